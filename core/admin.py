@@ -1,6 +1,7 @@
 from django.contrib import admin
 from leaflet.admin import LeafletGeoAdmin
-from core.models import Initiative, InitiativeReview
+from core.models import Initiative, InitiativeReview, TaskOutbox
 
 admin.site.register(Initiative, LeafletGeoAdmin)
-admin.site.register(InitiativeReview)
\ No newline at end of file
+admin.site.register(InitiativeReview)
+admin.site.register(TaskOutbox)
@@ -0,0 +1,23 @@
+"""
+Probe tasks of the `benchmark_task_queues` management command
+
+Not autodiscovered (only tasks.py modules are), production workers never
+load them. The workers measured by the benchmark import them when started
+with CELERY_BENCHMARK_TASKS=1 in their environment (see CELERY_INCLUDE in
+khadra/settings.py). The tasks are routed explicitly with apply_async(queue=...)
+"""
+import time
+
+from celery import shared_task
+
+
+@shared_task
+def benchmark_latency_probe_task(published_at):
+    """Return how long (seconds) the probe waited between publishing and execution."""
+    return time.time() - published_at
+
+
+@shared_task
+def benchmark_busy_task(duration):
+    """Keep a worker busy for `duration` seconds, stands for a notification fan-out."""
+    time.sleep(duration)
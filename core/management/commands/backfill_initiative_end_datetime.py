@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from core.models import Initiative
+
+
+class Command(BaseCommand):
+    """
+    Management command to (re)materialize Initiative.end_datetime
+
+    Initiative.save() keeps end_datetime equal to
+    scheduled_datetime + duration_days, but QuerySet.update() and raw SQL
+    bypass save(). Run this command after such bulk updates so the lifecycle
+    sweeper (core.tasks.sweep_initiative_lifecycle_task) completes
+    initiatives at the right time.
+
+    Rows are fixed in chunks (--chunk-size), each chunk in its own
+    transaction to keep locks short on big tables.
+    """
+
+    help = "Set Initiative.end_datetime to scheduled_datetime + duration_days where it is missing or stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of initiatives updated per transaction (default 1000)')
+
+    def handle(self, *args, **kwargs):
+        chunk_size = kwargs['chunk_size']
+        table = Initiative._meta.db_table
+        sql = f"""
+            UPDATE {table} SET end_datetime = scheduled_datetime + duration_days * INTERVAL '1 day'
+            WHERE id IN (
+                SELECT id FROM {table}
+                WHERE end_datetime IS DISTINCT FROM scheduled_datetime + duration_days * INTERVAL '1 day'
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+        """
+        total = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [chunk_size])
+                updated = cursor.rowcount
+            total += updated
+            if updated < chunk_size:
+                break
+
+        self.stdout.write(self.style.SUCCESS("Backfilled end_datetime of %s initiatives" % total))
@@ -0,0 +1,59 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from core.benchmark_tasks import benchmark_latency_probe_task, benchmark_busy_task
+
+
+class Command(BaseCommand):
+    """
+    Benchmark lifecycle task latency under a flood of fan-out work
+
+    Publishes --flood busy tasks (each one sleeping --busy-seconds, standing
+    for notification fan-out) then --probes latency probes and reports how
+    long the probes waited in the broker before a worker ran them.
+
+    The benchmark runs twice:
+    - shared: probes and flood on the 'notifications' queue, like when every
+      task ran on one queue.
+    - routed: probes on the 'lifecycle' queue, flood on 'notifications'.
+
+    Requires the workers of docker-compose.yml started with the probe tasks
+    (CELERY_BENCHMARK_TASKS=1 in .env.dev, see core/benchmark_tasks.py)
+    and a result backend, e.g:
+        docker-compose exec web python manage.py benchmark_task_queues
+
+    The flood is left in the broker when the command ends, purge it with
+        celery -A khadra purge -Q notifications
+    """
+
+    help = "Measure lifecycle queue latency while the notifications queue is flooded"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flood', type=int, default=2000, help='Number of busy tasks (default 2000)')
+        parser.add_argument('--busy-seconds', type=float, default=0.05, help='Duration of each busy task (default 0.05)')
+        parser.add_argument('--probes', type=int, default=20, help='Number of latency probes (default 20)')
+        parser.add_argument('--timeout', type=float, default=600, help='Seconds to wait for each probe (default 600)')
+
+    def measure(self, probe_queue, flood, busy_seconds, probes, timeout):
+        for _ in range(flood):
+            benchmark_busy_task.apply_async(args=[busy_seconds], queue='notifications')
+
+        results = []
+        for _ in range(probes):
+            # Queue profiles ignore results, the probes need theirs
+            results.append(benchmark_latency_probe_task.apply_async(args=[time.time()],
+                                                                    queue=probe_queue,
+                                                                    ignore_result=False))
+            time.sleep(0.05)
+        return sorted(result.get(timeout=timeout) for result in results)
+
+    def report(self, label, latencies):
+        p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+        self.stdout.write("%-8s probes=%d p50=%.3fs p95=%.3fs max=%.3fs" % (
+            label, len(latencies), statistics.median(latencies), p95, latencies[-1]))
+
+    def handle(self, *args, **kwargs):
+        options = (kwargs['flood'], kwargs['busy_seconds'], kwargs['probes'], kwargs['timeout'])
+        self.report('shared', self.measure('notifications', *options))
+        self.report('routed', self.measure('lifecycle', *options))
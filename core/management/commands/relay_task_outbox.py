@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.outbox import relay_task_outbox
+
+
+class Command(BaseCommand):
+    """
+    Management command running the task outbox relay (see core.outbox)
+
+    Publishes pending TaskOutbox messages to the Celery broker in batches
+    of --batch-size and sleeps --interval seconds whenever the outbox is
+    drained. Several relays can run in parallel.
+
+    Use --once to drain the outbox and exit (e.g: from a cron job).
+    """
+
+    help = "Publish pending task outbox messages to the Celery broker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size',
+            type=int,
+            default=settings.TASK_OUTBOX_RELAY_BATCH_SIZE,
+            help='Number of messages published per transaction')
+        parser.add_argument('--interval',
+            type=float,
+            default=settings.TASK_OUTBOX_RELAY_INTERVAL,
+            help='Seconds to wait when the outbox is drained')
+        parser.add_argument('--once',
+            action='store_true',
+            help='Drain the outbox and exit')
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        total = 0
+        while True:
+            published = relay_task_outbox(batch_size)
+            total += published
+            if published < batch_size:
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['interval'])
+
+        self.stdout.write(self.style.SUCCESS("Published %s task outbox messages" % total))
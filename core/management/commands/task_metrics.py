@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from core.task_metrics import get_metrics, reset_metrics
+
+
+class Command(BaseCommand):
+    """
+    Management command printing the celery task metrics (see core.task_metrics)
+
+    For each task: runs, failures, retries, run time, queue wait,
+    ETA drift (average and maximum, in milliseconds) and database queries.
+
+    A growing queue wait means workers can't keep up with the broker,
+    a growing ETA drift means delayed work fires late.
+    """
+
+    help = "Print a summary of celery task run time, queue wait, ETA drift, retries and queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('task_names', nargs='*', type=str, help='Task names (default: all registered tasks)')
+        parser.add_argument('--reset', action='store_true', help='Delete the metrics after printing them')
+
+    def handle(self, *args, **kwargs):
+        task_names = kwargs['task_names']
+        header = "%-55s %6s %5s %5s %17s %17s %17s %11s" % (
+            'task', 'runs', 'fail', 'retry', 'run ms avg/max', 'wait ms avg/max', 'drift ms avg/max', 'queries avg')
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for task_name, metrics in get_metrics(task_names).items():
+            if not metrics['runs'] and not metrics['eta_runs']:
+                continue
+            self.stdout.write("%-55s %6d %5d %5d %17s %17s %17s %11.1f" % (
+                task_name,
+                metrics['runs'],
+                metrics['failures'],
+                metrics['retries'],
+                "%.0f/%d" % (metrics['run_ms_avg'], metrics['run_ms_max']),
+                "%.0f/%d" % (metrics['queue_wait_ms_avg'], metrics['queue_wait_ms_max']),
+                "%.0f/%d" % (metrics['eta_drift_ms_avg'], metrics['eta_drift_ms_max']),
+                metrics['queries_avg'],
+            ))
+
+        if kwargs['reset']:
+            reset_metrics(task_names)
+            self.stdout.write(self.style.SUCCESS("Task metrics reset"))
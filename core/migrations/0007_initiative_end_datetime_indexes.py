@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_alter_initiativereview_options'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='initiative',
+            name='end_datetime',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the initiative ends, computed from the scheduled date and time and the duration', null=True, verbose_name='End date and time'),
+        ),
+        # Materialize end_datetime for existing initiatives, missing or stale,
+        # Initiative.save() keeps it up to date from now on
+        migrations.RunSQL(
+            sql="""
+                UPDATE core_initiative SET end_datetime = scheduled_datetime + duration_days * INTERVAL '1 day'
+                WHERE scheduled_datetime IS NOT NULL AND duration_days IS NOT NULL
+                    AND end_datetime IS DISTINCT FROM scheduled_datetime + duration_days * INTERVAL '1 day'
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='initiative',
+            index=models.Index(fields=['status', 'scheduled_datetime'], name='initiative_status_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='initiative',
+            index=models.Index(fields=['status', 'end_datetime'], name='initiative_status_end_idx'),
+        ),
+    ]
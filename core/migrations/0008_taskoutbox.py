@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-19 10:03
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_initiative_end_datetime_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_name', models.CharField(max_length=255, verbose_name='Task name')),
+                ('args', models.JSONField(blank=True, default=list, verbose_name='Arguments')),
+                ('kwargs', models.JSONField(blank=True, default=dict, verbose_name='Keyword arguments')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Publish attempts')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Created at')),
+            ],
+            options={
+                'verbose_name': 'Task outbox message',
+                'verbose_name_plural': 'Task outbox messages',
+            },
+        ),
+    ]
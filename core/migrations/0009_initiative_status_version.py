@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_taskoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='initiative',
+            name='status_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Status version'),
+        ),
+    ]
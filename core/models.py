@@ -17,6 +17,9 @@ class Initiative(models.Model):
         ('cancelled', _('Cancelled')),
     ]
     status = models.CharField(_('Status'), max_length=20, choices=STATUS_CHOICES, default='under_review')
+    # Incremented on every lifecycle transition, lifecycle tasks compare-and-set
+    # (status, status_version) so a transition happens exactly once (see core.tasks)
+    status_version = models.PositiveIntegerField(_('Status version'), default=0, editable=False)
 
     info = models.TextField(_('Information'), blank=True, help_text=_('Additional information about the intiative like requests or notes.'))
     city = models.ForeignKey(City, verbose_name=_('City'), on_delete=models.SET_NULL, null=True, blank=True)
@@ -41,11 +44,14 @@ class Initiative(models.Model):
         help_text=_('Number of days the initiative will last')
         )
     
+    # Always materialized from scheduled_datetime + duration_days in save()
+    # so the database can select the initiatives that ended (see core.tasks)
     end_datetime = models.DateTimeField(
         _('End date and time'),
-        help_text=_('When the initiative ends'),
+        help_text=_('When the initiative ends, computed from the scheduled date and time and the duration'),
         null=True,
-        blank=True
+        blank=True,
+        editable=False,
     )
     
     date_created = models.DateTimeField(_('Date created'), default=timezone.now)
@@ -58,12 +64,36 @@ class Initiative(models.Model):
     class Meta:
         verbose_name = _('Initiative')
         verbose_name_plural = _('Initiatives')
-    
-    def get_end_datetime(self):
-        """Calculate end_datetime if not set"""
-        if not self.end_datetime and self.scheduled_datetime:
+        indexes = [
+            # Lifecycle sweeps: "upcoming initiatives that should start now"
+            # and "upcoming/ongoing initiatives that should be completed now"
+            models.Index(fields=['status', 'scheduled_datetime'], name='initiative_status_start_idx'),
+            models.Index(fields=['status', 'end_datetime'], name='initiative_status_end_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Materialize end_datetime from scheduled_datetime + duration_days.
+
+        NOTE: QuerySet.update() bypasses this, run the
+        `backfill_initiative_end_datetime` command after bulk updates
+        of scheduled_datetime or duration_days.
+        """
+        self.end_datetime = self.compute_end_datetime()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'scheduled_datetime', 'duration_days'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'end_datetime'}
+        super().save(*args, **kwargs)
+
+    def compute_end_datetime(self):
+        """Return scheduled_datetime + duration_days (None if not scheduled)"""
+        if self.scheduled_datetime:
             return self.scheduled_datetime + timezone.timedelta(days=self.duration_days)
-        return self.end_datetime
+        return None
+
+    def get_end_datetime(self):
+        """Return end_datetime, computing it for unsaved instances"""
+        return self.end_datetime or self.compute_end_datetime()
 
 
 class InitiativeReview(models.Model):
@@ -94,3 +124,27 @@ class InitiativeReview(models.Model):
 
     def __str__(self):
         return f"initiative {self.pk} review"
+
+
+class TaskOutbox(models.Model):
+    """
+    Celery task waiting to be published to the broker.
+
+    Rows are written with core.outbox.enqueue_task() in the same transaction as
+    the model change that requires the task, so a task is never published for
+    a change that was rolled back, nor lost for a change that was committed.
+    They are published and deleted by the outbox relay (core.outbox.relay_task_outbox).
+    """
+    task_name = models.CharField(_('Task name'), max_length=255)
+    args = models.JSONField(_('Arguments'), default=list, blank=True)
+    kwargs = models.JSONField(_('Keyword arguments'), default=dict, blank=True)
+    attempts = models.PositiveIntegerField(_('Publish attempts'), default=0)
+    created_at = models.DateTimeField(_('Created at'), default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = _('Task outbox message')
+        verbose_name_plural = _('Task outbox messages')
+
+    def __str__(self):
+        return f"{self.task_name} {self.pk}"
+
@@ -0,0 +1,125 @@
+"""
+Transactional outbox for Celery task dispatch
+
+Purpose:
+--------
+Publishing a task straight from a view or a signal receiver has two problems:
+
+1. The task can reach a worker before the transaction that created its data
+   commits (or even when it rolls back).
+2. The caller blocks, or fails, when the broker (Redis) is slow or down.
+
+Instead, enqueue_task() writes the task to the TaskOutbox table in the
+caller's transaction, it never talks to the broker. The outbox relay
+(`python manage.py relay_task_outbox`) publishes pending rows in batches
+and deletes them.
+
+Delivery is at-least-once: a relay that crashes after publishing but before
+committing publishes its batch again, tasks enqueued here must be idempotent.
+
+A message that fails settings.TASK_OUTBOX_MAX_ATTEMPTS times (unknown task,
+arguments that can not be serialized...) is dead-lettered: it stays in the
+outbox for inspection (admin) but the relay no longer picks it, so it can
+not block the messages behind it.
+
+Usage:
+------
+    from core.outbox import enqueue_task
+    with transaction.atomic():
+        profile.save()
+        enqueue_task(generate_thumbnails_task, profile.id)
+"""
+import logging
+
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from kombu.exceptions import OperationalError
+from core.models import TaskOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_task(task, *args, **kwargs):
+    """
+    Write `task` to the outbox, it is published once the current transaction commits.
+
+    Args:
+        task (Task | str): Celery task or registered task name.
+        *args, **kwargs: JSON serializable task arguments.
+
+    Returns:
+        TaskOutbox: The created outbox message.
+    """
+    task_name = task if isinstance(task, str) else task.name
+    return TaskOutbox.objects.create(task_name=task_name, args=list(args), kwargs=kwargs)
+
+
+def enqueue_tasks(task, args_list):
+    """
+    Write one `task` message per arguments list of `args_list` to the outbox
+    with a single INSERT, see enqueue_task.
+
+    Returns:
+        list: The created outbox messages.
+    """
+    task_name = task if isinstance(task, str) else task.name
+    return TaskOutbox.objects.bulk_create([TaskOutbox(task_name=task_name, args=list(args)) for args in args_list])
+
+
+def publish(message):
+    """
+    Publish an outbox message to the broker without retrying.
+
+    Registered tasks are published through Task.apply_async() so
+    task_always_eager and task routes apply as usual.
+    """
+    task = current_app.tasks.get(message.task_name)
+    if task is not None:
+        task.apply_async(args=message.args, kwargs=message.kwargs, retry=False)
+    else:
+        current_app.send_task(message.task_name, args=message.args, kwargs=message.kwargs, retry=False)
+
+
+def relay_task_outbox(batch_size):
+    """
+    Publish one batch of pending outbox messages, oldest first, and delete them.
+
+    Safe to run in parallel: the batch is locked with FOR UPDATE SKIP LOCKED,
+    concurrent relays pick the next pending messages.
+
+    A message that can not be published stays in the outbox with its attempts
+    increased, up to settings.TASK_OUTBOX_MAX_ATTEMPTS (dead-lettered).
+    When the broker is unreachable the batch stops at the first failure
+    without counting an attempt, the messages are not at fault, they are
+    retried by the next call.
+
+    Returns:
+        int: Number of published messages.
+    """
+    published = []
+    failed = []
+    with transaction.atomic():
+        messages = (TaskOutbox.objects
+                    .filter(attempts__lt=settings.TASK_OUTBOX_MAX_ATTEMPTS)
+                    .select_for_update(skip_locked=True)
+                    .order_by('created_at', 'id')[:batch_size])
+        for message in messages:
+            try:
+                publish(message)
+            except OperationalError:
+                logger.warning("Broker unavailable, outbox message %s left pending", message.pk)
+                break
+            except Exception:
+                if message.attempts + 1 >= settings.TASK_OUTBOX_MAX_ATTEMPTS:
+                    logger.exception("Could not publish outbox message %s, dead-lettered", message.pk)
+                else:
+                    logger.exception("Could not publish outbox message %s", message.pk)
+                failed.append(message.pk)
+            else:
+                published.append(message.pk)
+
+        TaskOutbox.objects.filter(pk__in=published).delete()
+        TaskOutbox.objects.filter(pk__in=failed).update(attempts=F('attempts') + 1)
+    return len(published)
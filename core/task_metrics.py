@@ -0,0 +1,176 @@
+"""
+Celery task instrumentation
+
+Celery signal hooks recording, per task name:
+
+- runs, failures, retries
+- run time: time spent executing the task
+- queue wait: time between publishing (or the ETA for delayed tasks) and
+  execution, a growing queue wait means the broker has a backlog
+- ETA drift: how late tasks fire compared with their planned time, for ETA
+  tasks and for the lifecycle sweeper (compared with scheduled_datetime,
+  end_datetime and the end of the review period, see record_eta_drift)
+- database queries issued by the task
+
+Metrics are counters in the default cache (Redis) shared by all workers, they
+are read by `python manage.py task_metrics` and the TaskMetricsView endpoint.
+Durations are stored in milliseconds.
+
+The hooks are connected in CoreConfig.ready().
+"""
+import logging
+import time
+from datetime import datetime
+
+from celery import current_app
+from celery.signals import before_task_publish, task_prerun, task_postrun, task_retry
+from django.core.cache import cache
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'task_metrics'
+
+# Summed metrics, each one also keeps its maximum in '<metric>_max'
+TIMED_METRICS = ('run_ms', 'queue_wait_ms', 'eta_drift_ms', 'queries')
+COUNTERS = ('runs', 'failures', 'retries', 'eta_runs')
+
+# Task id -> (start time, query counter) of the tasks running in this process
+_running = {}
+
+
+class QueryCounter:
+    """Database execute wrapper counting the queries of a task"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _key(task_name, metric):
+    return f'{KEY_PREFIX}:{task_name}:{metric}'
+
+
+def _incr(task_name, metric, value=1):
+    key = _key(task_name, metric)
+    cache.add(key, 0, timeout=None)
+    cache.incr(key, int(value))
+
+
+def _observe(task_name, metric, value, maximum=None):
+    """
+    Add `value` to `metric` and keep its maximum (best effort, not atomic),
+    `maximum` is the largest of the values summed in `value` if several.
+    """
+    _incr(task_name, metric, value)
+    maximum = value if maximum is None else maximum
+    max_key = _key(task_name, f'{metric}_max')
+    if maximum > (cache.get(max_key) or 0):
+        cache.set(max_key, int(maximum), timeout=None)
+
+
+def record_eta_drift(task_name, seconds):
+    """
+    Record that something planned for a given time happened `seconds` late.
+
+    Called from task bodies, a cache failure is logged and never fails the task.
+    """
+    record_eta_drifts(task_name, [seconds])
+
+
+def record_eta_drifts(task_name, seconds):
+    """
+    Record that several things planned for given times happened `seconds`
+    (list) late, with as many cache calls as a single one.
+
+    Called from task bodies, a cache failure is logged and never fails the task.
+    """
+    if not seconds:
+        return
+    drifts = [max(drift, 0) * 1000 for drift in seconds]
+    try:
+        _incr(task_name, 'eta_runs', len(drifts))
+        _observe(task_name, 'eta_drift_ms', sum(drifts), maximum=max(drifts))
+    except Exception:
+        logger.warning("Could not record ETA drift of %s", task_name, exc_info=True)
+
+
+def get_task_names():
+    """Names of the project's registered tasks (celery built-ins excluded)"""
+    return sorted(name for name in current_app.tasks if not name.startswith('celery.'))
+
+
+def get_metrics(task_names=None):
+    """
+    Return the recorded metrics of `task_names` (default: all registered tasks).
+
+    Returns:
+        dict: task name -> metrics dict, with 'avg' values for every summed metric.
+    """
+    task_names = task_names or get_task_names()
+    metrics = [*COUNTERS] + [m for metric in TIMED_METRICS for m in (metric, f'{metric}_max')]
+    values = cache.get_many([_key(name, metric) for name in task_names for metric in metrics])
+
+    summary = {}
+    for name in task_names:
+        task_metrics = {metric: values.get(_key(name, metric), 0) for metric in metrics}
+        for metric in TIMED_METRICS:
+            runs = task_metrics['eta_runs'] if metric == 'eta_drift_ms' else task_metrics['runs']
+            task_metrics[f'{metric}_avg'] = task_metrics[metric] / runs if runs else 0
+        summary[name] = task_metrics
+    return summary
+
+
+def reset_metrics(task_names=None):
+    """Delete the recorded metrics of `task_names` (default: all registered tasks)"""
+    task_names = task_names or get_task_names()
+    metrics = [*COUNTERS] + [m for metric in TIMED_METRICS for m in (metric, f'{metric}_max')]
+    cache.delete_many([_key(name, metric) for name in task_names for metric in metrics])
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    """Add the publishing time to the message headers, read back as task.request.published_at"""
+    if headers is not None:
+        headers.setdefault('published_at', time.time())
+
+
+@task_prerun.connect
+def start_task_metrics(task_id=None, task=None, **kwargs):
+    now = time.time()
+    counter = QueryCounter()
+    connection.execute_wrappers.append(counter)
+    _running[task_id] = (time.monotonic(), counter)
+
+    eta = getattr(task.request, 'eta', None)
+    eta = datetime.fromisoformat(eta).timestamp() if isinstance(eta, str) else None
+    if eta is not None:
+        record_eta_drift(task.name, now - eta)
+
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is not None:
+        _observe(task.name, 'queue_wait_ms', max(now - max(published_at, eta or 0), 0) * 1000)
+
+
+@task_postrun.connect
+def finish_task_metrics(task_id=None, task=None, state=None, **kwargs):
+    started = _running.pop(task_id, None)
+    if started is None:
+        return
+    start, counter = started
+    if counter in connection.execute_wrappers:
+        connection.execute_wrappers.remove(counter)
+
+    _incr(task.name, 'runs')
+    if state == 'FAILURE':
+        _incr(task.name, 'failures')
+    _observe(task.name, 'run_ms', (time.monotonic() - start) * 1000)
+    _observe(task.name, 'queries', counter.count)
+
+
+@task_retry.connect
+def count_task_retry(sender=None, **kwargs):
+    _incr(sender.name, 'retries')
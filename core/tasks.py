@@ -1,21 +1,82 @@
+from datetime import timedelta
+from functools import partial
+
 from celery import shared_task
+from django.db import connection, transaction
+from django.db.models import F
 from django.utils import timezone
 from django.conf import settings
-from core.models import Initiative
+from core.models import Initiative, InitiativeReview
+from core.task_metrics import record_eta_drifts
 from notifications.signals import ( initiative_approved_signal,
                                     initiative_review_failed_signal,
                                     initiative_started_signal,
                                     initiative_completed_signal)
 
 
+def get_review_outcome(approve_count, reject_count):
+    """
+    Return the (status, reason) outcome of an initiative review period.
+
+    status is 'upcoming' when the initiative is approved and 'review_failed' otherwise,
+    reason is None for approved initiatives, 'lack_of_reviews' or 'rejected_by_managers'.
+
+    NOTE: Keep in sync with the CASE expression in `_evaluate_due_initiatives`.
+    """
+    # Not enough reviews -> review failed
+    if approve_count + reject_count < settings.MIN_INITIATIVE_REVIEWS_REQUIRED:
+        return 'review_failed', 'lack_of_reviews'
+    # Approved by majority or reviews are equal -> change status to 'upcoming'
+    if approve_count >= reject_count:
+        return 'upcoming', None
+    # More rejects than approves -> review failed
+    return 'review_failed', 'rejected_by_managers'
+
+
+def get_idempotency_key(initiative_id, status, status_version):
+    """
+    Return the idempotency key of an initiative transition.
+
+    The key identifies one transition (initiative, target status, resulting
+    status_version), notifications created for it are stored with this key
+    so a transition never notifies twice.
+    """
+    return f"initiative:{initiative_id}:{status}:{status_version}"
+
+
+def transition_initiative(initiative, from_statuses, to_status):
+    """
+    Compare-and-set the status of `initiative` to `to_status`.
+
+    The UPDATE only matches if the row is still in one of `from_statuses` and its
+    status_version is the one that was read, so among concurrent executions
+    (retries, re-deliveries, duplicates, the sweeper) exactly one wins.
+    On success `initiative` is updated in place.
+
+    Returns:
+        bool: True if this call performed the transition.
+    """
+    if initiative.status not in from_statuses:
+        return False
+    updated = Initiative.objects.filter(
+        id=initiative.id,
+        status=initiative.status,
+        status_version=initiative.status_version,
+    ).update(status=to_status, status_version=F('status_version') + 1)
+    if updated:
+        initiative.status = to_status
+        initiative.status_version += 1
+    return bool(updated)
+
+
 @shared_task
 def evaluate_initiative_reviews_task(initiative_id):
     """
     Evaluates the overall outcome of an initiative's review period.
 
-    This task is designed to be executed after the designated review period 
-    for an initiative has ended (settings.settings.INITIATIVE_REVIEW_DURATION) 
-    and it's scheduled in CreateInitiaiveView.
+    This task evaluates a single initiative on demand (e.g. re-running an evaluation
+    from a shell). Initiatives whose review period (settings.INITIATIVE_REVIEW_DURATION)
+    has ended are evaluated in bulk by `sweep_initiative_lifecycle_task`.
 
     Its primary purpose is to:
     1.  Retrieve the initiative specified by `initiative_id`.
@@ -27,65 +88,49 @@ def evaluate_initiative_reviews_task(initiative_id):
             is met, the status is set to 'upcoming'.
         *   In all other cases (e.g., more 'refuse' votes or exactly equal votes), the status is set to 
             'review_failed'.
-    4.  Saves the updated initiative status to the database.
+    4.  Saves the updated initiative status to the database (see `transition_initiative`).
     5. Emit proper custom signal from notifications.signals
 
-    This task ensures the review outcome is processed asynchronously, allowing the system to handle 
-    potentially large numbers of initiatives and reviews without blocking user interactions or other 
-    processes. It's typically scheduled to run automatically after settings.INITIATIVE_REVIEW_DURATION
-    ends.
+    Idempotent: only initiatives still 'under_review' are evaluated and the status
+    is changed with a compare-and-set, so retried, re-delivered or duplicated
+    executions emit the signals only once.
+
+    Transitions to 'ongoing' and 'completed' are not scheduled from here, they are picked
+    up by `sweep_initiative_lifecycle_task` once they are due.
     """
     try:
         initiative = Initiative.objects.get(id=initiative_id)
-        reviews = initiative.reviews.all()
-        
-        approve_count = reviews.filter(vote='approve').count()
-        refuse_count = reviews.filter(vote='reject').count()
-        total_reviews = approve_count + refuse_count
-
-        # Not enough reviews -> review failed
-        if total_reviews < settings.MIN_INITIATIVE_REVIEWS_REQUIRED:
-            initiative.status = 'review_failed'
-            # Emit initiative review failed signal with 'lack_of_reviews' reason
-            initiative_review_failed_signal.send(sender=Initiative, 
-                                                instance=initiative, 
-                                                reason='lack_of_reviews')
-        
-        # Approved by majority or reviews are equal -> change status to 'upcoming'
-        elif approve_count >= refuse_count:
-            initiative.status = 'upcoming'
-            initiative.save()
+    except Initiative.DoesNotExist:
+        # Missing initiative do nothing
+        return
+
+    # Only initiatives still under review are evaluated, re-running the task is a no-op
+    if initiative.status != 'under_review':
+        return
+
+    reviews = initiative.reviews.all()
+    approve_count = reviews.filter(vote='approve').count()
+    refuse_count = reviews.filter(vote='reject').count()
+    status, reason = get_review_outcome(approve_count, refuse_count)
+
+    with transaction.atomic():
+        if not transition_initiative(initiative, ['under_review'], status):
+            # A concurrent execution (or the sweeper) evaluated it first
+            return
+        idempotency_key = get_idempotency_key(initiative.id, status, initiative.status_version)
+
+        if status == 'upcoming':
             # Emit initiative approved signal for notifications
-            initiative_approved_signal.send(sender=Initiative, instance=initiative,)
-            # Schedule transition to 'ongoing' at the initiative's scheduled start time
-            if initiative.scheduled_datetime > timezone.now():
-                transition_initiative_to_ongoing_task.apply_async(
-                    args=[initiative.id],
-                    eta=initiative.scheduled_datetime
-                )
-
-            # Schedule transition to 'completed' at the initiative's calculated end time
-            # Ensure get_end_datetime() returns a timezone-aware datetime
-            end_datetime = initiative.get_end_datetime()
-            if end_datetime and end_datetime > timezone.now():
-                transition_initiative_to_completed_task.apply_async(
-                    args=[initiative.id],
-                    eta=end_datetime
-                )
-            
-        # More rejects than approves -> review failed
+            initiative_approved_signal.send(sender=Initiative,
+                                            instance=initiative,
+                                            idempotency_key=idempotency_key)
         else:
-            initiative.status = 'review_failed'
-            # Emit initiative review failed signal with 'rejected_by_managers' reason
+            # Emit initiative review failed signal with 'lack_of_reviews'
+            # or 'rejected_by_managers' reason
             initiative_review_failed_signal.send(sender=Initiative, 
                                                 instance=initiative, 
-                                                reason='rejected_by_managers')
- 
-        initiative.save()
-        
-    except Initiative.DoesNotExist:
-        # Missing initiative do nothing
-        pass
+                                                reason=reason,
+                                                idempotency_key=idempotency_key)
 
 
 @shared_task
@@ -93,26 +138,30 @@ def transition_initiative_to_ongoing_task(initiative_id):
     """
     Transitions an initiative's status to 'ongoing'.
 
-    This task is intended to be scheduled to run at the initiative's
-    `scheduled_datetime`. It checks if the initiative is still in the
-    'upcoming' status and eligible for transition.
+    Due initiatives are transitioned in bulk by `sweep_initiative_lifecycle_task`,
+    this task transitions a single initiative on demand. It checks if the
+    initiative is still in the 'upcoming' status and eligible for transition.
+
+    Idempotent: retried, re-delivered or duplicated executions emit the
+    initiative started signal only once (see `transition_initiative`).
 
     Args:
         initiative_id (int): The ID of the Initiative to transition.
     """
     try:
         initiative = Initiative.objects.get(id=initiative_id)
+    except Initiative.DoesNotExist:
+        # Missing initiative do nothing
+        return
 
+    with transaction.atomic():
         # Only transition if it's still 'upcoming'
-        if initiative.status == 'upcoming':
-            initiative.status = 'ongoing'
-            initiative.save()
+        if transition_initiative(initiative, ['upcoming'], 'ongoing'):
             # Emit initiative started signal for notifications
-            initiative_started_signal.send(sender=Initiative, instance=initiative,)
-    
-    except Initiative.DoesNotExist:
-        # Missing initiative do nothing
-        pass
+            initiative_started_signal.send(sender=Initiative,
+                                        instance=initiative,
+                                        idempotency_key=get_idempotency_key(initiative.id, 'ongoing',
+                                                                            initiative.status_version))
 
 
 @shared_task
@@ -120,24 +169,180 @@ def transition_initiative_to_completed_task(initiative_id):
     """
     Transitions an initiative's status to 'completed'.
 
-    This task is intended to be scheduled to run at the initiative's
-    end time (obtained via `initiative.get_end_datetime()`). It checks
-    if the initiative is in 'ongoing' or 'upcoming' status and eligible
-    for completion.
+    Due initiatives are completed in bulk by `sweep_initiative_lifecycle_task`,
+    this task completes a single initiative on demand. It checks if the
+    initiative is in 'ongoing' or 'upcoming' status and eligible for completion.
+
+    Idempotent: retried, re-delivered or duplicated executions emit the
+    initiative completed signal only once (see `transition_initiative`).
 
     Args:
         initiative_id (int): The ID of the Initiative to transition.
     """
     try:
         initiative = Initiative.objects.get(id=initiative_id)
+    except Initiative.DoesNotExist:
+        # Missing initiative do nothing
+        return
 
+    with transaction.atomic():
         # Transition if it's 'ongoing' or still 'upcoming' (maybe it started late)
-        if initiative.status in ['ongoing', 'upcoming']:
-            initiative.status = 'completed'
-            initiative.save()
+        if transition_initiative(initiative, ['ongoing', 'upcoming'], 'completed'):
             # Emit initiative completed signal for notifications
-            initiative_completed_signal.send(sender=Initiative, instance=initiative,)
+            initiative_completed_signal.send(sender=Initiative,
+                                            instance=initiative,
+                                            idempotency_key=get_idempotency_key(initiative.id, 'completed',
+                                                                                initiative.status_version))
+
+
+def _evaluate_due_initiatives(now, chunk_size):
+    """
+    Evaluate one chunk of initiatives whose review period has ended.
+
+    Locks the chunk (skipping rows locked by a concurrent sweep), tallies the votes
+    of all the chunk's initiatives with one grouped aggregate and sets the outcome
+    with a single UPDATE ... RETURNING.
+
+    Returns:
+        list: (initiative_id, status_version, status, reason) tuples of the evaluated initiatives.
+    """
+    initiatives = Initiative._meta.db_table
+    reviews = InitiativeReview._meta.db_table
+    sql = f"""
+        WITH due AS (
+            SELECT id FROM {initiatives}
+            WHERE status = 'under_review' AND date_created <= %s
+            ORDER BY date_created
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), tally AS (
+            SELECT due.id,
+                   COUNT(r.id) FILTER (WHERE r.vote = 'approve') AS approve_count,
+                   COUNT(r.id) FILTER (WHERE r.vote = 'reject') AS reject_count
+            FROM due LEFT JOIN {reviews} r ON r.initiative_id = due.id
+            GROUP BY due.id
+        )
+        UPDATE {initiatives} AS i
+        SET status = CASE
+            WHEN t.approve_count + t.reject_count < %s THEN 'review_failed'
+            WHEN t.approve_count >= t.reject_count THEN 'upcoming'
+            ELSE 'review_failed'
+        END,
+        status_version = i.status_version + 1
+        FROM tally t
+        WHERE i.id = t.id
+        RETURNING i.id, i.status_version, t.approve_count, t.reject_count
+    """
+    review_ended_before = now - timedelta(days=settings.INITIATIVE_REVIEW_DURATION)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [review_ended_before, chunk_size, settings.MIN_INITIATIVE_REVIEWS_REQUIRED])
+        rows = cursor.fetchall()
+    return [(initiative_id, status_version, *get_review_outcome(approve_count, reject_count))
+            for initiative_id, status_version, approve_count, reject_count in rows]
+
+
+def _transition_due_initiatives(from_statuses, to_status, due_column, now, chunk_size):
+    """
+    Move one chunk of initiatives in `from_statuses` whose `due_column` is in the
+    past to `to_status` with a single UPDATE ... RETURNING.
+
+    Rows locked by a concurrent sweep are skipped, they belong to that sweep.
+
+    Returns:
+        dict: status_version of the transitioned initiatives by id.
+    """
+    initiatives = Initiative._meta.db_table
+    sql = f"""
+        UPDATE {initiatives} SET status = %s, status_version = status_version + 1
+        WHERE id IN (
+            SELECT id FROM {initiatives}
+            WHERE status = ANY(%s) AND {due_column} <= %s
+            ORDER BY {due_column}
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, status_version
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [to_status, list(from_statuses), now, chunk_size])
+        return dict(cursor.fetchall())
+
+
+@shared_task
+def sweep_initiative_lifecycle_task():
+    """
+    Periodic (celery beat) task moving every due initiative to its next status.
+
+    Replaces per-initiative ETA tasks: nothing waits in the broker for days or weeks,
+    the database is the schedule, so transitions survive worker restarts and broker
+    flushes and broker memory does not grow with the number of initiatives.
+
+    Each run:
+    1.  Evaluates initiatives whose review period (settings.INITIATIVE_REVIEW_DURATION)
+        has ended, see `get_review_outcome` for the rules.
+    2.  Completes 'upcoming' and 'ongoing' initiatives whose `end_datetime` has passed.
+        Runs before step 3 so an initiative that is already over is only completed.
+    3.  Starts 'upcoming' initiatives whose `scheduled_datetime` has passed.
+
+    Every step works in chunks of settings.INITIATIVE_LIFECYCLE_SWEEP_CHUNK_SIZE,
+    each chunk in its own transaction: rows are moved with one set-based
+    UPDATE ... RETURNING and the notification signals are emitted for the returned rows
+    before the chunk commits, so a failing chunk is retried as a whole on the next run.
+
+    How late every initiative was moved compared with its due time is recorded as
+    this task's ETA drift (see core.task_metrics), once per chunk after it commits
+    so no cache call is made while the rows are locked.
+
+    Returns:
+        dict: number of initiatives moved per target status.
+    """
+    now = timezone.now()
+    chunk_size = settings.INITIATIVE_LIFECYCLE_SWEEP_CHUNK_SIZE
+    summary = {'evaluated': 0, 'completed': 0, 'ongoing': 0}
+
+    while True:
+        with transaction.atomic():
+            outcomes = _evaluate_due_initiatives(now, chunk_size)
+            initiatives = Initiative.objects.select_related('created_by').in_bulk(
+                [initiative_id for initiative_id, *_outcome in outcomes])
+            drifts = []
+            for initiative_id, status_version, status, reason in outcomes:
+                review_ended = initiatives[initiative_id].date_created + timedelta(days=settings.INITIATIVE_REVIEW_DURATION)
+                drifts.append((now - review_ended).total_seconds())
+                idempotency_key = get_idempotency_key(initiative_id, status, status_version)
+                if status == 'upcoming':
+                    initiative_approved_signal.send(sender=Initiative,
+                                                    instance=initiatives[initiative_id],
+                                                    idempotency_key=idempotency_key)
+                else:
+                    initiative_review_failed_signal.send(sender=Initiative,
+                                                        instance=initiatives[initiative_id],
+                                                        reason=reason,
+                                                        idempotency_key=idempotency_key)
+            transaction.on_commit(partial(record_eta_drifts, sweep_initiative_lifecycle_task.name, drifts))
+        summary['evaluated'] += len(outcomes)
+        if len(outcomes) < chunk_size:
+            break
+
+    transitions = [
+        (['upcoming', 'ongoing'], 'completed', 'end_datetime', initiative_completed_signal),
+        (['upcoming'], 'ongoing', 'scheduled_datetime', initiative_started_signal),
+    ]
+    for from_statuses, to_status, due_column, signal in transitions:
+        while True:
+            with transaction.atomic():
+                versions = _transition_due_initiatives(from_statuses, to_status, due_column, now, chunk_size)
+                drifts = []
+                for initiative in Initiative.objects.select_related('created_by').filter(id__in=versions):
+                    drifts.append((now - getattr(initiative, due_column)).total_seconds())
+                    signal.send(sender=Initiative,
+                                instance=initiative,
+                                idempotency_key=get_idempotency_key(initiative.id, to_status,
+                                                                    versions[initiative.id]))
+                transaction.on_commit(partial(record_eta_drifts, sweep_initiative_lifecycle_task.name, drifts))
+            summary[to_status] += len(versions)
+            if len(versions) < chunk_size:
+                break
+
+    return summary
 
-    except Initiative.DoesNotExist:
-        # Missing initiative do nothing
-        pass
\ No newline at end of file
@@ -3,8 +3,11 @@ from io import StringIO
 from django.conf import settings
 from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
+from django.utils import timezone
 from users.tests.test_utils import create_new_user
 from users.models import City, Country, Profile
+from core.models import Initiative
+from core.tests.test_utils import create_initiative
 
 
 # Ovveriding prod spatial data with light weigth test layers to speed up tests
@@ -88,3 +91,58 @@ class LoadSpatialDataTestCase(TestCase):
         # Ensure the country and city have been replaced (different PKs)
         self.assertNotEqual(profile_achref.country.pk, algeria.pk)
         self.assertNotEqual(profile_achref.city.pk, annaba.pk)
+
+
+# Ovveriding prod spatial data with light weigth test layers to speed up tests
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS)
+class BackfillInitiativeEndDatetimeTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(self):
+        call_command('load_spatial_layers', 'DZ')
+        self.annaba_city = City.objects.get(name='Annaba')
+        self.point_in_annaba = self.annaba_city.get_random_location_point()
+        self.initiative_creator = create_new_user(email='initiative_starter_user@gmail.com',
+                                username='initiative_starter_user',
+                                password='qsdflkjlkj',
+                                account_type='manager',
+                                phone_number='+213555447755', 
+                                bio='Some good bio',
+                                city=self.annaba_city,
+                                geo_location=self.point_in_annaba,
+                                )
+
+    # Test that saving an initiative materializes its end_datetime
+    def test_end_datetime_materialized_on_save(self):
+        initiative = create_initiative(created_by=self.initiative_creator,
+                                        info="good initiative",
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba)
+        initiative.duration_days = 4
+        initiative.save(update_fields=['duration_days'])
+        initiative.refresh_from_db()
+
+        self.assertEqual(initiative.end_datetime, initiative.scheduled_datetime + timezone.timedelta(days=4))
+
+    # Test that the command fixes end_datetime after updates bypassing save()
+    def test_backfill_missing_and_stale_end_datetime(self):
+        missing = create_initiative(created_by=self.initiative_creator,
+                                        info="missing end",
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba)
+        stale = create_initiative(created_by=self.initiative_creator,
+                                        info="stale end",
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba)
+        Initiative.objects.filter(id=missing.id).update(end_datetime=None)
+        Initiative.objects.filter(id=stale.id).update(duration_days=3)
+
+        out = StringIO()
+        call_command('backfill_initiative_end_datetime', '--chunk-size', '1', stdout=out)
+        missing.refresh_from_db()
+        stale.refresh_from_db()
+
+        self.assertIn("Backfilled end_datetime of 2 initiatives", out.getvalue())
+        self.assertEqual(missing.end_datetime, missing.scheduled_datetime + timezone.timedelta(days=1))
+        self.assertEqual(stale.end_datetime, stale.scheduled_datetime + timezone.timedelta(days=3))
+
@@ -15,7 +15,8 @@ from core.tests.test_utils import create_initiative
 UserModel = get_user_model()
 
 # Ovveriding prod spatial data with light weigth test layers to speed up tests
-@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS)
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES)
 class InitiativesTestCase(TestCase):
 
     @classmethod
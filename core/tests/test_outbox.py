@@ -0,0 +1,90 @@
+from unittest import mock
+
+from django.conf import settings
+from django.db import transaction
+from django.test import TestCase, override_settings
+from kombu.exceptions import OperationalError
+from core.models import TaskOutbox
+from core.outbox import enqueue_task, relay_task_outbox
+from core.tasks import sweep_initiative_lifecycle_task
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class TaskOutboxTestCase(TestCase):
+
+    def test_enqueue_is_part_of_the_caller_transaction(self):
+        """
+        Tests that a task enqueued in a transaction that rolls back
+        is never written to the outbox.
+        """
+        try:
+            with transaction.atomic():
+                enqueue_task(sweep_initiative_lifecycle_task)
+                raise ValueError('rollback')
+        except ValueError:
+            pass
+
+        enqueue_task('core.tasks.transition_initiative_to_ongoing_task', 42)
+
+        self.assertEqual(TaskOutbox.objects.count(), 1)
+        message = TaskOutbox.objects.get()
+        self.assertEqual(message.task_name, 'core.tasks.transition_initiative_to_ongoing_task')
+        self.assertEqual(message.args, [42])
+
+    def test_relay_publishes_in_batches_and_deletes_published_messages(self):
+        """
+        Tests that the relay publishes pending messages oldest first,
+        at most `batch_size` per call, and deletes them.
+        """
+        for initiative_id in range(3):
+            enqueue_task('core.tasks.transition_initiative_to_ongoing_task', initiative_id)
+
+        with mock.patch('core.outbox.publish') as publish:
+            first_batch = relay_task_outbox(batch_size=2)
+            second_batch = relay_task_outbox(batch_size=2)
+
+        published_args = [call.args[0].args for call in publish.call_args_list]
+        self.assertEqual(first_batch, 2)
+        self.assertEqual(second_batch, 1)
+        self.assertEqual(published_args, [[0], [1], [2]])
+        self.assertFalse(TaskOutbox.objects.exists())
+
+    def test_relay_keeps_messages_when_broker_is_down(self):
+        """
+        Tests that messages stay in the outbox when the broker is unreachable
+        and that the relay stops at the first failure.
+        """
+        first = enqueue_task('core.tasks.transition_initiative_to_ongoing_task', 1)
+        second = enqueue_task('core.tasks.transition_initiative_to_ongoing_task', 2)
+
+        with mock.patch('core.outbox.publish', side_effect=OperationalError) as publish:
+            published = relay_task_outbox(batch_size=10)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(published, 0)
+        self.assertEqual(publish.call_count, 1)
+        # The broker is at fault, not the messages
+        self.assertEqual(first.attempts, 0)
+        self.assertEqual(second.attempts, 0)
+
+    @override_settings(TASK_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failing_messages_are_dead_lettered_and_do_not_block_the_relay(self):
+        """
+        Tests that messages failing TASK_OUTBOX_MAX_ATTEMPTS times are skipped,
+        and kept, so a full batch of them does not stop the relay.
+        """
+        broken = [enqueue_task('core.tasks.unknown_task', index) for index in range(2)]
+        valid = enqueue_task('core.tasks.transition_initiative_to_ongoing_task', 1)
+
+        def publish(message):
+            if message.task_name == 'core.tasks.unknown_task':
+                raise ValueError('Can not publish')
+
+        with mock.patch('core.outbox.publish', side_effect=publish):
+            self.assertEqual(relay_task_outbox(batch_size=2), 0)
+            self.assertEqual(relay_task_outbox(batch_size=2), 0)
+            self.assertEqual(relay_task_outbox(batch_size=2), 1)
+
+        self.assertFalse(TaskOutbox.objects.filter(pk=valid.pk).exists())
+        self.assertEqual(list(TaskOutbox.objects.order_by('id').values_list('attempts', flat=True)), [2, 2])
@@ -0,0 +1,119 @@
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from users.models import City
+from users.tests.test_utils import create_new_user
+from core.tasks import sweep_initiative_lifecycle_task
+from core.task_metrics import finish_task_metrics, get_metrics, start_task_metrics
+from core.tests.test_utils import create_initiative
+
+
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES)
+class TaskMetricsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(self):
+        call_command('load_spatial_layers', 'DZ')
+        self.annaba_city = City.objects.get(name='Annaba')
+        self.point_in_annaba = self.annaba_city.get_random_location_point()
+        self.staff_user = create_new_user(email='staff_user@gmail.com',
+                                username='staff_user',
+                                password='qsdflkjlkj',
+                                phone_number='+213555447755',
+                                bio='Some good bio',
+                                city=self.annaba_city,
+                                geo_location=self.point_in_annaba,
+                                )
+        self.staff_user.is_staff = True
+        self.staff_user.save()
+        self.normal_user = create_new_user(email='normal_user@gmail.com',
+                                username='normal_user',
+                                password='qsdflkjlkj',
+                                phone_number='+213555447756',
+                                bio='Some good bio',
+                                city=self.annaba_city,
+                                geo_location=self.point_in_annaba,
+                                )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_task_run_is_recorded(self):
+        """
+        Tests that running a task records its run, run time and database queries.
+        """
+        sweep_initiative_lifecycle_task.apply()
+        sweep_initiative_lifecycle_task.apply()
+
+        metrics = get_metrics([sweep_initiative_lifecycle_task.name])[sweep_initiative_lifecycle_task.name]
+        self.assertEqual(metrics['runs'], 2)
+        self.assertEqual(metrics['failures'], 0)
+        self.assertGreater(metrics['queries'], 0)
+        self.assertGreaterEqual(metrics['run_ms_max'], 0)
+
+    def test_queue_wait_and_eta_drift_are_recorded(self):
+        """
+        Tests that a task published 60 seconds ago with an ETA 30 seconds ago
+        waited 30 seconds in the queue and fired 30 seconds late.
+        """
+        now = timezone.now()
+        task = SimpleNamespace(name='metrics_probe', request=SimpleNamespace(
+            eta=(now - timezone.timedelta(seconds=30)).isoformat(),
+            published_at=time.time() - 60))
+        start_task_metrics(task_id='probe', task=task)
+        finish_task_metrics(task_id='probe', task=task, state='SUCCESS')
+
+        metrics = get_metrics(['metrics_probe'])['metrics_probe']
+        self.assertEqual(metrics['runs'], 1)
+        self.assertEqual(metrics['eta_runs'], 1)
+        self.assertAlmostEqual(metrics['queue_wait_ms'], 30000, delta=1000)
+        self.assertAlmostEqual(metrics['eta_drift_ms'], 30000, delta=1000)
+
+    def test_sweeper_eta_drift_recorded_after_commit(self):
+        """
+        Tests that the sweeper records how late every initiative was moved,
+        once the chunk has committed.
+        """
+        for hours in (1, 2):
+            initiative = create_initiative(created_by=self.staff_user,
+                                            info=f'Started {hours} hours ago',
+                                            city=self.annaba_city,
+                                            geo_location=self.point_in_annaba,
+                                            scheduled_datetime=timezone.now() - timezone.timedelta(hours=hours))
+            initiative.status = 'upcoming'
+            initiative.save()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            sweep_initiative_lifecycle_task()
+        name = sweep_initiative_lifecycle_task.name
+        self.assertEqual(get_metrics([name])[name]['eta_runs'], 0)
+
+        for callback in callbacks:
+            callback()
+        metrics = get_metrics([name])[name]
+        self.assertEqual(metrics['eta_runs'], 2)
+        self.assertGreaterEqual(metrics['eta_drift_ms_max'], 2 * 3600 * 1000)
+        self.assertGreaterEqual(metrics['eta_drift_ms'], 3 * 3600 * 1000)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        """
+        Tests that the metrics endpoint is served to staff users only.
+        """
+        sweep_initiative_lifecycle_task.apply()
+        client = Client()
+
+        client.login(username='normal_user', password='qsdflkjlkj')
+        response = client.get(reverse('task-metrics'))
+        self.assertEqual(response.status_code, 403)
+
+        client.login(username='staff_user', password='qsdflkjlkj')
+        response = client.get(reverse('task-metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'khadra_task_runs_total{{task="{sweep_initiative_lifecycle_task.name}"}} 1')
@@ -1,16 +1,20 @@
 from django.utils import timezone
 from django.core.management import call_command
-from django.test import Client, TestCase
+from django.conf import settings
+from django.test import Client, TestCase, override_settings
 from users.models import City
 from users.tests.test_utils import create_new_user
 from core.models import Initiative
 from core.tests.test_utils import create_initiative, create_multiple_initiative_reviews
+from notifications.models import Notification
 from core.tasks import (evaluate_initiative_reviews_task, 
                         transition_initiative_to_ongoing_task, 
-                        transition_initiative_to_completed_task)
+                        transition_initiative_to_completed_task,
+                        sweep_initiative_lifecycle_task)
 
 
 
+@override_settings(CACHES=settings.TEST_CACHES)
 class CeleryTasksTestCase(TestCase):
 
     @classmethod
@@ -190,5 +194,107 @@ class CeleryTasksTestCase(TestCase):
         initiative.refresh_from_db()
         self.assertEqual( initiative.status, 'completed')
 
-    
-        
+    def test_sweep_evaluates_initiatives_after_review_period(self):
+        """
+        Tests that the lifecycle sweeper evaluates all initiatives whose review
+        period has ended and leaves the ones still under review untouched.
+        """
+        review_ended = timezone.now() - timezone.timedelta(days=8)
+
+        approved = create_initiative(created_by=self.initiative_creator,
+                                        info="approved initiative",
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba)
+        create_multiple_initiative_reviews(initiative=approved,
+                                                num_reviews=6,
+                                                base_username='active',
+                                                vote_type='approve',
+                                                city=self.annaba_city,
+                                                geo_location=self.point_in_annaba)
+
+        rejected = create_initiative(created_by=self.initiative_creator,
+                                        info="rejected initiative",
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba)
+        create_multiple_initiative_reviews(initiative=rejected,
+                                                num_reviews=6,
+                                                base_username='lazy',
+                                                vote_type='reject',
+                                                city=self.annaba_city,
+                                                geo_location=self.point_in_annaba)
+
+        # No reviews at all
+        ignored = create_initiative(created_by=self.initiative_creator,
+                                        info="ignored initiative",
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba)
+
+        # Still in its review period
+        still_under_review = create_initiative(created_by=self.initiative_creator,
+                                        info="fresh initiative",
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba)
+
+        Initiative.objects.filter(id__in=[approved.id, rejected.id, ignored.id]).update(date_created=review_ended)
+
+        summary = sweep_initiative_lifecycle_task()
+
+        for initiative in (approved, rejected, ignored, still_under_review):
+            initiative.refresh_from_db()
+
+        self.assertEqual( summary['evaluated'], 3)
+        self.assertEqual( approved.status, 'upcoming')
+        self.assertEqual( rejected.status, 'review_failed')
+        self.assertEqual( ignored.status, 'review_failed')
+        self.assertEqual( still_under_review.status, 'under_review')
+        self.assertTrue( Notification.objects.filter(notification_type='initiative_approved',
+                                                    related_initiative=approved).exists())
+        self.assertEqual( Notification.objects.get(notification_type='initiative_review_failed',
+                                                    related_initiative=rejected).message, 'rejected_by_managers')
+        self.assertEqual( Notification.objects.get(notification_type='initiative_review_failed',
+                                                    related_initiative=ignored).message, 'lack_of_reviews')
+
+    def test_sweep_transitions_due_initiatives(self):
+        """
+        Tests that the lifecycle sweeper starts and completes due initiatives
+        and only once, a second run has nothing left to move.
+        """
+        now = timezone.now()
+        initiatives = {}
+        # (status, scheduled_datetime) default duration is 1 day
+        cases = {
+            'starting': ('upcoming', now - timezone.timedelta(hours=1)),
+            'not_started': ('upcoming', now + timezone.timedelta(days=3)),
+            'started_late': ('upcoming', now - timezone.timedelta(days=2)),
+            'ending': ('ongoing', now - timezone.timedelta(days=2)),
+            'running': ('ongoing', now - timezone.timedelta(hours=1)),
+        }
+        for name, (status, scheduled_datetime) in cases.items():
+            initiative = create_initiative(created_by=self.initiative_creator,
+                                            info=name,
+                                            city=self.annaba_city,
+                                            geo_location=self.point_in_annaba,
+                                            scheduled_datetime=scheduled_datetime)
+            initiative.status = status
+            initiative.save()
+            initiatives[name] = initiative
+
+        summary = sweep_initiative_lifecycle_task()
+        second_summary = sweep_initiative_lifecycle_task()
+
+        for initiative in initiatives.values():
+            initiative.refresh_from_db()
+
+        self.assertEqual( summary['ongoing'], 1)
+        self.assertEqual( summary['completed'], 2)
+        self.assertEqual( second_summary, {'evaluated': 0, 'completed': 0, 'ongoing': 0})
+        self.assertEqual( initiatives['starting'].status, 'ongoing')
+        self.assertEqual( initiatives['not_started'].status, 'upcoming')
+        self.assertEqual( initiatives['started_late'].status, 'completed')
+        self.assertEqual( initiatives['ending'].status, 'completed')
+        self.assertEqual( initiatives['running'].status, 'ongoing')
+        # An initiative that is already over is completed without being started
+        self.assertFalse( Notification.objects.filter(notification_type='initiative_started',
+                                                     related_initiative=initiatives['started_late']).exists())
+        self.assertEqual( Notification.objects.filter(notification_type='initiative_completed').count(), 2)
+
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from users.models import City
+from users.tests.test_utils import create_new_user
+from notifications.models import Notification
+from core.tests.test_utils import create_initiative, create_multiple_initiative_reviews, run_concurrently
+from core.tasks import (evaluate_initiative_reviews_task,
+                        transition_initiative_to_ongoing_task,
+                        transition_initiative_to_completed_task,
+                        sweep_initiative_lifecycle_task)
+
+WORKERS = 8
+
+
+# Ovveriding prod spatial data with light weigth test layers to speed up tests
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES)
+class LifecycleTasksConcurrencyTestCase(TransactionTestCase):
+    """
+    Stress tests running the same lifecycle task from many workers at once,
+    exactly one of them must transition the initiative and notify.
+    """
+
+    def setUp(self):
+        call_command('load_spatial_layers', 'DZ')
+        self.annaba_city = City.objects.get(name='Annaba')
+        self.point_in_annaba = self.annaba_city.get_random_location_point()
+        self.initiative_creator = create_new_user(email='initiative_starter_user@gmail.com',
+                                username='initiative_starter_user',
+                                password='qsdflkjlkj',
+                                account_type='manager',
+                                phone_number='+213555447755', 
+                                bio='Some good bio',
+                                city=self.annaba_city,
+                                geo_location=self.point_in_annaba,
+                                )
+
+    def create_initiative(self, status, scheduled_datetime):
+        initiative = create_initiative(created_by=self.initiative_creator,
+                                        info="good initiative",
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba,
+                                        scheduled_datetime=scheduled_datetime)
+        initiative.status = status
+        initiative.save()
+        return initiative
+
+    def assert_transitioned_once(self, initiative, status, notification_type):
+        initiative.refresh_from_db()
+        self.assertEqual(initiative.status, status)
+        self.assertEqual(initiative.status_version, 1)
+        self.assertEqual(Notification.objects.filter(notification_type=notification_type,
+                                                    related_initiative=initiative).count(), 1)
+
+    def test_concurrent_evaluations(self):
+        initiative = self.create_initiative('under_review', timezone.now() + timezone.timedelta(days=15))
+        create_multiple_initiative_reviews(initiative=initiative,
+                                            num_reviews=6,
+                                            base_username='active',
+                                            vote_type='approve',
+                                            city=self.annaba_city,
+                                            geo_location=self.point_in_annaba)
+
+        errors = run_concurrently(lambda: evaluate_initiative_reviews_task(initiative_id=initiative.id), WORKERS)
+
+        self.assertEqual(errors, [])
+        self.assert_transitioned_once(initiative, 'upcoming', 'initiative_approved')
+
+    def test_concurrent_transitions_to_ongoing(self):
+        initiative = self.create_initiative('upcoming', timezone.now() - timezone.timedelta(hours=1))
+
+        errors = run_concurrently(lambda: transition_initiative_to_ongoing_task(initiative_id=initiative.id), WORKERS)
+
+        self.assertEqual(errors, [])
+        self.assert_transitioned_once(initiative, 'ongoing', 'initiative_started')
+
+    def test_concurrent_transitions_to_completed(self):
+        initiative = self.create_initiative('ongoing', timezone.now() - timezone.timedelta(days=2))
+
+        errors = run_concurrently(lambda: transition_initiative_to_completed_task(initiative_id=initiative.id), WORKERS)
+
+        self.assertEqual(errors, [])
+        self.assert_transitioned_once(initiative, 'completed', 'initiative_completed')
+
+    def test_concurrent_sweeps_and_tasks(self):
+        """
+        The sweeper and a duplicated on-demand task racing for the same initiative.
+        """
+        initiative = self.create_initiative('upcoming', timezone.now() - timezone.timedelta(hours=1))
+        calls = iter([sweep_initiative_lifecycle_task] * (WORKERS // 2) +
+                     [lambda: transition_initiative_to_ongoing_task(initiative_id=initiative.id)] * (WORKERS // 2))
+
+        errors = run_concurrently(lambda: next(calls)(), WORKERS)
+
+        self.assertEqual(errors, [])
+        self.assert_transitioned_once(initiative, 'ongoing', 'initiative_started')
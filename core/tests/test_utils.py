@@ -1,5 +1,9 @@
+import threading
+
+from celery import current_app
+from django.db import connection
 from django.utils import timezone
-from core.models import Initiative, InitiativeReview
+from core.models import Initiative, InitiativeReview, TaskOutbox
 from users.tests.test_utils import create_new_user
 
 DATE_IN_THE_FUTUR = timezone.now() + timezone.timedelta(days=15)
@@ -107,4 +111,52 @@ def create_multiple_initiative_reviews(initiative, num_reviews, base_username, v
         )
         created_reviews.append(review)
 
-    return created_reviews
\ No newline at end of file
+    return created_reviews
+
+
+def run_concurrently(func, workers=8):
+    """
+    Run `func` at the same time in `workers` threads, each thread with its own
+    database connection, to mimic celery workers executing the same task.
+
+    Use it in TransactionTestCase tests, TestCase wraps every test in a
+    transaction that the other threads can not see.
+
+    Returns:
+        list: Exceptions raised by `func`, empty if every call succeeded.
+    """
+    barrier = threading.Barrier(workers)
+    errors = []
+
+    def worker():
+        try:
+            barrier.wait()
+            func()
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def run_outbox_tasks():
+    """
+    Run the tasks waiting in the outbox (see core.outbox) in this process,
+    oldest first, and delete them, like the relay and a worker would.
+
+    Returns:
+        list: Names of the tasks that ran.
+    """
+    ran = []
+    for message in TaskOutbox.objects.order_by('created_at', 'id'):
+        current_app.tasks[message.task_name].apply(args=message.args, kwargs=message.kwargs, throw=True)
+        message.delete()
+        ran.append(message.task_name)
+    return ran
+
@@ -1,21 +1,19 @@
-from datetime import timedelta
-
-from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.gis.db.models.functions import Distance
+from django.db import transaction
+from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse_lazy
-from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.views.generic.edit import CreateView
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
-from django.views.generic import TemplateView
+from django.views.generic import TemplateView, View
 from core.forms import InitiativeCreationForm, InitiativeReviewForm
 from core.models import Initiative
 from core.messages import core_messages
-from core.tasks import evaluate_initiative_reviews_task
+from core.task_metrics import get_metrics, COUNTERS, TIMED_METRICS
 from users.models import Profile, City
 from users.messages import users_messages
 
@@ -38,15 +36,17 @@ class CreateInitiativeView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
             self.permission_denied_message = core_messages['MANAGERS_ONLY']
             return False
 
+    @transaction.atomic
     def form_valid(self, form):
+        # Atomic so the initiative and everything its post_save receivers write
+        # (notifications, core.outbox tasks) are committed together
         geo_location = form.instance.geo_location
         # Assign City instance automatically from given geo_location
         form.instance.city = City.objects.get(geom__contains=geo_location)
         form.instance.created_by = self.request.user
         messages.success( self.request, core_messages['INITIATIVE_CREATED_SUCCESS'])
-        # Schedule initiaitve reviews evaluation task
-        eta_time = timezone.now() + timedelta(days=settings.INITIATIVE_REVIEW_DURATION)
-        evaluate_initiative_reviews_task.apply_async(args=[form.instance.id], eta=eta_time)  
+        # Reviews are evaluated by core.tasks.sweep_initiative_lifecycle_task
+        # once settings.INITIATIVE_REVIEW_DURATION has passed
         return super().form_valid(form)
 
 class InitiativeDetails(LoginRequiredMixin, DetailView):
@@ -157,4 +157,31 @@ class InitiativeListView(LoginRequiredMixin, ListView):
                 distance=Distance('geo_location', user.profile.geo_location)
             ).order_by('distance')
         
-        return queryset
\ No newline at end of file
+        return queryset
+
+
+class TaskMetricsView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Celery task metrics (see core.task_metrics) in the Prometheus text format,
+    staff only.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        lines = []
+        metrics = get_metrics()
+        for counter in COUNTERS:
+            lines.append(f'# TYPE khadra_task_{counter}_total counter')
+            lines += [f'khadra_task_{counter}_total{{task="{task}"}} {values[counter]}'
+                      for task, values in metrics.items()]
+        for metric in TIMED_METRICS:
+            lines.append(f'# TYPE khadra_task_{metric}_sum counter')
+            lines += [f'khadra_task_{metric}_sum{{task="{task}"}} {values[metric]}'
+                      for task, values in metrics.items()]
+            lines.append(f'# TYPE khadra_task_{metric}_max gauge')
+            lines += [f'khadra_task_{metric}_max{{task="{task}"}} {values[f"{metric}_max"]}'
+                      for task, values in metrics.items()]
+        return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
+
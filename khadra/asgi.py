@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'khadra.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings
+
+if settings.DEBUG:
+    # Serve static files like runserver does
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+    application = ASGIStaticFilesHandler(application)
@@ -1,4 +1,5 @@
 import os
+from fnmatch import fnmatchcase
 from celery import Celery
 
 # Set the default Django settings module for the 'celery' program.
@@ -13,5 +14,30 @@ app = Celery('khadra')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+
+class QueueProfileAnnotation:
+    """
+    Celery task annotation applying the options of the task's queue
+    (settings.TASK_QUEUE_PROFILES) e.g. acks_late, ignore_result, time limits.
+
+    NOTE: Annotations override the options passed to @shared_task, change the
+    queue profile (or route the task elsewhere) instead.
+    """
+
+    def annotate(self, task):
+        from django.conf import settings
+        return settings.TASK_QUEUE_PROFILES.get(get_task_queue(task.name), {})
+
+
+def get_task_queue(task_name):
+    """Return the queue settings.CELERY_TASK_ROUTES sends `task_name` to."""
+    for pattern, route in app.conf.task_routes.items():
+        if fnmatchcase(task_name, pattern):
+            return route['queue']
+    return app.conf.task_default_queue
+
+
+app.conf.task_annotations = [QueueProfileAnnotation()]
+
 # Load task modules from all registered Django apps.
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
@@ -48,7 +48,6 @@ INSTALLED_APPS = [
     'allauth.socialaccount',
     'crispy_forms',
     'crispy_bootstrap4',
-    'imagekit',
     'leaflet',
 ]
 
@@ -57,6 +56,8 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
+    # Before AuthenticationMiddleware, see AUTHENTICATION_BACKENDS
+    'users.middleware.legacy_backend_session_middleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -75,12 +76,14 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'notifications.context_processors.unread_notifications',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'khadra.wsgi.application'
+ASGI_APPLICATION = 'khadra.asgi.application'
 
 
 # Database
@@ -97,6 +100,16 @@ DATABASES = {
     }
 }
 
+# Cache (Redis), also holds the celery task metrics (see core/task_metrics.py)
+# https://docs.djangoproject.com/en/5.2/topics/cache/#redis
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379/1'),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -143,16 +156,27 @@ STATICFILES_DIRS = [
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Profile pictures, downscaled on upload and thumbnails generated once per upload (see users/images.py)
+PROFILE_PIC_MAX_UPLOAD_SIZE = 10 * 1024 * 1024 # Bytes, larger uploads are rejected
+PROFILE_PIC_MAX_PIXELS = 40_000_000 # Larger images (decompression bombs) are rejected before decoding
+PROFILE_PIC_MAX_DIMENSION = 1024 # Pixels, larger originals are downscaled before being stored
+PROFILE_PIC_THUMBNAIL_SIZES = (64, 256) # Pixels, square thumbnails
+PROFILE_PIC_WEBP_QUALITY = 80 # Served to browsers supporting WebP
+PROFILE_PIC_JPEG_QUALITY = 85 # Fallback for the other browsers
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Both load the user with its profile, city and country in one query (see users/backends.py).
+# Sessions keep the backend they logged in with, the sessions opened with the default
+# backends are moved to these by users.middleware.legacy_backend_session_middleware
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
+    'users.backends.ProfileModelBackend',
 
     # `allauth` specific authentication methods, such as login by email
-    'allauth.account.auth_backends.AuthenticationBackend',
+    'users.backends.ProfileAuthenticationBackend',
 ]
 
 #Configs of allauth
@@ -166,6 +190,8 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 #Email backend configs
 if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'Khadra <noreply@khadra.dz>')
+SITE_URL = os.getenv('SITE_URL', 'http://localhost:8000') # Base of the links in emails
 
 
 # Spatial data paths for prod and for automated tests
@@ -188,6 +214,15 @@ TEST_SPATIAL_LAYER_PATHS = {
     }
 }
 
+# In-process cache for the tests touching the unread counters, the dropdown
+# cache or the task metrics, so they never share the Redis cache:
+# @override_settings(CACHES=settings.TEST_CACHES)
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Leaflet configs 
 # https://django-leaflet.readthedocs.io/en/latest/templates.html#configuration
 
@@ -215,8 +250,124 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+# Probe tasks of the benchmark_task_queues command, only loaded by the benchmarked workers
+CELERY_INCLUDE = ['core.benchmark_tasks'] if os.getenv('CELERY_BENCHMARK_TASKS') else []
+
+# Task routing, one queue per workload so slow work (notification fan-out,
+# image processing) never delays time critical lifecycle transitions.
+# Patterns are matched in order, unmatched tasks go to the 'default' queue.
+# https://docs.celeryq.dev/en/stable/userguide/routing.html
+
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = {
+    # Periodic housekeeping
+    '*.reconcile_*': {'queue': 'maintenance'},
+    '*.purge_*': {'queue': 'maintenance'},
+    # Profile pictures processing
+    '*thumbnail*': {'queue': 'images'},
+    # Initiatives and upgrade requests lifecycle
+    'core.tasks.*': {'queue': 'lifecycle'},
+    'users.tasks.evaluate_*': {'queue': 'lifecycle'},
+    # Notifications fan-out and delivery
+    'notifications.tasks.*': {'queue': 'notifications'},
+}
+
+# Options applied to every task of a queue (see khadra/celery.py).
+# Prefetch and concurrency are worker options, see the workers in docker-compose.yml
+TASK_QUEUE_PROFILES = {
+    'lifecycle': {
+        # Tasks are idempotent (see core.tasks), a worker crash must not lose a transition
+        'acks_late': True,
+        'reject_on_worker_lost': True,
+        'ignore_result': True,
+    },
+    'notifications': {
+        'acks_late': True,
+        'reject_on_worker_lost': True,
+        'ignore_result': True,
+    },
+    'images': {
+        'acks_late': True,
+        'ignore_result': True,
+        'soft_time_limit': 60,
+        'time_limit': 90,
+    },
+    'maintenance': {
+        'ignore_result': True,
+        'soft_time_limit': 15 * 60,
+    },
+    'default': {},
+}
+
+# Periodic tasks run by celery beat
+# https://docs.celeryq.dev/en/stable/userguide/periodic-tasks.html
+
+CELERY_BEAT_SCHEDULE = {
+    'sweep-initiative-lifecycle': {
+        'task': 'core.tasks.sweep_initiative_lifecycle_task',
+        'schedule': 60.0, # Seconds, how late at most a lifecycle transition fires
+    },
+    'evaluate-upgrade-requests': {
+        'task': 'users.tasks.evaluate_upgrade_requests_task',
+        'schedule': 15 * 60.0,
+    },
+    'reconcile-unread-notification-counts': {
+        'task': 'notifications.tasks.reconcile_unread_counts_task',
+        'schedule': 60 * 60.0,
+    },
+    'send-notification-emails': {
+        'task': 'notifications.tasks.send_notification_emails_task',
+        'schedule': 60.0, # NOTIFICATIONS_EMAIL_RATE_LIMIT is per run
+    },
+    'purge-old-notifications': {
+        'task': 'notifications.tasks.purge_old_notifications_task',
+        'schedule': 24 * 60 * 60.0,
+    },
+}
+
+# Task outbox relay (python manage.py relay_task_outbox), see core/outbox.py
+
+TASK_OUTBOX_RELAY_BATCH_SIZE = 100 # Messages published per transaction
+TASK_OUTBOX_RELAY_INTERVAL = 1.0 # Seconds to wait when the outbox is drained
+TASK_OUTBOX_MAX_ATTEMPTS = 5 # Failed publications before a message is dead-lettered (left in the outbox, skipped)
 
 # Initiative configs
 
 INITIATIVE_REVIEW_DURATION = 7 # The initiative will be under review for 7 days
-MIN_INITIATIVE_REVIEWS_REQUIRED = 5 # Minimum required reviews (votes)
\ No newline at end of file
+MIN_INITIATIVE_REVIEWS_REQUIRED = 5 # Minimum required reviews (votes)
+INITIATIVE_LIFECYCLE_SWEEP_CHUNK_SIZE = 500 # Initiatives moved per UPDATE (and transaction) by the lifecycle sweeper
+
+# Upgrade request configs
+
+UPGRADE_REQUEST_REVIEW_DURATION = 7 # The upgrade request will be under review for 7 days
+MIN_UPGRADE_REQUEST_REVIEWS_REQUIRED = 5 # Minimum required reviews (votes)
+UPGRADE_REQUEST_EVALUATION_CHUNK_SIZE = 1000 # Upgrade requests evaluated per transaction
+
+# Notification configs
+
+UNREAD_NOTIFICATIONS_CACHE_TIMEOUT = 24 * 60 * 60 # Seconds an unread counter is kept in the cache
+UNREAD_NOTIFICATIONS_INCR_LIMIT = 1000 # Larger fan-outs delete the counters instead of incrementing them one by one
+UNREAD_NOTIFICATIONS_RECONCILE_CHUNK_SIZE = 5000 # Users recounted per query by the reconcile task
+NOTIFICATIONS_DROPDOWN_SIZE = 10 # Latest notifications shown in the navbar dropdown
+NOTIFICATIONS_MARK_READ_MAX_IDS = 500 # Notifications marked as read per request by id
+NOTIFICATIONS_FAN_OUT_CHUNK_SIZE = 5000 # Recipients inserted per query (and transaction) by the fan-out tasks
+NOTIFICATIONS_NEARBY_RADIUS = 30 # Kilometers, volunteers living this close to an approved initiative are notified
+# Notifications of these types grouped into one delivery per recipient within the window,
+# see Notification.add_recipients (users in digest mode get every type grouped per day)
+NOTIFICATIONS_COALESCE_TYPES = ('initiative_created', 'initiative_started', 'initiative_completed', 'upgrade_request_created')
+NOTIFICATIONS_COALESCE_WINDOW = 60 * 60 # Seconds
+NOTIFICATIONS_RETENTION_DAYS = 180 # Older notifications are deleted by the daily purge task
+NOTIFICATIONS_PURGE_CHUNK_SIZE = 5000 # Notifications deleted per transaction by the purge task
+# Email channel (see notifications/emails.py)
+NOTIFICATIONS_EMAIL_TYPES = ('initiative_started', 'initiative_completed') # Notification types also sent by email
+NOTIFICATIONS_EMAIL_BATCH_SIZE = 200 # Emails sent per connection (and transaction)
+NOTIFICATIONS_EMAIL_RATE_LIMIT = 3000 # Emails sent per minute at most
+NOTIFICATIONS_EMAIL_MAX_ATTEMPTS = 5 # Attempts before an email is given up
+NOTIFICATIONS_EMAIL_RETRY_DELAY = 5 * 60 # Seconds before the first retry, doubled on every attempt
+
+# Real-time notifications push (see notifications/push.py)
+NOTIFICATIONS_PUSH_REDIS_URL = os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379/1')
+NOTIFICATIONS_PUSH_CHANNEL = 'notifications:push'
+NOTIFICATIONS_PUSH_KEEPALIVE = 25 # Seconds between keepalive comments on idle streams
+NOTIFICATIONS_PUSH_RETRY = 5 # Seconds browsers wait before reconnecting a dropped stream
+NOTIFICATIONS_PUSH_QUEUE_SIZE = 100 # Notifications waiting per stream, more are dropped
@@ -6,8 +6,15 @@ from core.views import ( HomeView,
                         CreateInitiativeView, 
                         InitiativeDetails,
                         InitiativeReviewView,
-                        InitiativeListView)
-from notifications.views import NotificationsListView
+                        InitiativeListView,
+                        TaskMetricsView)
+from notifications.views import ( NotificationsListView,
+                                  NotificationsDropdownView,
+                                  NotificationsStreamView,
+                                  MarkNotificationsReadView,
+                                  MarkNotificationsReadUpToView,
+                                  MarkNotificationsReadByIdView,
+                                  NotificationPreferencesView)
 
 urlpatterns = [
     path('', HomeView.as_view(), name='home'),
@@ -15,10 +22,17 @@ urlpatterns = [
     path('initiative/new/', CreateInitiativeView.as_view(), name='create-initiative'),
     path('initiative/<pk>/', InitiativeDetails.as_view(), name='initiative-detail'),
     path('initiative/<pk>/review/', InitiativeReviewView.as_view(), name='initiative-review'),
+    path('metrics/tasks/', TaskMetricsView.as_view(), name='task-metrics'),
     path('admin/', admin.site.urls),
     path('accounts/', include('allauth.urls')),
     path('users/', include('users.urls')),
     path('notifications/', NotificationsListView.as_view(), name='notifications-list'),
+    path('notifications/dropdown/', NotificationsDropdownView.as_view(), name='notifications-dropdown'),
+    path('notifications/stream/', NotificationsStreamView.as_view(), name='notifications-stream'),
+    path('notifications/read/', MarkNotificationsReadView.as_view(), name='notifications-mark-read'),
+    path('notifications/read/up-to/', MarkNotificationsReadUpToView.as_view(), name='notifications-mark-read-up-to'),
+    path('notifications/preferences/', NotificationPreferencesView.as_view(), name='notification-preferences'),
+    path('notifications/read/ids/', MarkNotificationsReadByIdView.as_view(), name='notifications-mark-read-ids'),
 ]
 
 if settings.DEBUG:
@@ -1,4 +1,8 @@
 from django.contrib import admin
-from notifications.models import Notification
+from notifications.models import AnnouncementAudience, Notification, NotificationDelivery, NotificationEmail, NotificationPreference
 
 admin.site.register(Notification)
+admin.site.register(NotificationDelivery)
+admin.site.register(NotificationEmail)
+admin.site.register(NotificationPreference)
+admin.site.register(AnnouncementAudience)
@@ -0,0 +1,9 @@
+from notifications.counters import get_unread_count
+
+
+def unread_notifications(request):
+    """Unread notifications count of the current user for the navbar badge"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_notifications_count': get_unread_count(user)}
@@ -0,0 +1,162 @@
+"""
+Unread notifications counters
+
+The unread count of every user is kept in the cache (Redis) so the navbar
+badge costs no query:
+
+- Fan-out increments the counters of the recipients (see
+  notifications.signals and Notification.add_recipients), fan-outs larger
+  than settings.UNREAD_NOTIFICATIONS_INCR_LIMIT delete them instead, one
+  round trip rather than one per recipient.
+- Reading a notification decrements the counter of the reader.
+- Both also delete the cached navbar dropdown of the users (see
+  notifications.views.NotificationsDropdownView).
+- Counters change when the transaction commits, a rolled back fan-out
+  is never counted.
+- A missing counter is counted from the partial unread index and cached
+  for settings.UNREAD_NOTIFICATIONS_CACHE_TIMEOUT.
+- reconcile_unread_counts_task recounts the counters of recently active
+  users, fixing the drift left by races (e.g. an increment landing between
+  a count and its caching) and cache failures.
+- The cache is an optimization only: when Redis is unreachable the count
+  comes from the database and counter updates are skipped, pages never fail.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'notifications:unread'
+DROPDOWN_KEY_PREFIX = 'notifications:dropdown'
+
+
+def _key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+def dropdown_key(user_id):
+    return f'{DROPDOWN_KEY_PREFIX}:{user_id}'
+
+
+def count_unread(user_id):
+    from notifications.models import NotificationDelivery
+    return NotificationDelivery.objects.filter(user_id=user_id).unread().count()
+
+
+def get_unread_count(user):
+    """Return the unread notifications count of `user`, from the cache when possible"""
+    try:
+        count = cache.get(_key(user.pk))
+    except RedisError:
+        logger.warning('Cache unavailable, unread notifications counted from the database', exc_info=True)
+        return count_unread(user.pk)
+    if count is None:
+        count = count_unread(user.pk)
+        try:
+            cache.add(_key(user.pk), count, timeout=settings.UNREAD_NOTIFICATIONS_CACHE_TIMEOUT)
+        except RedisError:
+            logger.warning('Cache unavailable, unread notifications count not cached', exc_info=True)
+    return count
+
+
+def _incr(user_ids):
+    try:
+        cache.delete_many([dropdown_key(user_id) for user_id in user_ids])
+        if len(user_ids) > settings.UNREAD_NOTIFICATIONS_INCR_LIMIT:
+            cache.delete_many([_key(user_id) for user_id in user_ids])
+            return
+        for user_id in user_ids:
+            try:
+                cache.incr(_key(user_id))
+            except ValueError:
+                # Not cached, counted from the database on the next read
+                pass
+    except RedisError:
+        # Fixed by reconcile_unread_counts_task
+        logger.warning('Cache unavailable, unread notifications counters not incremented', exc_info=True)
+
+
+def _decr(user_id, delta):
+    try:
+        cache.delete(dropdown_key(user_id))
+        if cache.decr(_key(user_id), delta) < 0:
+            cache.delete(_key(user_id))
+    except ValueError:
+        pass
+    except RedisError:
+        logger.warning('Cache unavailable, unread notifications counter not decremented', exc_info=True)
+
+
+def incr_unread_counts(user_ids):
+    """Count a new notification for each of `user_ids` once the transaction commits"""
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: _incr(user_ids))
+
+
+def invalidate_dropdowns(user_ids):
+    """Delete the cached dropdowns of `user_ids` once the transaction commits"""
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: _delete_dropdowns(user_ids))
+
+
+def _delete_dropdowns(user_ids):
+    try:
+        cache.delete_many([dropdown_key(user_id) for user_id in user_ids])
+    except RedisError:
+        logger.warning('Cache unavailable, notifications dropdowns not invalidated', exc_info=True)
+
+
+def decr_unread_count(user_id, delta=1):
+    """Count `delta` notifications of `user_id` as read once the transaction commits"""
+    transaction.on_commit(lambda: _decr(user_id, delta))
+
+
+def _count_unread_many(user_ids):
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+
+    return dict(User.objects.filter(pk__in=user_ids).annotate(
+        unread=Count('notification_deliveries', filter=Q(notification_deliveries__is_read=False))
+    ).values_list('pk', 'unread'))
+
+
+def reconcile_unread_counts(user_ids):
+    """
+    Recount the unread notifications of `user_ids` with one grouped query
+    and overwrite their counters.
+
+    Returns:
+        dict: unread count by user id.
+    """
+    counts = _count_unread_many(user_ids)
+    cache.set_many({_key(user_id): unread for user_id, unread in counts.items()},
+                   timeout=settings.UNREAD_NOTIFICATIONS_CACHE_TIMEOUT)
+    return counts
+
+
+def get_unread_counts(user_ids):
+    """
+    Return the unread notifications counts of `user_ids` by user id with one
+    cache round trip, the missing counters are recounted with one grouped
+    query (see reconcile_unread_counts).
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    try:
+        cached = cache.get_many([_key(user_id) for user_id in user_ids])
+        counts = {user_id: cached[_key(user_id)] for user_id in user_ids if _key(user_id) in cached}
+        missing = [user_id for user_id in user_ids if user_id not in counts]
+        if missing:
+            counts.update(reconcile_unread_counts(missing))
+        return counts
+    except RedisError:
+        logger.warning('Cache unavailable, unread notifications counted from the database', exc_info=True)
+        return _count_unread_many(user_ids)
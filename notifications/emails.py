@@ -0,0 +1,146 @@
+"""
+Email channel of the notifications
+
+Emails are queued as NotificationEmail rows by Notification.add_recipients
+(types of settings.NOTIFICATIONS_EMAIL_TYPES) and sent by
+notifications.tasks.send_notification_emails_task:
+
+- Due emails are picked in batches of settings.NOTIFICATIONS_EMAIL_BATCH_SIZE
+  (SKIP LOCKED, workers never send the same email twice), every batch is
+  sent over a single connection of the email backend (get_connection).
+- Each message is sent with send_messages on that open connection, so a
+  refused recipient (bounce) only fails its own email, the others of the
+  batch are still sent.
+- Other errors (server unavailable, connection dropped) are temporary, the
+  email is retried later with an exponential backoff, up to
+  settings.NOTIFICATIONS_EMAIL_MAX_ATTEMPTS attempts.
+- A run sends at most settings.NOTIFICATIONS_EMAIL_RATE_LIMIT emails, the
+  task runs every minute (celery beat), hence a rate limit per minute.
+
+Any email backend works (console and locmem for development and tests, a
+local SMTP server such as `python -m aiosmtpd -n` to measure throughput).
+"""
+import logging
+from datetime import timedelta
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPSenderRefused
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import select_template
+from django.utils import timezone
+from notifications.models import NotificationEmail
+
+logger = logging.getLogger(__name__)
+
+# Permanent errors, retrying would fail again
+BOUNCE_ERRORS = (SMTPRecipientsRefused, SMTPSenderRefused)
+
+
+def render_email(email):
+    """
+    Render the message of `email` with the templates of its notification type
+    (notifications/emails/<type>_subject.txt and <type>.txt).
+    """
+    notification = email.notification
+    context = {
+        'user': email.user,
+        'notification': notification,
+        'initiative': notification.related_initiative,
+        'site_url': settings.SITE_URL,
+    }
+    template_type = notification.notification_type
+    subject = select_template([f'notifications/emails/{template_type}_subject.txt',
+                               'notifications/emails/default_subject.txt']).render(context)
+    body = select_template([f'notifications/emails/{template_type}.txt',
+                            'notifications/emails/default.txt']).render(context)
+    return EmailMessage(' '.join(subject.split()), body, to=[email.user.email])
+
+
+def _retry_later(email, now):
+    email.attempts += 1
+    if email.attempts >= settings.NOTIFICATIONS_EMAIL_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.next_attempt_at = now + timedelta(
+            seconds=settings.NOTIFICATIONS_EMAIL_RETRY_DELAY * 2 ** (email.attempts - 1))
+
+
+def send_batch(emails, connection=None):
+    """
+    Send `emails` over a single connection of the email backend and update
+    their status (not saved).
+
+    Returns:
+        int: number of emails sent.
+    """
+    now = timezone.now()
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except (SMTPException, OSError):
+        logger.warning('Email backend unavailable, %d notification emails postponed', len(emails), exc_info=True)
+        for email in emails:
+            _retry_later(email, now)
+        return 0
+
+    sent = 0
+    try:
+        for index, email in enumerate(emails):
+            if not email.user.email:
+                email.status = 'failed'
+                continue
+            try:
+                connection.send_messages([render_email(email)])
+            except BOUNCE_ERRORS:
+                logger.info('Notification email %d refused', email.pk)
+                email.status = 'failed'
+                email.attempts += 1
+            except (SMTPException, OSError):
+                # The connection is likely gone, the rest of the batch is retried later
+                logger.warning('Sending notification emails failed', exc_info=True)
+                for pending in emails[index:]:
+                    _retry_later(pending, now)
+                break
+            else:
+                email.status = 'sent'
+                email.attempts += 1
+                email.sent_at = timezone.now()
+                sent += 1
+    finally:
+        try:
+            connection.close()
+        except (SMTPException, OSError):
+            pass
+    return sent
+
+
+def send_due_emails(limit=None):
+    """
+    Send the due notification emails, at most `limit`
+    (default settings.NOTIFICATIONS_EMAIL_RATE_LIMIT).
+
+    Every batch is picked, sent and updated in its own transaction.
+
+    Returns:
+        int: number of emails sent.
+    """
+    if limit is None:
+        limit = settings.NOTIFICATIONS_EMAIL_RATE_LIMIT
+
+    sent = processed = 0
+    while processed < limit:
+        with transaction.atomic():
+            emails = list(
+                NotificationEmail.objects.due()
+                .order_by('next_attempt_at')
+                .select_related('user', 'notification__related_initiative')
+                .select_for_update(skip_locked=True, of=('self',))
+                [:min(settings.NOTIFICATIONS_EMAIL_BATCH_SIZE, limit - processed)]
+            )
+            if not emails:
+                break
+            sent += send_batch(emails)
+            NotificationEmail.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at', 'sent_at'])
+        processed += len(emails)
+    return sent
@@ -0,0 +1,176 @@
+"""
+Notifications feed of a user with keyset (cursor) pagination
+
+The feed is the union of index scans, merged by created_at:
+- the user's deliveries (NotificationDelivery index on user, -created_at)
+- the broadcast notifications created after the user joined (partial index
+  on created_at of broadcast notifications)
+- the targeted announcements created after the user joined whose audience
+  (AnnouncementAudience) holds the city of the user (cities through table
+  index on city) or whose circle contains the location of the user (GiST
+  index on the circle polygon), resolved here rather than fanned out
+
+The branches are disjoint, every notification appears once: announcements
+also delivered to the user are left to the deliveries branch and an
+audience matching both by city and by circle is a single row. Each branch
+reads at most one page past the cursor, so any page costs the same
+whatever its depth, and there is neither OFFSET nor COUNT.
+
+Announcements have no delivery until the user reads them: marking them as
+read creates a read delivery (see mark_announcements_as_read), the feed
+then serves them from the deliveries branch with their read state.
+"""
+import base64
+from datetime import datetime
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+from django.db.models import Case, Exists, OuterRef, Q, Subquery, When
+from django.db.models.functions import Coalesce
+from notifications.counters import invalidate_dropdowns
+from notifications.models import AnnouncementAudience, Notification, NotificationDelivery
+
+
+def encode_cursor(created_at, pk):
+    """Cursor of the page starting after the notification (created_at, pk) of the feed"""
+    value = f'{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        tuple: (created_at, id) of the last notification of the previous page.
+
+    Raises:
+        ValueError: the cursor is not valid.
+    """
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f'Invalid cursor {cursor!r}') from error
+
+
+def get_profile(user):
+    """Profile of `user`, None for users without profile"""
+    try:
+        return user.profile
+    except ObjectDoesNotExist:
+        return None
+
+
+def get_audience_filter(user):
+    """
+    Filter of the targeted announcements whose audience holds `user`: by the
+    city of the user or by a circle containing their location. Empty (Q())
+    for users without profile, city nor location.
+    """
+    profile = get_profile(user)
+    audience = Q()
+    if profile is not None and profile.city_id is not None:
+        audience |= Q(Exists(AnnouncementAudience.cities.through.objects.filter(
+            announcementaudience_id=OuterRef('pk'), city_id=profile.city_id)))
+    if profile is not None and profile.geo_location is not None:
+        audience |= Q(audience__area__contains=profile.geo_location)
+    return audience
+
+
+def get_announcements(user):
+    """
+    Announcements of the feed of `user` without a delivery, so unread: the
+    broadcast and targeted notifications created after the user joined.
+    """
+    delivered = NotificationDelivery.objects.filter(notification=OuterRef('pk'), user=user)
+    return Notification.objects.filter(Q(is_broadcast=True) | get_audience_filter(user),
+                                       created_at__gte=user.date_joined).exclude(Exists(delivered))
+
+
+def mark_announcements_as_read(user, announcements):
+    """
+    Mark the `announcements` (see get_announcements) as read for `user` with
+    a single INSERT ... SELECT of read deliveries, dated like their
+    notification so the feed order is unchanged. Announcements are not
+    counted by the unread counter, it is left as is.
+
+    Returns:
+        int: number of announcements marked as read.
+    """
+    quote_name = connection.ops.quote_name
+    column = lambda name: quote_name(NotificationDelivery._meta.get_field(name).column)
+    announcements_sql, params = announcements.order_by().values('pk', 'created_at').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {quote_name(NotificationDelivery._meta.db_table)}
+                ({column('notification')}, {column('user')}, {column('is_read')},
+                 {column('created_at')}, {column('grouped_count')})
+            SELECT announcement.{quote_name(Notification._meta.pk.column)}, %s, TRUE,
+                announcement.{quote_name(Notification._meta.get_field('created_at').column)}, 1
+            FROM ({announcements_sql}) AS announcement
+            ON CONFLICT DO NOTHING
+            """,
+            [user.pk, *params],
+        )
+        marked = cursor.rowcount
+    if marked:
+        # The dropdown lists the deliveries of the user
+        invalidate_dropdowns([user.pk])
+    return marked
+
+
+def get_feed_page(user, cursor=None, size=20):
+    """
+    Get a page of the notifications of `user`, newest first.
+
+    Args:
+        cursor (str): next_cursor of the previous page, None for the first page.
+        size (int): notifications per page.
+
+    Returns:
+        tuple: (notifications, next_cursor), notifications is a queryset
+        annotated with the read state of `user` (`is_read`) and the number
+        of notifications its delivery groups (`grouped_count`), next_cursor
+        is None on the last page.
+
+    Raises:
+        ValueError: the cursor is not valid.
+    """
+    direct = NotificationDelivery.objects.filter(user=user)
+    # Broadcast and targeted announcements
+    announcements = [Notification.objects.filter(is_broadcast=True)]
+    audience = get_audience_filter(user)
+    if audience:
+        announcements.append(Notification.objects.filter(audience, is_broadcast=False))
+    delivered = NotificationDelivery.objects.filter(notification=OuterRef('pk'), user=user)
+    announcements = [notifications.filter(created_at__gte=user.date_joined).exclude(Exists(delivered))
+                     for notifications in announcements]
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        direct = direct.filter(Q(created_at__lt=created_at) |
+                               Q(created_at=created_at, notification_id__lt=pk))
+        announcements = [notifications.filter(Q(created_at__lt=created_at) |
+                                              Q(created_at=created_at, pk__lt=pk))
+                         for notifications in announcements]
+
+    direct = direct.order_by('-created_at', '-notification_id').values_list('created_at', 'notification_id')
+    announcements = [notifications.order_by('-created_at', '-pk').values_list('created_at', 'pk')[:size + 1]
+                     for notifications in announcements]
+    feed = direct[:size + 1].union(*announcements, all=True).order_by('-created_at', '-notification_id')
+
+    rows = list(feed[:size + 1])
+    has_next = len(rows) > size
+    rows = rows[:size]
+
+    deliveries = NotificationDelivery.objects.filter(notification=OuterRef('pk'), user=user)
+    notifications = Notification.objects.filter(
+        pk__in=[notification_id for _created_at, notification_id in rows]
+    ).annotate(is_read=Exists(deliveries.filter(is_read=True)),
+               grouped_count=Coalesce(Subquery(deliveries.values('grouped_count')[:1]), 1))
+    if rows:
+        # Keep the feed order, deliveries are dated by the feed rather than by their notification
+        notifications = notifications.order_by(
+            Case(*[When(pk=notification_id, then=index) for index, (_created_at, notification_id) in enumerate(rows)]))
+
+    next_cursor = encode_cursor(*rows[-1]) if has_next else None
+    return notifications, next_cursor
@@ -0,0 +1,90 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from users.models import Profile
+from notifications.models import Notification
+from notifications.tasks import _add_recipients_in_chunks, get_nearby_volunteers
+
+User = get_user_model()
+
+# Bounding box of Algeria (longitude, latitude)
+ALGERIA_EXTENT = (-8.67, 18.96, 11.98, 37.09)
+ALGIERS = Point(3.0588, 36.7538, srid=4326)
+
+
+class Command(BaseCommand):
+    """
+    Benchmark the fan-out of an approved initiative to the nearby volunteers
+
+    Creates --profiles volunteers spread uniformly across Algeria (two
+    INSERT ... SELECT generate_series), then for an initiative in Algiers:
+    - scan: counting the volunteers with the exact distance only, every
+      profile is measured
+    - index: counting them with get_nearby_volunteers, the spatial index
+      selects the candidates first
+    - fan-out: adding them to a notification in chunks, as
+      fan_out_to_nearby_volunteers_task does
+
+    Everything runs in a transaction rolled back at the end, nothing is kept, e.g:
+        docker-compose exec web python manage.py benchmark_nearby_fanout --profiles 1000000
+    """
+
+    help = "Measure the spatial selection and chunked fan-out of nearby volunteers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=1000000, help='Number of volunteers (default 1000000)')
+        parser.add_argument('--radius', type=float, default=30, help='Radius in kilometers (default 30)')
+
+    def create_volunteers(self, count):
+        quote_name = connection.ops.quote_name
+        min_x, min_y, max_x, max_y = ALGERIA_EXTENT
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {quote_name(User._meta.db_table)}
+                    (username, email, password, first_name, last_name, is_superuser, is_staff, is_active, date_joined)
+                SELECT 'nearby_benchmark_' || i, '', %s, '', '', FALSE, FALSE, TRUE, now()
+                FROM generate_series(1, %s) AS i
+                """,
+                [make_password(None), count],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {quote_name(Profile._meta.db_table)}
+                    (user_id, geo_location, account_type, phone_number, notification_digest, thumbnails_source, thumbnail_names)
+                SELECT id,
+                    ST_SetSRID(ST_MakePoint(%s + random() * %s, %s + random() * %s), 4326),
+                    'volunteer', '+213555000000', FALSE, '', '{{}}'
+                FROM {quote_name(User._meta.db_table)}
+                WHERE username LIKE 'nearby\\_benchmark\\_%%'
+                """,
+                [min_x, max_x - min_x, min_y, max_y - min_y],
+            )
+            cursor.execute(f"ANALYZE {quote_name(Profile._meta.db_table)}")
+
+    def measure(self, label, run):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        self.stdout.write("%-7s volunteers=%d %.3fs" % (label, result, elapsed))
+
+    def handle(self, *args, **kwargs):
+        radius = kwargs['radius']
+        with transaction.atomic():
+            self.create_volunteers(kwargs['profiles'])
+
+            scan = User.objects.filter(profile__account_type='volunteer',
+                                       profile__geo_location__distance_lte=(ALGIERS, D(km=radius)))
+            self.measure('scan', scan.count)
+            self.measure('index', get_nearby_volunteers(ALGIERS, radius).count)
+
+            notification = Notification.objects.create(notification_type='initiative_nearby')
+            self.measure('fan-out', lambda: _add_recipients_in_chunks(notification,
+                                                                      get_nearby_volunteers(ALGIERS, radius)))
+
+            transaction.set_rollback(True)
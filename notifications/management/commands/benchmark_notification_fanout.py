@@ -0,0 +1,55 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from users.models import Profile
+from notifications.models import Notification
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Benchmark adding notification recipients
+
+    Creates --recipients managers then adds them to a notification:
+    - orm: loading the managers and calling notification.recipients.add(*managers)
+    - bulk: notification.add_recipients(managers), a single INSERT ... SELECT
+
+    Everything runs in a transaction rolled back at the end, nothing is kept, e.g:
+        docker-compose exec web python manage.py benchmark_notification_fanout --recipients 50000
+    """
+
+    help = "Compare ORM and INSERT ... SELECT fan-out of notification recipients"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=50000, help='Number of recipients (default 50000)')
+
+    def create_managers(self, count):
+        password = make_password(None)
+        users = User.objects.bulk_create(
+            [User(username=f'fanout_benchmark_{i}', email=f'fanout_benchmark_{i}@khadra.local', password=password)
+             for i in range(count)],
+            batch_size=5000)
+        Profile.objects.bulk_create(
+            [Profile(user=user, account_type='manager', phone_number='+213555000000') for user in users],
+            batch_size=5000)
+
+    def measure(self, label, fanout):
+        notification = Notification.objects.create(notification_type='announcement')
+        start = time.perf_counter()
+        fanout(notification)
+        elapsed = time.perf_counter() - start
+        self.stdout.write("%-5s recipients=%d %.3fs" % (label, notification.recipients.count(), elapsed))
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            self.create_managers(kwargs['recipients'])
+            managers = User.objects.filter(profile__account_type='manager')
+
+            self.measure('orm', lambda notification: notification.recipients.add(*managers))
+            self.measure('bulk', lambda notification: notification.add_recipients(managers))
+
+            transaction.set_rollback(True)
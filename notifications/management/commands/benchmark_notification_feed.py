@@ -0,0 +1,96 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from notifications.models import Notification
+from notifications.feed import get_feed_page
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Benchmark the notifications feed of a user with many notifications
+
+    Creates a user with --notifications deliveries (one broadcast every
+    --broadcast-every notifications) then times, for the first, a middle
+    and the last page:
+    - offset: Notification.get_for_user() with Paginator (COUNT + OFFSET)
+    - keyset: notifications.feed.get_feed_page() (UNION, cursor)
+
+    --background adds notifications delivered to another user, to measure the
+    feed on big tables (e.g. 50M rows, the retention purge keeps tables
+    around that size, see notifications.tasks.purge_old_notifications_task).
+
+    Everything runs in a transaction rolled back at the end, nothing is kept, e.g:
+        docker-compose exec web python manage.py benchmark_notification_feed --notifications 100000
+        docker-compose exec web python manage.py benchmark_notification_feed --background 50000000
+    """
+
+    help = "Compare OFFSET and keyset pagination of the notifications feed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notifications', type=int, default=100000, help='Notifications of the user (default 100000)')
+        parser.add_argument('--broadcast-every', type=int, default=10, help='One broadcast every N notifications (default 10)')
+        parser.add_argument('--page-size', type=int, default=20, help='Notifications per page (default 20)')
+        parser.add_argument('--background', type=int, default=0, help='Notifications of another user (default 0)')
+
+    def create_notifications(self, user, count, broadcast_every):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM notifications_notification")
+            last_id, = cursor.fetchone()
+            cursor.execute(
+                """
+                INSERT INTO notifications_notification
+                    (notification_type, message, is_broadcast, created_at)
+                SELECT 'announcement', '', i %% %s = 0, %s + i * INTERVAL '1 millisecond'
+                FROM generate_series(1, %s) AS i
+                """,
+                [broadcast_every, user.date_joined, count],
+            )
+            cursor.execute(
+                """
+                INSERT INTO notifications_notificationdelivery
+                    (notification_id, user_id, is_read, created_at, grouped_count)
+                SELECT id, %s, FALSE, created_at, 1 FROM notifications_notification
+                WHERE NOT is_broadcast AND id > %s
+                """,
+                [user.pk, last_id],
+            )
+            cursor.execute("ANALYZE notifications_notification")
+            cursor.execute("ANALYZE notifications_notificationdelivery")
+
+    def timed(self, func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    def handle(self, *args, **kwargs):
+        page_size = kwargs['page_size']
+        with transaction.atomic():
+            if kwargs['background']:
+                other_user = User.objects.create_user(username='feed_benchmark_other', email='feed_benchmark_other@khadra.local')
+                # No broadcasts, they would be in the feed of the measured user
+                self.create_notifications(other_user, kwargs['background'], kwargs['background'] + 1)
+            user = User.objects.create_user(username='feed_benchmark', email='feed_benchmark@khadra.local')
+            self.create_notifications(user, kwargs['notifications'], kwargs['broadcast_every'])
+
+            paginator = Paginator(Notification.get_for_user(user), page_size)
+            pages = (1, paginator.num_pages // 2, paginator.num_pages)
+
+            # Cursors of the keyset pages matching the offset pages
+            cursors, cursor, number = {1: None}, None, 1
+            while number < pages[-1]:
+                _notifications, cursor = get_feed_page(user, cursor=cursor, size=page_size)
+                number += 1
+                if number in pages:
+                    cursors[number] = cursor
+
+            for number in pages:
+                offset = self.timed(lambda: list(Paginator(Notification.get_for_user(user), page_size).page(number)))
+                keyset = self.timed(lambda: list(get_feed_page(user, cursor=cursors[number], size=page_size)[0]))
+                self.stdout.write("page %-6d offset=%.4fs keyset=%.4fs" % (number, offset, keyset))
+
+            transaction.set_rollback(True)
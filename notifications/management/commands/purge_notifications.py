@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notifications.tasks import purge_old_notifications_task
+
+
+class Command(BaseCommand):
+    """
+    Management command deleting old notifications and their deliveries
+
+    Runs notifications.tasks.purge_old_notifications_task in the current
+    process (celery beat runs it daily), e.g. to purge a backlog after
+    lowering settings.NOTIFICATIONS_RETENTION_DAYS:
+        python manage.py purge_notifications --days 90
+    """
+
+    help = "Delete notifications older than the retention period, in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days',
+            type=int,
+            default=settings.NOTIFICATIONS_RETENTION_DAYS,
+            help='Retention period in days (default settings.NOTIFICATIONS_RETENTION_DAYS)')
+
+    def handle(self, *args, **kwargs):
+        purged = purge_old_notifications_task(retention_days=kwargs['days'])
+        self.stdout.write(self.style.SUCCESS("Purged %s notifications" % purged))
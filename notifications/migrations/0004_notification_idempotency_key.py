@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_notification_related_upgrade_request'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, unique=True, verbose_name='Idempotency key'),
+        ),
+    ]
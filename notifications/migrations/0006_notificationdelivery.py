@@ -0,0 +1,87 @@
+# Generated by Django 5.2.3 on 2026-10-19 16:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Replace the auto-created recipients table with NotificationDelivery,
+    existing recipients are copied with one INSERT ... SELECT and get the
+    read state and creation time of their notification.
+    """
+
+    dependencies = [
+        ('notifications', '0005_alter_notification_notification_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_read', models.BooleanField(default=False, verbose_name='Is read')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created at')),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='notifications.notification', verbose_name='Notification')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_deliveries', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Notification delivery',
+                'verbose_name_plural': 'Notification deliveries',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO notifications_notificationdelivery (notification_id, user_id, is_read, created_at)
+                SELECT recipient.notification_id, recipient.user_id, notification.is_read, notification.created_at
+                FROM notifications_notification_recipients AS recipient
+                JOIN notifications_notification AS notification ON notification.id = recipient.notification_id
+            """,
+            reverse_sql="""
+                INSERT INTO notifications_notification_recipients (notification_id, user_id)
+                SELECT notification_id, user_id FROM notifications_notificationdelivery
+            """,
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='notification',
+                    name='recipients',
+                    field=models.ManyToManyField(blank=True, related_name='notifications', through='notifications.NotificationDelivery', to=settings.AUTH_USER_MODEL, verbose_name='Recipients'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    sql="DROP TABLE notifications_notification_recipients",
+                    reverse_sql="""
+                        CREATE TABLE notifications_notification_recipients (
+                            id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                            notification_id bigint NOT NULL REFERENCES notifications_notification (id) DEFERRABLE INITIALLY DEFERRED,
+                            user_id integer NOT NULL REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED,
+                            UNIQUE (notification_id, user_id)
+                        )
+                    """,
+                ),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='notification',
+            name='is_read',
+        ),
+        migrations.AddConstraint(
+            model_name='notificationdelivery',
+            constraint=models.UniqueConstraint(fields=('notification', 'user'), name='notification_delivery_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationdelivery',
+            index=models.Index(fields=['user', '-created_at'], name='delivery_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationdelivery',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at'], name='delivery_user_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0006_notificationdelivery'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notificationdelivery',
+            name='delivery_user_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='notificationdelivery',
+            index=models.Index(fields=['user', '-created_at', '-notification'], name='delivery_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_broadcast', True)), fields=['-created_at', '-id'], name='notification_broadcast_idx'),
+        ),
+    ]
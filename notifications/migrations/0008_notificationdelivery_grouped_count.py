@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0007_notification_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationdelivery',
+            name='grouped_count',
+            field=models.PositiveIntegerField(default=1, help_text='Number of notifications grouped in this delivery.', verbose_name='Grouped notifications'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0008_notificationdelivery_grouped_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['created_at'], name='notification_created_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0009_notification_created_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next attempt at')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sent at')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created at')),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emails', to='notifications.notification', verbose_name='Notification')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_emails', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Notification email',
+                'verbose_name_plural': 'Notification emails',
+                'constraints': [models.UniqueConstraint(fields=('notification', 'user'), name='notification_email_unique')],
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at'], name='notification_email_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0010_notificationemail'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationPreference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification_type', models.CharField(choices=[('initiative_created', 'Initiative Created'), ('initiative_approved', 'Initiative Approved'), ('initiative_review_failed', 'Initiative Review Failed'), ('initiative_started', 'Initiative Started'), ('initiative_cancelled', 'Initiative Cancelled'), ('initiative_completed', 'Initiative Completed'), ('announcement', 'Announcement'), ('upgrade_request_created', 'Upgrade Request Created'), ('upgrade_request_approved', 'Upgrade Request Approved'), ('upgrade_request_rejected', 'Upgrade Request Rejected')], max_length=50, verbose_name='Notification type')),
+                ('in_app', models.BooleanField(default=True, verbose_name='In-app')),
+                ('email', models.BooleanField(default=True, help_text='Only the types of NOTIFICATIONS_EMAIL_TYPES are sent by email.', verbose_name='Email')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_preferences', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Notification preference',
+                'verbose_name_plural': 'Notification preferences',
+                'constraints': [models.UniqueConstraint(fields=('user', 'notification_type'), name='notification_preference_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0011_notificationpreference'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('initiative_created', 'Initiative Created'), ('initiative_approved', 'Initiative Approved'), ('initiative_review_failed', 'Initiative Review Failed'), ('initiative_started', 'Initiative Started'), ('initiative_cancelled', 'Initiative Cancelled'), ('initiative_completed', 'Initiative Completed'), ('initiative_nearby', 'Initiative Nearby'), ('announcement', 'Announcement'), ('upgrade_request_created', 'Upgrade Request Created'), ('upgrade_request_approved', 'Upgrade Request Approved'), ('upgrade_request_rejected', 'Upgrade Request Rejected')], max_length=50, verbose_name='Notification type'),
+        ),
+        migrations.AlterField(
+            model_name='notificationpreference',
+            name='notification_type',
+            field=models.CharField(choices=[('initiative_created', 'Initiative Created'), ('initiative_approved', 'Initiative Approved'), ('initiative_review_failed', 'Initiative Review Failed'), ('initiative_started', 'Initiative Started'), ('initiative_cancelled', 'Initiative Cancelled'), ('initiative_completed', 'Initiative Completed'), ('initiative_nearby', 'Initiative Nearby'), ('announcement', 'Announcement'), ('upgrade_request_created', 'Upgrade Request Created'), ('upgrade_request_approved', 'Upgrade Request Approved'), ('upgrade_request_rejected', 'Upgrade Request Rejected')], max_length=50, verbose_name='Notification type'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-19 20:15
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0012_alter_notification_type_initiative_nearby'),
+        ('users', '0008_profile_notification_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnouncementAudience',
+            fields=[
+                ('notification', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='audience', serialize=False, to='notifications.notification', verbose_name='Notification')),
+                ('center', django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326, verbose_name='Center')),
+                ('radius', models.FloatField(blank=True, help_text='Radius of the circle in kilometers.', null=True, verbose_name='Radius')),
+                ('area', django.contrib.gis.db.models.fields.PolygonField(blank=True, editable=False, null=True, srid=4326, verbose_name='Area')),
+                ('cities', models.ManyToManyField(blank=True, related_name='announcement_audiences', to='users.city', verbose_name='Cities')),
+            ],
+            options={
+                'verbose_name': 'Announcement audience',
+                'verbose_name_plural': 'Announcement audiences',
+            },
+        ),
+    ]
@@ -1,9 +1,18 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.gis.db import models
+from django.contrib.gis.gdal import CoordTransform, SpatialReference
+from django.contrib.gis.geos import Point
+from django.db import connection
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from core.models import Initiative
-from users.models import UpgradeRequest
+from users.models import City, UpgradeRequest
+from notifications.counters import decr_unread_count, incr_unread_counts, invalidate_dropdowns
+from notifications.push import push_notifications
 
 User = get_user_model()
 
@@ -16,20 +25,26 @@ class Notification(models.Model):
         ('initiative_started', _('Initiative Started')),
         ('initiative_cancelled', _('Initiative Cancelled')),
         ('initiative_completed', _('Initiative Completed')),
+        # Approved initiative sent to the volunteers living nearby
+        ('initiative_nearby', _('Initiative Nearby')),
         # Announcement is for notifying all users with news
         # or with events unrelated to any initiative or specific user
         # this will come in handy in the future to communicate with all users
         ('announcement', _('Announcement')),
         # Users related notifictions categories
         ('upgrade_request_created', _('Upgrade Request Created')),
+        ('upgrade_request_approved', _('Upgrade Request Approved')),
+        ('upgrade_request_rejected', _('Upgrade Request Rejected')),
     ]
 
     notification_type = models.CharField(_('Notification type'), max_length=50, choices=NOTIFICATION_TYPES)
     message = models.TextField(_('Message')) 
     
-    # Recipients: Many-to-Many so we can target one, many, or zero users
+    # Recipients: Many-to-Many so we can target one, many, or zero users,
+    # each recipient has its own read state (see NotificationDelivery)
     recipients = models.ManyToManyField(
         User,
+        through='NotificationDelivery',
         blank=True,
         related_name='notifications',
         verbose_name=_('Recipients'),
@@ -48,24 +63,153 @@ class Notification(models.Model):
                                             null=True, blank=True, related_name='notifications',
                                             verbose_name=_('Related upgrade request'))
     
-    # Status
-    is_read = models.BooleanField(_('Is read'), default=False)
+    # Identifies the event that created the notification (e.g. an initiative
+    # transition, see core.tasks.get_idempotency_key) so it is only created once
+    idempotency_key = models.CharField(_('Idempotency key'), max_length=100,
+                                        unique=True, null=True, blank=True, editable=False)
+
     created_at = models.DateTimeField(_('Created at'), default=timezone.now)
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = _('Notification')
         verbose_name_plural = _('Notifications')
+        indexes = [
+            # Retention purge (see notifications.tasks.purge_old_notifications_task)
+            models.Index(fields=['created_at'], name='notification_created_idx'),
+            # Broadcast branch of the notifications feed (see notifications.feed)
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_broadcast=True),
+                        name='notification_broadcast_idx'),
+        ]
 
     def __str__(self):
         return f'Notification {self.pk}'
 
-    # Helper method to mark notification as read
-    def mark_as_read(self):
-        if not self.is_read:
-            self.is_read = True
-            self.save(update_fields=['is_read'])
+    def mark_as_read(self, user):
+        """Mark the notification as read for `user` only"""
+        NotificationDelivery.objects.filter(notification=self).mark_as_read(user)
     
+    def add_recipients(self, users):
+        """
+        Add every user of the `users` queryset to the recipients with a single
+        query, users are never loaded in Python.
+
+        Coalescing: instead of getting a new delivery, a recipient whose latest
+        unread delivery has the same notification type and is recent enough
+        gets it moved to this notification with its grouped_count increased:
+        - within settings.NOTIFICATIONS_COALESCE_WINDOW for the types of
+          settings.NOTIFICATIONS_COALESCE_TYPES,
+        - since the start of the day, for any type, for the users in daily
+          digest mode (Profile.notification_digest).
+
+        Unlike recipients.add() no m2m_changed signal is sent, users already
+        recipients are skipped. The unread counters of the new recipients are
+        incremented and the notification is pushed to the recipients not in
+        digest mode. Every recipient of the types of settings.NOTIFICATIONS_EMAIL_TYPES
+        gets an email queued (NotificationEmail) in the same query, coalesced
+        or not, the email channel does not depend on the in-app grouping.
+
+        Preferences (NotificationPreference) are joined in the recipient
+        selection: muted users are skipped, users with the in-app channel
+        off get no delivery, users with the email channel off get no email.
+
+        Returns:
+            int: number of recipients added or coalesced.
+        """
+        quote_name = connection.ops.quote_name
+        table = quote_name(NotificationDelivery._meta.db_table)
+        column = lambda name: quote_name(NotificationDelivery._meta.get_field(name).column)
+        coalesce = self.notification_type in settings.NOTIFICATIONS_COALESCE_TYPES
+        window_start = self.created_at - timedelta(seconds=settings.NOTIFICATIONS_COALESCE_WINDOW)
+        day_start = timezone.localtime(self.created_at).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        # Recipients of an emailed type get an email queued (see notifications.emails), whether
+        # their delivery is new or coalesced, the unique (notification, user) skips duplicates
+        emails = ''
+        if self.notification_type in settings.NOTIFICATIONS_EMAIL_TYPES:
+            email_table = quote_name(NotificationEmail._meta.db_table)
+            email_columns = ', '.join(quote_name(NotificationEmail._meta.get_field(name).column) for name in
+                                      ('notification', 'user', 'status', 'attempts', 'next_attempt_at', 'created_at'))
+            emails = f""",
+                emailed AS (
+                    INSERT INTO {email_table} ({email_columns})
+                    SELECT {self.pk:d}, recipient.{quote_name(User._meta.pk.column)}, 'pending', 0, now(), now()
+                    FROM recipient
+                    WHERE recipient.email_channel
+                    ON CONFLICT DO NOTHING
+                )"""
+
+        # One LEFT JOIN on the (user, notification_type) unique index, no preference means every channel
+        recipients = users.order_by().annotate(preference=models.FilteredRelation(
+            'notification_preferences',
+            condition=models.Q(notification_preferences__notification_type=self.notification_type),
+        )).values(
+            'pk',
+            digest=models.F('profile__notification_digest'),
+            in_app_channel=Coalesce('preference__in_app', models.Value(True)),
+            email_channel=(Coalesce('preference__email', models.Value(True)) if emails else models.Value(False)),
+        ).filter(models.Q(in_app_channel=True) | models.Q(email_channel=True))
+        users_sql, params = recipients.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH recipient AS ({users_sql}),
+                target AS (
+                    -- Latest unread delivery of the same type, per recipient
+                    SELECT DISTINCT ON (delivery.{column('user')})
+                        delivery.id, recipient.digest
+                    FROM {table} AS delivery
+                    JOIN recipient ON recipient.{quote_name(User._meta.pk.column)} = delivery.{column('user')}
+                    JOIN {quote_name(Notification._meta.db_table)} AS notification
+                        ON notification.id = delivery.{column('notification')}
+                    WHERE recipient.in_app_channel AND NOT delivery.{column('is_read')}
+                        AND notification.notification_type = %s
+                        AND ((recipient.digest IS TRUE AND delivery.{column('created_at')} >= %s)
+                             OR (%s AND delivery.{column('created_at')} >= %s))
+                        AND NOT EXISTS (
+                            SELECT 1 FROM {table} AS existing
+                            WHERE existing.{column('notification')} = %s
+                                AND existing.{column('user')} = delivery.{column('user')})
+                    ORDER BY delivery.{column('user')}, delivery.{column('created_at')} DESC
+                ),
+                coalesced AS (
+                    UPDATE {table} AS delivery
+                    SET {column('notification')} = %s,
+                        {column('created_at')} = %s,
+                        {column('grouped_count')} = delivery.{column('grouped_count')} + 1
+                    FROM target
+                    WHERE delivery.id = target.id
+                    RETURNING delivery.{column('user')}, target.digest
+                ),
+                inserted AS (
+                    INSERT INTO {table}
+                        ({column('notification')}, {column('user')}, {column('is_read')},
+                         {column('created_at')}, {column('grouped_count')})
+                    SELECT %s, recipient.{quote_name(User._meta.pk.column)}, FALSE, %s, 1
+                    FROM recipient
+                    WHERE recipient.in_app_channel
+                        AND recipient.{quote_name(User._meta.pk.column)} NOT IN (SELECT {column('user')} FROM coalesced)
+                    ON CONFLICT DO NOTHING
+                    RETURNING {column('user')}
+                ){emails}
+                SELECT coalesced.{column('user')}, TRUE, coalesced.digest IS TRUE FROM coalesced
+                UNION ALL
+                SELECT inserted.{column('user')}, FALSE, recipient.digest IS TRUE
+                FROM inserted JOIN recipient
+                    ON recipient.{quote_name(User._meta.pk.column)} = inserted.{column('user')}
+                """,
+                [*params,
+                 self.notification_type, day_start, coalesce, window_start, self.pk,
+                 self.pk, self.created_at,
+                 self.pk, self.created_at],
+            )
+            rows = cursor.fetchall()
+
+        incr_unread_counts([user_id for user_id, coalesced, _digest in rows if not coalesced])
+        invalidate_dropdowns([user_id for user_id, coalesced, _digest in rows if coalesced])
+        push_notifications([(self, [user_id for user_id, _coalesced, digest in rows if not digest])])
+        return len(rows)
+
     @staticmethod
     def get_for_user(user):
         """
@@ -73,9 +217,214 @@ class Notification(models.Model):
         
         Returns direct notifications + broadcast notifications created after user joined.
         This prevents new users from seeing old announcement notifications.
+
+        Every notification is annotated with `is_read`, the read state of `user`.
         """
+        is_read = NotificationDelivery.objects.filter(
+            notification=models.OuterRef('pk'), user=user, is_read=True)
         return Notification.objects.filter(
             models.Q(recipients=user) | 
             (models.Q(is_broadcast=True) & 
              models.Q(created_at__gte=user.date_joined))
-        ).distinct().order_by('-created_at')
\ No newline at end of file
+        ).annotate(is_read=models.Exists(is_read)).distinct().order_by('-created_at')
+
+
+class NotificationDeliveryQuerySet(models.QuerySet):
+
+    def unread(self):
+        return self.filter(is_read=False)
+
+    def mark_as_read(self, user):
+        """
+        Mark the unread deliveries of `user` in the queryset as read with a
+        single UPDATE and decrement the unread counter of `user` by as many.
+
+        Returns:
+            int: number of deliveries marked as read.
+        """
+        count = self.filter(user=user).unread().update(is_read=True)
+        if count:
+            decr_unread_count(user.pk, count)
+        return count
+
+
+class NotificationDelivery(models.Model):
+    """
+    A notification delivered to one of its recipients, with the read state
+    of that recipient.
+
+    created_at is copied from the notification so "my notifications, newest
+    first" is served by the (user, -created_at) indexes without a join.
+
+    A delivery may group several notifications of the same type (see
+    Notification.add_recipients), it then points to the latest one and
+    grouped_count tells how many it stands for.
+    """
+
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE,
+                                    related_name='deliveries', verbose_name=_('Notification'))
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                            related_name='notification_deliveries', verbose_name=_('User'))
+    is_read = models.BooleanField(_('Is read'), default=False)
+    created_at = models.DateTimeField(_('Created at'), default=timezone.now)
+    grouped_count = models.PositiveIntegerField(_('Grouped notifications'), default=1,
+                                                help_text=_('Number of notifications grouped in this delivery.'))
+
+    objects = NotificationDeliveryQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = _('Notification delivery')
+        verbose_name_plural = _('Notification deliveries')
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'user'], name='notification_delivery_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-notification'], name='delivery_user_created_idx'),
+            # Small partial index for unread badges and "my unread, newest first"
+            models.Index(fields=['user', '-created_at'], condition=models.Q(is_read=False),
+                        name='delivery_user_unread_idx'),
+        ]
+
+    def __str__(self):
+        return f'Notification {self.notification_id} to user {self.user_id}'
+
+class NotificationEmailQuerySet(models.QuerySet):
+
+    def due(self):
+        """Pending emails whose next attempt is due"""
+        return self.filter(status='pending', next_attempt_at__lte=timezone.now())
+
+
+class NotificationEmail(models.Model):
+    """
+    Email of a notification to one of its recipients, queued by
+    Notification.add_recipients for the types of settings.NOTIFICATIONS_EMAIL_TYPES
+    and sent in batches by notifications.emails.
+    """
+    STATUS_CHOICES = [
+        ('pending', _('Pending')),
+        ('sent', _('Sent')),
+        # Refused by the mail server (bounce) or out of attempts
+        ('failed', _('Failed')),
+    ]
+
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE,
+                                    related_name='emails', verbose_name=_('Notification'))
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                            related_name='notification_emails', verbose_name=_('User'))
+    status = models.CharField(_('Status'), max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(_('Attempts'), default=0)
+    next_attempt_at = models.DateTimeField(_('Next attempt at'), default=timezone.now)
+    sent_at = models.DateTimeField(_('Sent at'), null=True, blank=True)
+    created_at = models.DateTimeField(_('Created at'), default=timezone.now)
+
+    objects = NotificationEmailQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _('Notification email')
+        verbose_name_plural = _('Notification emails')
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'user'], name='notification_email_unique'),
+        ]
+        indexes = [
+            # Small partial index of the emails waiting to be sent
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'),
+                        name='notification_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'Email of notification {self.notification_id} to user {self.user_id}'
+
+
+class NotificationPreference(models.Model):
+    """
+    Channels a user receives the notifications of one type on, applied by
+    Notification.add_recipients when selecting the recipients. A user
+    without preference for a type receives it on every channel.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                            related_name='notification_preferences', verbose_name=_('User'))
+    notification_type = models.CharField(_('Notification type'), max_length=50,
+                                        choices=Notification.NOTIFICATION_TYPES)
+    in_app = models.BooleanField(_('In-app'), default=True)
+    email = models.BooleanField(_('Email'), default=True,
+                                help_text=_('Only the types of NOTIFICATIONS_EMAIL_TYPES are sent by email.'))
+
+    class Meta:
+        verbose_name = _('Notification preference')
+        verbose_name_plural = _('Notification preferences')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'notification_type'], name='notification_preference_unique'),
+        ]
+
+    def __str__(self):
+        return f'Preference of user {self.user_id} for {self.notification_type}'
+
+    @property
+    def muted(self):
+        return not (self.in_app or self.email)
+
+
+def circle_polygon(center, radius):
+    """
+    Polygon (SRID 4326) of the circle of `radius` kilometers around `center`,
+    drawn in an azimuthal equidistant projection centered on it so the
+    radius is exact in every direction.
+    """
+    projection = SpatialReference(f'+proj=aeqd +lat_0={center.y} +lon_0={center.x} +datum=WGS84 +units=m +no_defs')
+    circle = Point(0, 0).buffer(radius * 1000, quadsegs=16)
+    circle.transform(CoordTransform(projection, SpatialReference(4326)))
+    circle.srid = 4326
+    return circle
+
+
+class AnnouncementAudience(models.Model):
+    """
+    Audience of a targeted announcement: the users living in some cities
+    (wilayas) and/or within a circle.
+
+    The audience is stored once and never fanned out, it is resolved when
+    feeds are read (see notifications.feed) with index-backed membership
+    checks: the city of the user against the cities (through table index),
+    the location of the user against the circle polygon (GiST index).
+    """
+
+    notification = models.OneToOneField(Notification, on_delete=models.CASCADE, primary_key=True,
+                                        related_name='audience', verbose_name=_('Notification'))
+    cities = models.ManyToManyField(City, blank=True, related_name='announcement_audiences',
+                                    verbose_name=_('Cities'))
+    center = models.PointField(_('Center'), srid=4326, null=True, blank=True)
+    radius = models.FloatField(_('Radius'), null=True, blank=True, help_text=_('Radius of the circle in kilometers.'))
+    # Materialized from center and radius
+    area = models.PolygonField(_('Area'), srid=4326, null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = _('Announcement audience')
+        verbose_name_plural = _('Announcement audiences')
+
+    def __str__(self):
+        return f'Audience of notification {self.notification_id}'
+
+    def save(self, *args, **kwargs):
+        if self.center is not None and self.radius:
+            self.area = circle_polygon(self.center, self.radius)
+        else:
+            self.area = None
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def create_announcement(message, cities=(), center=None, radius=None):
+        """
+        Create an announcement for the users of `cities` (City instances or
+        ids) and the users living within `radius` kilometers of `center`.
+
+        Returns:
+            Notification: the announcement.
+        """
+        notification = Notification.objects.create(notification_type='announcement', message=message)
+        audience = AnnouncementAudience.objects.create(notification=notification, center=center, radius=radius)
+        if cities:
+            audience.cities.set(cities)
+        return notification
@@ -0,0 +1,141 @@
+"""
+Real-time notifications push
+
+Fan-out publishes one message per notification on a Redis pub/sub channel
+(settings.NOTIFICATIONS_PUSH_CHANNEL) once the transaction commits:
+
+    {"users": [recipient ids], "notification": {"id": ..., "type": ...}}
+
+Every web process runs a single subscriber (Broadcaster) dispatching the
+messages to the event streams (NotificationsStreamView) of its connected
+recipients, so a notification reaches its recipients whatever process
+they are connected to. An idle stream costs a coroutine and a queue, no
+thread, Redis or database connection.
+
+The unread counts of the connected recipients are read once per message
+by the subscriber (one cache round trip, see get_unread_counts) and sent
+along with the notification, a broadcast to thousands of streams does
+not cost a cache call per stream.
+"""
+import asyncio
+import json
+import logging
+
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from notifications.counters import get_unread_counts
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.NOTIFICATIONS_PUSH_REDIS_URL)
+    return _client
+
+
+def _publish(messages):
+    try:
+        pipeline = _get_client().pipeline(transaction=False)
+        for message in messages:
+            pipeline.publish(settings.NOTIFICATIONS_PUSH_CHANNEL, json.dumps(message))
+        pipeline.execute()
+    except redis.RedisError:
+        # Connected users get it on their next page load
+        logger.warning("Could not push %s notifications", len(messages), exc_info=True)
+
+
+def push_notifications(deliveries):
+    """
+    Push notifications to their connected recipients once the transaction commits.
+
+    Args:
+        deliveries: iterable of (notification, recipient ids).
+    """
+    messages = [
+        {'users': list(user_ids), 'notification': {'id': notification.pk, 'type': notification.notification_type}}
+        for notification, user_ids in deliveries if user_ids
+    ]
+    if messages:
+        transaction.on_commit(lambda: _publish(messages))
+
+
+class Broadcaster:
+    """
+    Subscriber of the push channel, one per process, forwarding every
+    message to the queues of the streams of its recipients.
+    """
+
+    def __init__(self):
+        self.streams = {}
+        self.task = None
+
+    def connect(self, user_id):
+        """Register a stream of `user_id`, returns the queue receiving its notifications"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.listen())
+        queue = asyncio.Queue(maxsize=settings.NOTIFICATIONS_PUSH_QUEUE_SIZE)
+        self.streams.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def disconnect(self, user_id, queue):
+        queues = self.streams.get(user_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.streams.pop(user_id, None)
+
+    def connected(self, user_ids):
+        """Ids of `user_ids` with a stream open on this process"""
+        return [user_id for user_id in user_ids if user_id in self.streams]
+
+    def dispatch(self, message, unread_counts=None):
+        """
+        Queue the notification of `message` on the streams of its recipients,
+        with their unread count (`unread_counts` by user id) when known.
+        """
+        message = json.loads(message)
+        unread_counts = unread_counts or {}
+        for user_id in message['users']:
+            notification = message['notification']
+            if user_id in unread_counts:
+                notification = dict(notification, unread=unread_counts[user_id])
+            for queue in self.streams.get(user_id, ()):
+                try:
+                    queue.put_nowait(notification)
+                except asyncio.QueueFull:
+                    # Slow client, it still gets the latest unread count
+                    pass
+
+    async def handle(self, message):
+        """Dispatch `message` with the unread counts of its connected recipients"""
+        user_ids = self.connected(json.loads(message)['users'])
+        unread_counts = {}
+        if user_ids:
+            try:
+                unread_counts = await sync_to_async(get_unread_counts)(user_ids)
+            except Exception:
+                # The notification is still pushed, the badge is updated on the next page load
+                logger.warning("Could not count the unread notifications of %s users", len(user_ids), exc_info=True)
+        self.dispatch(message, unread_counts)
+
+    async def listen(self):
+        while True:
+            try:
+                async with redis.asyncio.Redis.from_url(settings.NOTIFICATIONS_PUSH_REDIS_URL) as client, \
+                        client.pubsub() as pubsub:
+                    await pubsub.subscribe(settings.NOTIFICATIONS_PUSH_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            await self.handle(message['data'])
+            except redis.RedisError:
+                logger.warning("Notifications push subscriber disconnected, reconnecting", exc_info=True)
+                await asyncio.sleep(1)
+
+
+broadcaster = Broadcaster()
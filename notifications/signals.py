@@ -1,10 +1,15 @@
 from django.contrib.auth import get_user_model
 from django.dispatch import Signal
-from django.db.models.signals import post_save
+from django.db.models import Q
+from django.db.models.signals import post_save, m2m_changed
 from django.dispatch import receiver
 from core.models import Initiative
+from core.outbox import enqueue_task
 from users.models import UpgradeRequest
 from notifications.models import Notification
+from notifications.counters import incr_unread_counts
+from notifications.push import push_notifications
+from notifications.tasks import fan_out_to_managers_task, fan_out_to_nearby_volunteers_task
 
 User = get_user_model()
 
@@ -14,6 +19,42 @@ initiative_started_signal = Signal()
 initiative_completed_signal = Signal()
 
 
+def get_initiative_participants(initiative):
+    """Users queryset of the creator and the volunteers of `initiative`"""
+    return User.objects.filter(Q(pk=initiative.created_by_id) |
+                               Q(pk__in=initiative.volunteers.values('pk')))
+
+
+def create_notification(idempotency_key=None, **fields):
+    """
+    Create a notification, only once per `idempotency_key`.
+
+    Lifecycle signals are sent with the idempotency key of the transition
+    (see core.tasks.get_idempotency_key), if a notification already exists
+    for that key nothing is created.
+
+    Returns:
+        Notification: the created notification, None if it already existed.
+    """
+    if idempotency_key is None:
+        return Notification.objects.create(**fields)
+    notification, created = Notification.objects.get_or_create(idempotency_key=idempotency_key,
+                                                                defaults=fields)
+    return notification if created else None
+
+
+@receiver(m2m_changed, sender=Notification.recipients.through)
+def count_unread_recipients(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Increment the unread counters of the users added with recipients.add()
+    (pk_set only holds the users that were not recipients yet) and push
+    them the notification.
+    """
+    if action == 'post_add' and not reverse and pk_set:
+        incr_unread_counts(pk_set)
+        push_notifications([(instance, pk_set)])
+
+
 @receiver(post_save, sender=Initiative)
 def notify_managers_initiative_created(sender, instance, created, **kwargs):
     """
@@ -21,34 +62,49 @@ def notify_managers_initiative_created(sender, instance, created, **kwargs):
 
     Notify all users with account type manager to review
     new initiative (except the initiative creator).
+
+    The managers are added by notifications.tasks.fan_out_to_managers_task,
+    enqueued in the same transaction.
     """
     if created:
-        managers = User.objects.filter(profile__account_type='manager').exclude(id=instance.created_by.id)
-
         notification = Notification.objects.create(
             notification_type='initiative_created',
             related_initiative=instance)
         
-        notification.recipients.add(*managers)
+        enqueue_task(fan_out_to_managers_task, notification.id, exclude_user_id=instance.created_by_id)
 
 
 @receiver(initiative_approved_signal)
-def handle_initiative_approval(sender, instance, **kwargs):
+def handle_initiative_approval(sender, instance, idempotency_key=None, **kwargs):
     """
     This signal is emitted from core.tasks.evaluate_initiative_reviews_task
     when the initiative is approved successfully.
 
-    Notify the creator of the initiative.
+    Notify the creator of the initiative, and the volunteers living within
+    settings.NOTIFICATIONS_NEARBY_RADIUS of the initiative, added by
+    notifications.tasks.fan_out_to_nearby_volunteers_task enqueued in the
+    same transaction.
     """
-    notification = Notification.objects.create(
+    notification = create_notification(
+        idempotency_key=idempotency_key,
         notification_type='initiative_approved',
         related_initiative=instance
     )
-    notification.recipients.add(instance.created_by)
+    if notification:
+        notification.add_recipients(User.objects.filter(pk=instance.created_by_id))
+
+    if instance.geo_location is not None:
+        nearby_notification = create_notification(
+            idempotency_key=f'{idempotency_key}:nearby' if idempotency_key else None,
+            notification_type='initiative_nearby',
+            related_initiative=instance
+        )
+        if nearby_notification:
+            enqueue_task(fan_out_to_nearby_volunteers_task, nearby_notification.id)
 
 
 @receiver(initiative_review_failed_signal)
-def handle_initiative_review_failed(sender, instance, reason, **kwargs):
+def handle_initiative_review_failed(sender, instance, reason, idempotency_key=None, **kwargs):
     """
     This signal is emitted from core.tasks.evaluate_initiative_reviews_task
     when the initiative evaluation failed due to lack of reviews or majority
@@ -60,50 +116,48 @@ def handle_initiative_review_failed(sender, instance, reason, **kwargs):
         reason (str): reason for evaluation failure can be 'lack_of_reviews'
         or 'rejected_by_managers'.
     """
-    notification = Notification.objects.create(
+    notification = create_notification(
+        idempotency_key=idempotency_key,
         notification_type='initiative_review_failed',
         related_initiative=instance,
         message=reason,
     )
-    notification.recipients.add(instance.created_by)
+    if notification:
+        notification.add_recipients(User.objects.filter(pk=instance.created_by_id))
 
 
 @receiver(initiative_started_signal)
-def handle_initiative_started_signal(sender, instance, **kwargs):
+def handle_initiative_started_signal(sender, instance, idempotency_key=None, **kwargs):
     """
     This signal is emitted from core.tasks.transition_initiative_to_ongoing_task
     when the initiative starts.
 
     Notify volunteers and initiative creator.
     """
-    notification = Notification.objects.create(
+    notification = create_notification(
+        idempotency_key=idempotency_key,
         notification_type='initiative_started',
         related_initiative=instance
     )
-    volunteers = instance.volunteers.all()
-    notification.recipients.add(instance.created_by)
-
-    if volunteers.exists():
-        notification.recipients.add(*volunteers)
+    if notification:
+        notification.add_recipients(get_initiative_participants(instance))
 
 
 @receiver(initiative_completed_signal)
-def handle_initiative_completed_signal(sender, instance, **kwargs):
+def handle_initiative_completed_signal(sender, instance, idempotency_key=None, **kwargs):
     """
     This signal is emitted from core.tasks.transition_initiative_to_completed_task
     when the initiative is completed.
 
     Notify volunteers and initiative creator.
     """
-    notification = Notification.objects.create(
+    notification = create_notification(
+        idempotency_key=idempotency_key,
         notification_type='initiative_completed',
         related_initiative=instance
     )
-    volunteers = instance.volunteers.all()
-    notification.recipients.add(instance.created_by)
-
-    if volunteers.exists():
-        notification.recipients.add(*volunteers)
+    if notification:
+        notification.add_recipients(get_initiative_participants(instance))
 
 
 @receiver(post_save, sender=UpgradeRequest)
@@ -113,12 +167,13 @@ def notify_managers_upgrade_request_created(sender, instance, created, **kwargs)
 
     Notify all users with account type manager to review
     the new upgrade request.
+
+    The managers are added by notifications.tasks.fan_out_to_managers_task,
+    enqueued in the same transaction.
     """
     if created:
-        managers = User.objects.filter(profile__account_type='manager')
-
         notification = Notification.objects.create(
             notification_type='upgrade_request_created',
             related_upgrade_request=instance)
         
-        notification.recipients.add(*managers)
\ No newline at end of file
+        enqueue_task(fan_out_to_managers_task, notification.id)
\ No newline at end of file
@@ -0,0 +1,233 @@
+import math
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.gis.measure import D
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from notifications.counters import decr_unread_count, invalidate_dropdowns, reconcile_unread_counts
+from notifications.emails import send_due_emails
+from notifications.models import AnnouncementAudience, Notification, NotificationDelivery, NotificationEmail
+
+User = get_user_model()
+
+
+@shared_task
+def reconcile_unread_counts_task():
+    """
+    Periodic (celery beat) task recounting the cached unread notifications
+    counters (see notifications.counters) of the users who logged in within
+    settings.UNREAD_NOTIFICATIONS_CACHE_TIMEOUT, the only ones likely to
+    have a counter cached.
+
+    Users are recounted in chunks of settings.UNREAD_NOTIFICATIONS_RECONCILE_CHUNK_SIZE,
+    one grouped query per chunk.
+
+    Returns:
+        int: number of users recounted.
+    """
+    active_since = timezone.now() - timedelta(seconds=settings.UNREAD_NOTIFICATIONS_CACHE_TIMEOUT)
+    user_ids = User.objects.filter(last_login__gte=active_since).order_by('pk').values_list('pk', flat=True)
+    chunk_size = settings.UNREAD_NOTIFICATIONS_RECONCILE_CHUNK_SIZE
+
+    recounted = 0
+    last_id = 0
+    while True:
+        chunk = list(user_ids.filter(pk__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+        reconcile_unread_counts(chunk)
+        recounted += len(chunk)
+        last_id = chunk[-1]
+    return recounted
+
+
+def _add_recipients_in_chunks(notification, users):
+    """
+    Add the users of the `users` queryset to the recipients of `notification`
+    in chunks of settings.NOTIFICATIONS_FAN_OUT_CHUNK_SIZE users, one
+    INSERT ... SELECT and transaction per chunk (see Notification.add_recipients).
+
+    Chunks are bounded by user ids, only the boundary ids are read.
+
+    Returns:
+        int: number of recipients added.
+    """
+    user_ids = users.order_by('pk').values_list('pk', flat=True)
+    chunk_size = settings.NOTIFICATIONS_FAN_OUT_CHUNK_SIZE
+
+    added = 0
+    last_id = 0
+    while True:
+        # Last user of the chunk, None for the last chunk
+        upper_id = user_ids.filter(pk__gt=last_id)[chunk_size - 1:chunk_size].first()
+        chunk = users.filter(pk__gt=last_id)
+        if upper_id is not None:
+            chunk = chunk.filter(pk__lte=upper_id)
+        with transaction.atomic():
+            added += notification.add_recipients(chunk)
+        if upper_id is None:
+            return added
+        last_id = upper_id
+
+
+@shared_task(autoretry_for=(DatabaseError,), retry_backoff=True, max_retries=5)
+def fan_out_to_managers_task(notification_id, exclude_user_id=None):
+    """
+    Add every manager (except `exclude_user_id`) to the recipients of a notification.
+
+    Enqueued through the task outbox (core.outbox) by the receivers of
+    notifications.signals, so creating an initiative or an upgrade request
+    does not wait for the fan-out.
+
+    Recipients are inserted in chunks (see _add_recipients_in_chunks). A
+    retried or duplicated task skips the managers already notified.
+
+    Returns:
+        int: number of recipients added.
+    """
+    notification = Notification.objects.filter(pk=notification_id).first()
+    if notification is None:
+        # Deleted with its initiative or upgrade request
+        return 0
+
+    managers = User.objects.filter(profile__account_type='manager')
+    if exclude_user_id is not None:
+        managers = managers.exclude(pk=exclude_user_id)
+    return _add_recipients_in_chunks(notification, managers)
+
+
+def get_nearby_volunteers(point, radius):
+    """
+    Users queryset of the volunteers whose profile location is within
+    `radius` kilometers of `point`.
+
+    Profile.geo_location is a geometry (SRID 4326) so distances in meters
+    can't use its spatial index, the candidates are first selected by an
+    index-backed ST_DWithin on a box in degrees that contains the circle,
+    then filtered on the exact (spheroid) distance.
+    """
+    latitude_degrees = radius / 111.32
+    # A degree of longitude shrinks with the latitude, use the circle's edge closest to a pole
+    edge_latitude = min(abs(point.y) + latitude_degrees, 89.0)
+    degrees = max(latitude_degrees, radius / (111.32 * math.cos(math.radians(edge_latitude))))
+    return User.objects.filter(
+        profile__account_type='volunteer',
+        profile__geo_location__dwithin=(point, degrees),
+        profile__geo_location__distance_lte=(point, D(km=radius)),
+    )
+
+
+@shared_task(autoretry_for=(DatabaseError,), retry_backoff=True, max_retries=5)
+def fan_out_to_nearby_volunteers_task(notification_id, radius=None):
+    """
+    Add the volunteers living within `radius` kilometers (default
+    settings.NOTIFICATIONS_NEARBY_RADIUS) of the initiative of a notification
+    to its recipients, except the initiative creator.
+
+    Enqueued through the task outbox (core.outbox) when an initiative is
+    approved, see notifications.signals.handle_initiative_approval.
+    Recipients are inserted in chunks (see _add_recipients_in_chunks).
+
+    Returns:
+        int: number of recipients added.
+    """
+    notification = Notification.objects.select_related('related_initiative').filter(pk=notification_id).first()
+    if notification is None or notification.related_initiative is None:
+        return 0
+    initiative = notification.related_initiative
+    if initiative.geo_location is None:
+        return 0
+
+    if radius is None:
+        radius = settings.NOTIFICATIONS_NEARBY_RADIUS
+    volunteers = get_nearby_volunteers(initiative.geo_location, radius).exclude(pk=initiative.created_by_id)
+    return _add_recipients_in_chunks(notification, volunteers)
+
+
+@shared_task
+def send_notification_emails_task():
+    """
+    Periodic (celery beat) task sending the due notification emails, at
+    most settings.NOTIFICATIONS_EMAIL_RATE_LIMIT per run, in batches sharing
+    one connection to the mail server (see notifications.emails).
+
+    Returns:
+        int: number of emails sent.
+    """
+    return send_due_emails()
+
+
+def _purge_notifications_chunk(cutoff, chunk_size):
+    """
+    Delete the oldest `chunk_size` notifications created before `cutoff`
+    and their deliveries, in the current transaction.
+
+    Notifications are picked through the created_at index and locked with
+    SKIP LOCKED, deliveries are deleted through the (notification, user)
+    unique index, plain DELETEs, nothing is loaded in Python but ids.
+
+    Returns:
+        int: number of deleted notifications.
+    """
+    notification_ids = list(
+        Notification.objects.filter(created_at__lt=cutoff)
+        .order_by('created_at')
+        .select_for_update(skip_locked=True)
+        .values_list('pk', flat=True)[:chunk_size]
+    )
+    if not notification_ids:
+        return 0
+
+    deliveries = NotificationDelivery.objects.filter(notification_id__in=notification_ids)
+    recipients = deliveries.order_by().values('user_id').annotate(unread=Count('id', filter=Q(is_read=False)))
+    user_ids = []
+    for row in recipients:
+        user_ids.append(row['user_id'])
+        if row['unread']:
+            decr_unread_count(row['user_id'], row['unread'])
+    # Cached dropdowns may list the purged notifications, read or not
+    invalidate_dropdowns(user_ids)
+    deliveries.delete()
+    NotificationEmail.objects.filter(notification_id__in=notification_ids).delete()
+    AnnouncementAudience.objects.filter(notification_id__in=notification_ids).delete()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {connection.ops.quote_name(Notification._meta.db_table)} WHERE id = ANY(%s)",
+            [notification_ids],
+        )
+    return len(notification_ids)
+
+
+@shared_task
+def purge_old_notifications_task(retention_days=None):
+    """
+    Periodic (celery beat) task deleting the notifications older than
+    `retention_days` (default settings.NOTIFICATIONS_RETENTION_DAYS) and
+    their deliveries.
+
+    Deletes in chunks of settings.NOTIFICATIONS_PURGE_CHUNK_SIZE
+    notifications, one transaction per chunk, so locks stay short and the
+    purge can be stopped at any time. Unread counters of the recipients of
+    unread purged deliveries are decremented and the cached dropdowns of
+    every recipient of a purged delivery are invalidated.
+
+    Returns:
+        int: number of deleted notifications.
+    """
+    if retention_days is None:
+        retention_days = settings.NOTIFICATIONS_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=retention_days)
+
+    purged = 0
+    while True:
+        with transaction.atomic():
+            deleted = _purge_notifications_chunk(cutoff, settings.NOTIFICATIONS_PURGE_CHUNK_SIZE)
+        if not deleted:
+            return purged
+        purged += deleted
+
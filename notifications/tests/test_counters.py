@@ -0,0 +1,213 @@
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from redis.exceptions import ConnectionError as RedisConnectionError
+from users.models import City
+from users.tests.test_utils import create_new_user
+from notifications.models import Notification, NotificationDelivery
+from notifications.counters import get_unread_count
+from notifications.feed import encode_cursor
+from notifications.tasks import reconcile_unread_counts_task, purge_old_notifications_task
+
+UserModel = get_user_model()
+
+
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES)
+class UnreadCountersTestCase(TestCase):
+    @classmethod
+    def setUpTestData(self):
+        call_command('load_spatial_layers', 'DZ')
+        self.annaba_city = City.objects.get(name='Annaba')
+        self.point_in_annaba = self.annaba_city.get_random_location_point()
+        self.manager = create_new_user(email='manager_user@gmail.com',
+                                    username='manager_user',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447766',
+                                    bio='Some good bio',
+                                    account_type='manager',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_counter_follows_fan_out_and_reads(self):
+        """
+        Tests that the cached counter is incremented on fan-out, decremented on read
+        and served without queries.
+        """
+        managers = UserModel.objects.filter(profile__account_type='manager')
+        self.assertEqual(get_unread_count(self.manager), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Notification.objects.create(notification_type='announcement')
+            first.add_recipients(managers)
+            second = Notification.objects.create(notification_type='announcement')
+            second.recipients.add(self.manager)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count(self.manager), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.mark_as_read(self.manager)
+            # Already read, not counted twice
+            first.mark_as_read(self.manager)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count(self.manager), 1)
+
+    def test_reconcile_fixes_drifted_counters(self):
+        """
+        Tests that the reconcile task recounts the counters of recently active users.
+        """
+        self.manager.last_login = timezone.now()
+        self.manager.save()
+        notification = Notification.objects.create(notification_type='announcement')
+        # Bypasses the counters
+        NotificationDelivery.objects.create(notification=notification, user=self.manager)
+        cache.set(f'notifications:unread:{self.manager.pk}', 7)
+
+        self.assertEqual(reconcile_unread_counts_task(), 1)
+        self.assertEqual(get_unread_count(self.manager), 1)
+
+    def test_navbar_badge_uses_the_counter(self):
+        """
+        Tests that the navbar badge shows the cached unread count.
+        """
+        self.client.login(username='manager_user', password='qsdflkjlkj')
+        cache.set(f'notifications:unread:{self.manager.pk}', 42)
+
+        response = self.client.get(reverse('notifications-list'))
+
+        self.assertEqual(response.context['unread_notifications_count'], 42)
+
+    def test_navbar_badge_counted_from_the_database_when_cache_is_down(self):
+        """
+        Tests that pages still render, with the badge counted from the
+        database, when the cache (Redis) is unreachable.
+        """
+        self.client.login(username='manager_user', password='qsdflkjlkj')
+        expected = NotificationDelivery.objects.filter(user=self.manager).unread().count()
+
+        with mock.patch('notifications.counters.cache.get', side_effect=RedisConnectionError), \
+                mock.patch('notifications.counters.cache.add', side_effect=RedisConnectionError):
+            response = self.client.get(reverse('notifications-list'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['unread_notifications_count'], expected)
+
+    def test_dropdown_is_cached_until_a_notification_arrives(self):
+        """
+        Tests that the navbar dropdown is rendered with one query, served from the cache
+        afterwards and rendered again once a new notification is delivered.
+        """
+        self.client.login(username='manager_user', password='qsdflkjlkj')
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(notification_type='announcement').recipients.add(self.manager)
+
+        # Session and user
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('notifications-dropdown'))
+        self.assertContains(response, 'fa-bullhorn', count=1)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('notifications-dropdown'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(notification_type='announcement').recipients.add(self.manager)
+
+        response = self.client.get(reverse('notifications-dropdown'))
+        self.assertContains(response, 'fa-bullhorn', count=2)
+
+    def test_bulk_mark_as_read(self):
+        """
+        Tests that the notifications are marked as read by id, up to a cursor and all at once,
+        each with a single UPDATE, and that the counter is decremented by as many.
+        """
+        self.client.login(username='manager_user', password='qsdflkjlkj')
+        now = timezone.now()
+        notifications = [Notification.objects.create(notification_type='announcement',
+                                                      created_at=now - timezone.timedelta(minutes=minutes))
+                        for minutes in range(6)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for notification in notifications:
+                notification.add_recipients(UserModel.objects.filter(pk=self.manager.pk))
+        self.assertEqual(get_unread_count(self.manager), 6)
+
+        with self.assertNumQueries(1):
+            marked = NotificationDelivery.objects.filter(user=self.manager).mark_as_read(self.manager)
+        self.assertEqual(marked, 6)
+        NotificationDelivery.objects.update(is_read=False)
+        cache.set(f'notifications:unread:{self.manager.pk}', 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('notifications-mark-read-ids'),
+                                        {'ids': [notifications[0].pk, notifications[1].pk]})
+        self.assertEqual(response.json()['marked'], 2)
+        self.assertEqual(get_unread_count(self.manager), 4)
+
+        # Newest first: notifications[3] and older
+        cursor = encode_cursor(notifications[3].created_at, notifications[3].pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('notifications-mark-read-up-to'), {'cursor': cursor})
+        self.assertEqual(response.json()['marked'], 3)
+        self.assertEqual(get_unread_count(self.manager), 1)
+        self.assertFalse(NotificationDelivery.objects.get(notification=notifications[2]).is_read)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('notifications-mark-read'))
+        self.assertEqual(response.json()['marked'], 1)
+        self.assertEqual(get_unread_count(self.manager), 0)
+        self.assertFalse(NotificationDelivery.objects.filter(user=self.manager).unread().exists())
+
+        self.assertEqual(self.client.post(reverse('notifications-mark-read-up-to'), {'cursor': 'invalid'}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('notifications-mark-read-ids'), {'ids': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('notifications-mark-read')).status_code, 405)
+
+    def test_purge_deletes_old_notifications_only(self):
+        """
+        Tests that the purge task deletes the notifications past the retention period
+        with their deliveries and decrements the unread counters.
+        """
+        old = Notification.objects.create(notification_type='announcement',
+                                          created_at=timezone.now() - timezone.timedelta(days=200))
+        recent = Notification.objects.create(notification_type='announcement')
+        with self.captureOnCommitCallbacks(execute=True):
+            old.recipients.add(self.manager)
+            recent.recipients.add(self.manager)
+        self.assertEqual(get_unread_count(self.manager), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            purged = purge_old_notifications_task(retention_days=180)
+
+        self.assertEqual(purged, 1)
+        self.assertFalse(Notification.objects.filter(pk=old.pk).exists())
+        self.assertFalse(NotificationDelivery.objects.filter(notification_id=old.pk).exists())
+        self.assertTrue(Notification.objects.filter(pk=recent.pk).exists())
+        self.assertEqual(get_unread_count(self.manager), 1)
+
+    def test_purge_invalidates_the_cached_dropdowns(self):
+        """
+        Tests that purged notifications leave the cached dropdowns of their
+        recipients, including the notifications they had already read.
+        """
+        old = Notification.objects.create(notification_type='announcement', message='Old news',
+                                          created_at=timezone.now() - timezone.timedelta(days=200))
+        with self.captureOnCommitCallbacks(execute=True):
+            old.recipients.add(self.manager)
+            old.mark_as_read(self.manager)
+        self.client.login(username='manager_user', password='qsdflkjlkj')
+        self.assertContains(self.client.get(reverse('notifications-dropdown')), 'Old news')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            purge_old_notifications_task(retention_days=180)
+
+        self.assertNotContains(self.client.get(reverse('notifications-dropdown')), 'Old news')
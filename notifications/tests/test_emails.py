@@ -0,0 +1,161 @@
+from smtplib import SMTPRecipientsRefused
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from users.models import City
+from users.tests.test_utils import create_new_user
+from core.tests.test_utils import create_initiative
+from notifications.emails import send_due_emails
+from notifications.models import Notification, NotificationDelivery, NotificationEmail, NotificationPreference
+
+UserModel = get_user_model()
+
+
+class BouncingEmailBackend(locmem.EmailBackend):
+    """locmem backend refusing the addresses of bounce.test and counting its connections"""
+    connections = 0
+
+    def open(self):
+        BouncingEmailBackend.connections += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if any(address.endswith('@bounce.test') for address in message.to):
+                raise SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES,
+                   EMAIL_BACKEND='notifications.tests.test_emails.BouncingEmailBackend')
+class NotificationEmailsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(self):
+        call_command('load_spatial_layers', 'DZ')
+        self.annaba_city = City.objects.get(name='Annaba')
+        self.point_in_annaba = self.annaba_city.get_random_location_point()
+        self.volunteers = []
+        for index, domain in enumerate(['gmail.com', 'gmail.com', 'bounce.test']):
+            volunteer = create_new_user(email=f'volunteer_{index}@{domain}',
+                                        username=f'volunteer_{index}',
+                                        password='qsdflkjlkj',
+                                        phone_number=f'+21355544770{index}',
+                                        bio='Some good bio',
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba,
+                                        )
+            volunteer.email = f'volunteer_{index}@{domain}'
+            volunteer.save()
+            self.volunteers.append(volunteer)
+        self.manager = create_new_user(email='manager_user@gmail.com',
+                                    username='manager_user',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447766',
+                                    bio='Some good bio',
+                                    account_type='manager',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    )
+        self.initiative = create_initiative(self.manager, 'Some info', self.annaba_city, self.point_in_annaba)
+
+    def setUp(self):
+        BouncingEmailBackend.connections = 0
+
+    def test_emails_are_queued_for_emailed_types_only(self):
+        """
+        Tests that add_recipients queues an email per new recipient of the emailed types only.
+        """
+        volunteers = UserModel.objects.filter(pk__in=[volunteer.pk for volunteer in self.volunteers])
+        started = Notification.objects.create(notification_type='initiative_started',
+                                              related_initiative=self.initiative)
+        started.add_recipients(volunteers)
+        approved = Notification.objects.create(notification_type='initiative_approved',
+                                               related_initiative=self.initiative)
+        approved.add_recipients(volunteers)
+
+        self.assertEqual(NotificationEmail.objects.filter(notification=started, status='pending').count(), 3)
+        self.assertFalse(NotificationEmail.objects.filter(notification=approved).exists())
+
+    def test_email_queued_when_the_delivery_is_coalesced(self):
+        """
+        Tests that a notification coalesced into the previous delivery of the
+        recipient still queues its own email.
+        """
+        volunteer = UserModel.objects.filter(pk=self.volunteers[0].pk)
+        first = Notification.objects.create(notification_type='initiative_started',
+                                            related_initiative=self.initiative)
+        first.add_recipients(volunteer)
+        second = Notification.objects.create(notification_type='initiative_started',
+                                             related_initiative=self.initiative)
+        second.add_recipients(volunteer)
+
+        delivery = NotificationDelivery.objects.get(user=self.volunteers[0])
+        self.assertEqual(delivery.notification, second)
+        self.assertEqual(delivery.grouped_count, 2)
+        self.assertEqual(set(NotificationEmail.objects.filter(user=self.volunteers[0])
+                             .values_list('notification', flat=True)), {first.pk, second.pk})
+
+    def test_batch_is_sent_over_one_connection_and_tolerates_bounces(self):
+        """
+        Tests that the due emails are sent over a single connection, a refused
+        recipient fails its own email only and sent emails are not sent again.
+        """
+        volunteers = UserModel.objects.filter(pk__in=[volunteer.pk for volunteer in self.volunteers])
+        notification = Notification.objects.create(notification_type='initiative_completed',
+                                                   related_initiative=self.initiative)
+        notification.add_recipients(volunteers)
+
+        self.assertEqual(send_due_emails(), 2)
+
+        self.assertEqual(BouncingEmailBackend.connections, 1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn(f'/initiative/{self.initiative.pk}/', mail.outbox[0].body)
+        emails = NotificationEmail.objects.filter(notification=notification)
+        self.assertEqual(emails.filter(status='sent').count(), 2)
+        self.assertEqual(emails.get(status='failed').user, self.volunteers[2])
+
+        self.assertEqual(send_due_emails(), 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_preferences_are_applied_in_the_recipient_query(self):
+        """
+        Tests that muted users get neither delivery nor email and users with the
+        in-app channel off only get the email, all within the single fan-out query.
+        """
+        NotificationPreference.objects.create(user=self.volunteers[0], notification_type='initiative_started',
+                                              in_app=False, email=False)
+        NotificationPreference.objects.create(user=self.volunteers[1], notification_type='initiative_started',
+                                              in_app=False, email=True)
+        volunteers = UserModel.objects.filter(pk__in=[volunteer.pk for volunteer in self.volunteers])
+        notification = Notification.objects.create(notification_type='initiative_started',
+                                                   related_initiative=self.initiative)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(notification.add_recipients(volunteers), 1)
+
+        self.assertEqual(list(NotificationDelivery.objects.filter(notification=notification).values_list('user', flat=True)),
+                         [self.volunteers[2].pk])
+        self.assertEqual(set(NotificationEmail.objects.filter(notification=notification).values_list('user', flat=True)),
+                         {self.volunteers[1].pk, self.volunteers[2].pk})
+
+    def test_preferences_form_stores_the_submitted_channels(self):
+        """
+        Tests that a type not sent by email with the in-app channel unchecked
+        is stored muted, as the fan-out query treats it.
+        """
+        self.client.login(username='volunteer_0', password='qsdflkjlkj')
+        response = self.client.post(reverse('notification-preferences'),
+                                    {'initiative_started-in_app': 'on', 'initiative_started-email': 'on'})
+
+        self.assertEqual(response.status_code, 302)
+        preferences = NotificationPreference.objects.filter(user=self.volunteers[0])
+        self.assertFalse(preferences.get(notification_type='initiative_started').muted)
+        approved = preferences.get(notification_type='initiative_approved')
+        self.assertFalse(approved.email)
+        self.assertTrue(approved.muted)
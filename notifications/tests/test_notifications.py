@@ -6,8 +6,10 @@ from django.urls import reverse
 from django.utils import timezone
 from users.models import Profile, City, UpgradeRequest
 from users.tests.test_utils import create_new_user
-from core.tests.test_utils import create_initiative, create_multiple_initiative_reviews
-from notifications.models import Notification
+from core.tests.test_utils import create_initiative, create_multiple_initiative_reviews, run_outbox_tasks
+from notifications.models import AnnouncementAudience, Notification
+from notifications.feed import encode_cursor, get_feed_page
+from notifications.tasks import fan_out_to_managers_task
 from core.tasks import (evaluate_initiative_reviews_task, 
                         transition_initiative_to_ongoing_task, 
                         transition_initiative_to_completed_task)
@@ -15,7 +17,8 @@ from core.tasks import (evaluate_initiative_reviews_task,
 UserModel = get_user_model()
 
 # Ovveriding prod spatial data with light weigth test layers to speed up tests
-@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS)
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES)
 class NotificationsTestCase(TestCase):
     @classmethod
     def setUpTestData(self):
@@ -73,6 +76,8 @@ class NotificationsTestCase(TestCase):
                                         info="good initiative",
                                         city=self.annaba_city,
                                         geo_location=self.point_in_annaba)
+        # Managers are added by the fan-out task
+        self.assertEqual(run_outbox_tasks(), ['notifications.tasks.fan_out_to_managers_task'])
 
         all_notifications = Notification.objects.all()
         notification = Notification.objects.filter(related_initiative__id=initiative.id).first()
@@ -115,6 +120,48 @@ class NotificationsTestCase(TestCase):
         self.assertEqual(notification.related_initiative, initiative)
         self.assertTrue(creator_notified)
 
+    def test_nearby_volunteers_notified_on_initiative_approval(self):
+        """
+        Tests that the volunteers living within NOTIFICATIONS_NEARBY_RADIUS of an
+        approved initiative are notified, and the ones living farther are not.
+        """
+        nearby_volunteer = create_new_user(email='nearby_volunteer@gmail.com',
+                                        username='nearby_volunteer',
+                                        password='qsdflkjlkj',
+                                        phone_number='+213555447700',
+                                        bio='Some good bio',
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba,
+                                        )
+        oran_city = City.objects.get(name='Oran')
+        far_volunteer = create_new_user(email='far_volunteer@gmail.com',
+                                        username='far_volunteer',
+                                        password='qsdflkjlkj',
+                                        phone_number='+213555447701',
+                                        bio='Some good bio',
+                                        city=oran_city,
+                                        geo_location=oran_city.geom.centroid,
+                                        )
+        initiative = create_initiative(created_by=self.initiative_creator,
+                                        info="good initiative",
+                                        city=self.annaba_city,
+                                        geo_location=self.point_in_annaba)
+        create_multiple_initiative_reviews(initiative=initiative,
+                                            num_reviews=10,
+                                            base_username='random',
+                                            vote_type='approve',
+                                            city=self.annaba_city,
+                                            geo_location=self.point_in_annaba)
+        evaluate_initiative_reviews_task(initiative_id=initiative.id)
+        run_outbox_tasks()
+
+        notification = Notification.objects.get(notification_type='initiative_nearby')
+
+        self.assertEqual(notification.related_initiative, initiative)
+        self.assertTrue(notification.recipients.contains(nearby_volunteer))
+        self.assertFalse(notification.recipients.contains(far_volunteer))
+        self.assertFalse(notification.recipients.contains(self.initiative_creator))
+
     def test_notification_created_on_initiative_review_failed_lack_of_reviews(self):
         """
         Tests that a notification is created when initaitive evaluation failed
@@ -295,6 +342,7 @@ class NotificationsTestCase(TestCase):
                                         city=self.annaba_city,
                                         geo_location=self.point_in_annaba,
                                         scheduled_datetime=timezone.now())
+        run_outbox_tasks()
 
         
         notification_2 = Notification.objects.create(notification_type='initiative_approved', related_initiative=initiative)
@@ -370,6 +418,8 @@ class NotificationsTestCase(TestCase):
                                     )
         
         upgrade_request = UpgradeRequest.objects.create(user=volunteer, motivation="Im a nice person...")
+        # Managers are added by the fan-out task
+        run_outbox_tasks()
 
         all_notifications = Notification.objects.all()
         notification = Notification.objects.filter(related_upgrade_request__id=upgrade_request.id).first()
@@ -385,4 +435,283 @@ class NotificationsTestCase(TestCase):
         self.assertTrue(manager_notified)
         self.assertTrue(manager_1_notified)
         self.assertTrue(manager_2_notified)
-        self.assertFalse(volunteer_not_notified)
\ No newline at end of file
+        self.assertFalse(volunteer_not_notified)
+
+    def test_add_recipients_inserts_in_one_query(self):
+        """
+        Tests that add_recipients adds every user of the queryset with a single query
+        and skips users that are already recipients.
+        """
+        for i in range(3):
+            create_new_user(email=f'fanout_manager_{i}@gmail.com',
+                            username=f'fanout_manager_{i}',
+                            password='qsdflkjlkj',
+                            phone_number='+213555447766',
+                            bio='Some good bio',
+                            account_type='manager',
+                            city=self.annaba_city,
+                            geo_location=self.point_in_annaba,
+                            )
+        managers = UserModel.objects.filter(profile__account_type='manager')
+        notification = Notification.objects.create(notification_type='announcement')
+        notification.recipients.add(self.initiative_creator)
+
+        with self.assertNumQueries(1):
+            added = notification.add_recipients(managers)
+
+        # 4 managers, self.initiative_creator was already a recipient
+        self.assertEqual(added, 3)
+        self.assertEqual(notification.recipients.count(), 4)
+
+    def test_read_state_is_per_recipient(self):
+        """
+        Tests that a recipient reading a notification does not mark it
+        as read for the other recipients.
+        """
+        manager_1 = create_new_user(email='manager_1@gmail.com',
+                                    username='manager_1',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447766',
+                                    bio='Some good bio',
+                                    account_type='manager',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    )
+        notification = Notification.objects.create(notification_type='announcement')
+        notification.add_recipients(UserModel.objects.filter(profile__account_type='manager'))
+
+        notification.mark_as_read(manager_1)
+
+        self.assertEqual(manager_1.notification_deliveries.unread().count(), 0)
+        self.assertEqual(self.initiative_creator.notification_deliveries.unread().count(), 1)
+        self.assertTrue(Notification.get_for_user(manager_1).get(pk=notification.pk).is_read)
+        self.assertFalse(Notification.get_for_user(self.initiative_creator).get(pk=notification.pk).is_read)
+
+    def test_notification_listview_cursor_pagination(self):
+        """
+        Tests that following next_cursor walks the whole feed (deliveries and broadcasts)
+        newest first, without duplicates.
+        """
+        user = create_new_user(email='user@gmail.com',
+                                    username='user',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447766',
+                                    bio='Some good bio',
+                                    account_type='volunteer',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    )
+        expected = []
+        for i in range(45):
+            notification = Notification.objects.create(notification_type='announcement', is_broadcast=i % 3 == 0)
+            if not notification.is_broadcast:
+                notification.add_recipients(UserModel.objects.filter(pk=user.pk))
+            expected.append(notification.pk)
+        expected.reverse()
+
+        client = Client()
+        client.login(username='user', password='qsdflkjlkj')
+
+        seen = []
+        url = reverse('notifications-list')
+        for _page in range(3):
+            response = client.get(url)
+            seen += [notification.pk for notification in response.context['notifications']]
+            next_cursor = response.context['next_cursor']
+            url = f"{reverse('notifications-list')}?cursor={next_cursor}"
+
+        self.assertEqual(seen, expected)
+        self.assertIsNone(next_cursor)
+        self.assertEqual(client.get(f"{reverse('notifications-list')}?cursor=invalid").status_code, 404)
+
+    def test_feed_page_not_cut_short_by_delivered_broadcasts(self):
+        """
+        Tests that broadcasts also delivered to the user appear once and still
+        fill the page, the next cursor is given while older notifications exist.
+        """
+        users = UserModel.objects.filter(pk=self.initiative_creator.pk)
+        broadcasts = []
+        for _ in range(3):
+            notification = Notification.objects.create(notification_type='announcement', is_broadcast=True)
+            notification.add_recipients(users)
+            broadcasts.append(notification)
+
+        first_page, next_cursor = get_feed_page(self.initiative_creator, size=2)
+        self.assertEqual(list(first_page), [broadcasts[2], broadcasts[1]])
+        self.assertIsNotNone(next_cursor)
+
+        last_page, next_cursor = get_feed_page(self.initiative_creator, cursor=next_cursor, size=2)
+        self.assertEqual(list(last_page), [broadcasts[0]])
+        self.assertIsNone(next_cursor)
+
+    def test_broadcasts_marked_as_read(self):
+        """
+        Tests that broadcasts, which have no delivery, are marked as read by
+        id, up to a cursor and all at once, and keep their place in the feed.
+        """
+        user = create_new_user(email='reader@gmail.com',
+                                username='reader',
+                                password='qsdflkjlkj',
+                                phone_number='+213555447766',
+                                bio='Some good bio',
+                                city=self.annaba_city,
+                                geo_location=self.point_in_annaba,
+                                )
+        broadcasts = [Notification.objects.create(notification_type='announcement', is_broadcast=True)
+                      for _ in range(4)]
+        read_state = lambda: {notification.pk: notification.is_read for notification in get_feed_page(user)[0]}
+        client = Client()
+        client.login(username='reader', password='qsdflkjlkj')
+
+        response = client.post(reverse('notifications-mark-read-ids'), {'ids': [broadcasts[0].pk]})
+        self.assertEqual(response.json()['marked'], 1)
+        self.assertEqual(read_state(), {broadcasts[3].pk: False, broadcasts[2].pk: False,
+                                        broadcasts[1].pk: False, broadcasts[0].pk: True})
+
+        cursor = encode_cursor(broadcasts[1].created_at, broadcasts[1].pk)
+        response = client.post(reverse('notifications-mark-read-up-to'), {'cursor': cursor})
+        self.assertEqual(response.json()['marked'], 1)
+        self.assertEqual(read_state(), {broadcasts[3].pk: False, broadcasts[2].pk: False,
+                                        broadcasts[1].pk: True, broadcasts[0].pk: True})
+
+        response = client.post(reverse('notifications-mark-read'))
+        self.assertEqual(response.json()['marked'], 2)
+        self.assertEqual(list(get_feed_page(user)[0]), broadcasts[::-1])
+        self.assertTrue(all(read_state().values()))
+        self.assertEqual(client.post(reverse('notifications-mark-read')).json()['marked'], 0)
+
+    @override_settings(NOTIFICATIONS_FAN_OUT_CHUNK_SIZE=2)
+    def test_fan_out_task_in_chunks(self):
+        """
+        Tests that the fan-out task adds every manager across chunks and that
+        running it again adds nobody twice.
+        """
+        for i in range(4):
+            create_new_user(email=f'fanout_manager_{i}@gmail.com',
+                            username=f'fanout_manager_{i}',
+                            password='qsdflkjlkj',
+                            phone_number='+213555447766',
+                            bio='Some good bio',
+                            account_type='manager',
+                            city=self.annaba_city,
+                            geo_location=self.point_in_annaba,
+                            )
+        notification = Notification.objects.create(notification_type='announcement')
+
+        # 5 managers, self.initiative_creator excluded
+        self.assertEqual(fan_out_to_managers_task(notification.id, exclude_user_id=self.initiative_creator.id), 4)
+        self.assertEqual(fan_out_to_managers_task(notification.id, exclude_user_id=self.initiative_creator.id), 0)
+        self.assertEqual(notification.recipients.count(), 4)
+        self.assertFalse(notification.recipients.contains(self.initiative_creator))
+
+
+    def test_notifications_coalesced_within_window(self):
+        """
+        Tests that notifications of a coalesced type are grouped into the latest unread
+        delivery of the recipient, and that a read delivery starts a new group.
+        """
+        managers = UserModel.objects.filter(pk=self.initiative_creator.pk)
+        first = Notification.objects.create(notification_type='initiative_created')
+        second = Notification.objects.create(notification_type='initiative_created')
+        first.add_recipients(managers)
+        second.add_recipients(managers)
+
+        delivery = self.initiative_creator.notification_deliveries.get()
+        self.assertEqual(delivery.notification, second)
+        self.assertEqual(delivery.grouped_count, 2)
+
+        second.mark_as_read(self.initiative_creator)
+        third = Notification.objects.create(notification_type='initiative_created')
+        third.add_recipients(managers)
+        self.assertEqual(self.initiative_creator.notification_deliveries.count(), 2)
+
+        # Not a coalesced type
+        for _ in range(2):
+            Notification.objects.create(notification_type='initiative_approved').add_recipients(managers)
+        self.assertEqual(self.initiative_creator.notification_deliveries.count(), 4)
+
+    def test_digest_mode_groups_every_type_per_day(self):
+        """
+        Tests that users in daily digest mode get one delivery per notification type
+        for the notifications of the day.
+        """
+        self.initiative_creator.profile.notification_digest = True
+        self.initiative_creator.profile.save()
+        managers = UserModel.objects.filter(pk=self.initiative_creator.pk)
+
+        for _ in range(3):
+            Notification.objects.create(notification_type='initiative_approved').add_recipients(managers)
+
+        delivery = self.initiative_creator.notification_deliveries.get()
+        self.assertEqual(delivery.grouped_count, 3)
+
+    def test_targeted_announcements_resolved_at_read_time(self):
+        """
+        Tests that targeted announcements reach the users of their cities or
+        living within their circle through the feed, without any delivery.
+        """
+        oran_city = City.objects.get(name='Oran')
+        oran_user = create_new_user(email='oran_user@gmail.com',
+                                    username='oran_user',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447702',
+                                    bio='Some good bio',
+                                    city=oran_city,
+                                    geo_location=oran_city.geom.centroid,
+                                    )
+        annaba_user = create_new_user(email='annaba_user@gmail.com',
+                                    username='annaba_user',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447703',
+                                    bio='Some good bio',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    )
+
+        by_city = AnnouncementAudience.create_announcement('Planting day in Annaba', cities=[self.annaba_city])
+        by_circle = AnnouncementAudience.create_announcement('Cleanup near Oran',
+                                                             center=oran_city.geom.centroid, radius=20)
+        # Matched both by city and by circle, listed once
+        by_both = AnnouncementAudience.create_announcement('Nursery open in Annaba', cities=[self.annaba_city],
+                                                           center=self.point_in_annaba, radius=20)
+
+        self.assertFalse(by_city.deliveries.exists())
+        annaba_feed, next_cursor = get_feed_page(annaba_user, size=2)
+        oran_feed, _next_cursor = get_feed_page(oran_user)
+        self.assertEqual(list(annaba_feed), [by_both, by_city])
+        self.assertIsNone(next_cursor)
+        self.assertEqual(list(oran_feed), [by_circle])
+
+    def test_targeted_announcements_marked_as_read(self):
+        """
+        Tests that the targeted announcements of the user are marked as read
+        like broadcasts, and that announcements for other audiences are not.
+        """
+        oran_city = City.objects.get(name='Oran')
+        annaba_user = create_new_user(email='annaba_reader@gmail.com',
+                                    username='annaba_reader',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447704',
+                                    bio='Some good bio',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    )
+        by_city = AnnouncementAudience.create_announcement('Planting day in Annaba', cities=[self.annaba_city])
+        by_circle = AnnouncementAudience.create_announcement('Cleanup in Annaba',
+                                                             center=self.point_in_annaba, radius=20)
+        for_oran = AnnouncementAudience.create_announcement('Planting day in Oran', cities=[oran_city])
+        client = Client()
+        client.login(username='annaba_reader', password='qsdflkjlkj')
+
+        response = client.post(reverse('notifications-mark-read-ids'), {'ids': [by_city.pk, for_oran.pk]})
+        self.assertEqual(response.json()['marked'], 1)
+        feed, _next_cursor = get_feed_page(annaba_user)
+        self.assertEqual([(notification, notification.is_read) for notification in feed],
+                         [(by_circle, False), (by_city, True)])
+
+        response = client.post(reverse('notifications-mark-read'))
+        self.assertEqual(response.json()['marked'], 1)
+        feed, _next_cursor = get_feed_page(annaba_user)
+        self.assertEqual([(notification, notification.is_read) for notification in feed],
+                         [(by_circle, True), (by_city, True)])
+        self.assertFalse(for_oran.deliveries.exists())
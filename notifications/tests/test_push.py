@@ -0,0 +1,65 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from notifications.push import Broadcaster
+
+
+class BroadcasterTestCase(SimpleTestCase):
+
+    def test_dispatch_reaches_the_streams_of_the_recipients_only(self):
+        """
+        Tests that a pushed notification is queued on every stream of its recipients
+        and on no other stream.
+        """
+        async def scenario():
+            broadcaster = Broadcaster()
+            # No Redis subscriber in tests
+            broadcaster.task = asyncio.get_running_loop().create_future()
+            first_tab = broadcaster.connect(1)
+            second_tab = broadcaster.connect(1)
+            other_user = broadcaster.connect(2)
+
+            broadcaster.dispatch(json.dumps({'users': [1, 3], 'notification': {'id': 7, 'type': 'announcement'}}))
+
+            self.assertEqual(first_tab.get_nowait(), {'id': 7, 'type': 'announcement'})
+            self.assertEqual(second_tab.get_nowait(), {'id': 7, 'type': 'announcement'})
+            self.assertTrue(other_user.empty())
+
+            broadcaster.disconnect(1, first_tab)
+            broadcaster.disconnect(1, second_tab)
+            self.assertNotIn(1, broadcaster.streams)
+
+        asyncio.run(scenario())
+
+    def test_unread_counts_read_once_per_message(self):
+        """
+        Tests that the unread counts of the connected recipients are read with a
+        single call per message and sent along with the notification.
+        """
+        async def scenario():
+            broadcaster = Broadcaster()
+            broadcaster.task = asyncio.get_running_loop().create_future()
+            tabs = [broadcaster.connect(user_id) for user_id in (1, 1, 2)]
+
+            with mock.patch('notifications.push.get_unread_counts', return_value={1: 5, 2: 0}) as get_unread_counts:
+                await broadcaster.handle(json.dumps({'users': [1, 2, 3], 'notification': {'id': 7, 'type': 'announcement'}}))
+
+            get_unread_counts.assert_called_once_with([1, 2])
+            self.assertEqual([tab.get_nowait()['unread'] for tab in tabs], [5, 5, 0])
+
+        asyncio.run(scenario())
+
+
+@override_settings(CACHES=settings.TEST_CACHES)
+class NotificationsStreamViewTestCase(TestCase):
+
+    def test_stream_requires_login(self):
+        """
+        Tests that anonymous users are redirected to the login page.
+        """
+        response = self.client.get(reverse('notifications-stream'))
+        self.assertEqual(response.status_code, 302)
@@ -1,14 +1,213 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.db.models import Q
+from django.shortcuts import redirect
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.translation import gettext as _
+from django.views import View
+from django.views.generic.base import TemplateView
 from django.views.generic.list import ListView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from notifications.models import Notification
+from notifications.models import Notification, NotificationDelivery, NotificationPreference
+from notifications.counters import dropdown_key, get_unread_count
+from notifications.feed import (decode_cursor, encode_cursor, get_announcements, get_feed_page,
+                                mark_announcements_as_read)
+from notifications.push import broadcaster
 
 
 class NotificationsListView(LoginRequiredMixin, ListView):
+    """
+    Notifications of the user, paginated with a cursor (?cursor=) rather
+    than page numbers, see notifications.feed.
+    """
     model = Notification
-    paginate_by = 20
+    page_size = 20
     context_object_name = 'notifications'
     template_name = 'notifications/notifications_list.html'
 
     def get_queryset(self, **kwargs):
-        return Notification.get_for_user(user=self.request.user)
+        try:
+            notifications, self.next_cursor = get_feed_page(self.request.user,
+                                                            cursor=self.request.GET.get('cursor'),
+                                                            size=self.page_size)
+        except ValueError:
+            raise Http404(_('Invalid page.'))
+        return notifications
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['next_cursor'] = self.next_cursor
+        context['is_first_page'] = not self.request.GET.get('cursor')
+        # Evaluates the page, the template reuses the results
+        newest = next(iter(self.object_list), None)
+        if context['is_first_page'] and newest:
+            # "Mark all as read" leaves the notifications delivered after the page was loaded unread
+            context['read_cursor'] = encode_cursor(newest.created_at, newest.pk)
+        return context
+
+
+class NotificationsDropdownView(LoginRequiredMixin, View):
+    """
+    Navbar notifications dropdown, loaded when the dropdown is first opened.
+
+    The latest deliveries and their notifications are fetched with one query
+    and cached per user until a notification is delivered to or read by the
+    user (see notifications.counters). The fragment itself is rendered on
+    every request, its relative times ("5 minutes ago") are never stale.
+    """
+    template_name = 'notifications/notifications_dropdown.html'
+
+    def get(self, request, *args, **kwargs):
+        key = dropdown_key(request.user.pk)
+        deliveries = cache.get(key)
+        if deliveries is None:
+            deliveries = list(NotificationDelivery.objects.filter(user=request.user).select_related(
+                'notification')[:settings.NOTIFICATIONS_DROPDOWN_SIZE])
+            cache.set(key, deliveries, timeout=settings.UNREAD_NOTIFICATIONS_CACHE_TIMEOUT)
+        return HttpResponse(render_to_string(self.template_name, {'deliveries': deliveries}))
+
+
+class MarkNotificationsReadView(LoginRequiredMixin, View):
+    """
+    Mark all the notifications of the user as read (POST).
+
+    The deliveries are marked with a single UPDATE through the partial
+    unread index and the unread counter is decremented by as many, see
+    NotificationDeliveryQuerySet.mark_as_read. The announcements, which
+    have no delivery, get a read one with a single INSERT, see
+    notifications.feed.mark_announcements_as_read.
+
+    Responds with the number of notifications marked and the unread count.
+    """
+    http_method_names = ['post']
+
+    def get_deliveries(self):
+        return NotificationDelivery.objects.all()
+
+    def filter_announcements(self, announcements):
+        return announcements
+
+    def post(self, request, *args, **kwargs):
+        try:
+            deliveries = self.get_deliveries()
+            announcements = self.filter_announcements(get_announcements(request.user))
+        except ValueError:
+            return HttpResponseBadRequest()
+        marked = deliveries.mark_as_read(request.user) + mark_announcements_as_read(request.user, announcements)
+        return JsonResponse({'marked': marked, 'unread': get_unread_count(request.user)})
+
+
+class MarkNotificationsReadUpToView(MarkNotificationsReadView):
+    """
+    Mark the notifications of the user as read up to a feed cursor (POST
+    `cursor`): the notification the cursor points to and every older one,
+    notifications delivered since the user loaded the feed stay unread.
+    """
+
+    def get_deliveries(self):
+        created_at, pk = decode_cursor(self.request.POST.get('cursor', ''))
+        return NotificationDelivery.objects.filter(Q(created_at__lt=created_at) |
+                                                   Q(created_at=created_at, notification_id__lte=pk))
+
+    def filter_announcements(self, announcements):
+        created_at, pk = decode_cursor(self.request.POST.get('cursor', ''))
+        return announcements.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lte=pk))
+
+
+class MarkNotificationsReadByIdView(MarkNotificationsReadView):
+    """
+    Mark the given notifications of the user as read (POST `ids`, repeated).
+    """
+
+    def get_ids(self):
+        ids = [int(pk) for pk in self.request.POST.getlist('ids')]
+        if not ids or len(ids) > settings.NOTIFICATIONS_MARK_READ_MAX_IDS:
+            raise ValueError('Between 1 and NOTIFICATIONS_MARK_READ_MAX_IDS ids are expected')
+        return ids
+
+    def get_deliveries(self):
+        return NotificationDelivery.objects.filter(notification_id__in=self.get_ids())
+
+    def filter_announcements(self, announcements):
+        return announcements.filter(pk__in=self.get_ids())
+
+
+class NotificationPreferencesView(LoginRequiredMixin, TemplateView):
+    """
+    Channels (in-app, email) of every notification type for the user, a
+    type with both channels off is muted. Saved with a single upsert, types
+    not sent by email have no email checkbox and are stored with the email
+    channel off.
+    """
+    template_name = 'notifications/notification_preferences.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        preferences = {preference.notification_type: preference
+                       for preference in self.request.user.notification_preferences.all()}
+        context['preferences'] = [
+            (notification_type, label, preferences.get(notification_type, NotificationPreference()),
+             notification_type in settings.NOTIFICATIONS_EMAIL_TYPES)
+            for notification_type, label in Notification.NOTIFICATION_TYPES
+            if notification_type != 'announcement'
+        ]
+        return context
+
+    def post(self, request, *args, **kwargs):
+        NotificationPreference.objects.bulk_create(
+            [NotificationPreference(user=request.user,
+                                    notification_type=notification_type,
+                                    in_app=f'{notification_type}-in_app' in request.POST,
+                                    email=f'{notification_type}-email' in request.POST)
+             for notification_type, _label in Notification.NOTIFICATION_TYPES
+             if notification_type != 'announcement'],
+            update_conflicts=True,
+            unique_fields=['user', 'notification_type'],
+            update_fields=['in_app', 'email'],
+        )
+        messages.success(request, _('Notification preferences saved.'))
+        return redirect('notification-preferences')
+
+
+class NotificationsStreamView(View):
+    """
+    Server-Sent Events stream of the new notifications of the user, with
+    the unread count, see notifications.push.
+
+    Async view: served by an ASGI server (khadra/asgi.py), one process holds
+    thousands of idle streams. Every page opens a stream, under a WSGI
+    server or runserver each open tab would tie up a worker.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        response = StreamingHttpResponse(self.events(user), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Disable proxy buffering (nginx)
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def events(self, user):
+        queue = broadcaster.connect(user.pk)
+        try:
+            yield f'retry: {settings.NOTIFICATIONS_PUSH_RETRY * 1000}\n\n'
+            while True:
+                try:
+                    notification = await asyncio.wait_for(queue.get(), settings.NOTIFICATIONS_PUSH_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing idle streams
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'event: notification\ndata: {json.dumps(notification)}\n\n'
+        finally:
+            broadcaster.disconnect(user.pk, queue)
+
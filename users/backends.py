@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from allauth.account.auth_backends import AuthenticationBackend
+
+UserModel = get_user_model()
+
+
+class ProfileBackendMixin:
+    """
+    Load the user of every request (get_user) together with its profile,
+    city and country in a single query, instead of one more query on the
+    first access to request.user.profile and each of its relations.
+
+    The city and country geometries (large multipolygons) are deferred,
+    they are only needed by the spatial queries, which run in the database.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = (
+                UserModel._default_manager
+                .select_related('profile__city', 'profile__country')
+                .defer('profile__city__geom', 'profile__country__geom')
+                .get(pk=user_id)
+            )
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+class ProfileModelBackend(ProfileBackendMixin, ModelBackend):
+    pass
+
+
+class ProfileAuthenticationBackend(ProfileBackendMixin, AuthenticationBackend):
+    """allauth authentication (login by email), see ProfileBackendMixin"""
@@ -1,12 +1,14 @@
 from django.contrib.gis import forms
 from django.forms import ModelForm
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import UploadedFile
 from django.utils.translation import gettext as _
 from leaflet.forms.widgets import LeafletWidget
 from phonenumber_field.formfields import PhoneNumberField
 from allauth.account.models import EmailAddress
 from users.models import Profile, Country, City, UpgradeRequest
 from users.messages import users_messages
+from users.images import ingest_profile_pic
 
 UserModel = get_user_model()
 
@@ -17,7 +19,18 @@ LEAFLET_WIDGET_ATTRS = {
     'map_srid': 4326,
 }
 
-class ProfileCreationForm(ModelForm):
+class ProfilePicIngestMixin:
+    """Downscale and strip new profile pictures before they are stored, see users.images"""
+
+    def clean_profile_pic(self):
+        profile_pic = self.cleaned_data.get('profile_pic')
+        # Unchanged (stored FieldFile) or cleared (False) pictures are kept as is
+        if isinstance(profile_pic, UploadedFile):
+            return ingest_profile_pic(profile_pic)
+        return profile_pic
+
+
+class ProfileCreationForm(ProfilePicIngestMixin, ModelForm):
     phone_number = PhoneNumberField(region="DZ")
     geo_location = forms.PointField(required=False, widget=LeafletWidget(attrs=LEAFLET_WIDGET_ATTRS))
     city = forms.ModelChoiceField(queryset=City.objects.all(), required=False)
@@ -104,7 +117,7 @@ class UserUpdateForm(forms.ModelForm):
         fields = ['username', 'first_name', 'last_name']
 
 
-class ProfileUpdateForm(ModelForm):
+class ProfileUpdateForm(ProfilePicIngestMixin, ModelForm):
     phone_number = PhoneNumberField(region="DZ")
     geo_location = forms.PointField(widget=LeafletWidget(attrs=LEAFLET_WIDGET_ATTRS), required=False)
     city = forms.ModelChoiceField(queryset=City.objects.all())
@@ -115,7 +128,8 @@ class ProfileUpdateForm(ModelForm):
                   'phone_number', 
                   'bio', 
                   'city', 
-                  'geo_location']
+                  'geo_location',
+                  'notification_digest']
 
     def __init__(self, *args, **kwargs):
         super(ProfileUpdateForm, self).__init__( * args, ** kwargs)
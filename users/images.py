@@ -0,0 +1,125 @@
+"""
+Profile pictures processing
+
+Uploads are ingested by the profile forms (see ingest_profile_pic): bombs
+and oversized files are rejected from the header alone, the picture is
+oriented, downscaled to settings.PROFILE_PIC_MAX_DIMENSION and re-encoded
+without its metadata (EXIF, GPS position, ICC profile), so only a bounded
+JPEG is ever stored.
+
+Thumbnails of every size of settings.PROFILE_PIC_THUMBNAIL_SIZES are
+generated once per uploaded picture by users.tasks.generate_thumbnails_task,
+in WebP and in JPEG for the browsers without WebP support. They are stored
+next to the original under deterministic names (see thumbnail_name), so
+their URLs are built without touching the storage, and
+Profile.thumbnails_source records the picture they were generated from.
+"""
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+from users.messages import users_messages
+
+# Extension: (Pillow format, save options)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': settings.PROFILE_PIC_WEBP_QUALITY, 'method': 6}),
+    'jpg': ('JPEG', {'quality': settings.PROFILE_PIC_JPEG_QUALITY, 'optimize': True, 'progressive': True}),
+}
+
+
+def thumbnail_name(name, size, extension):
+    """Storage name of the `size` thumbnail of the picture `name`, e.g. profile_pics/thumbnails/me_64.webp"""
+    path = PurePosixPath(name)
+    return str(path.parent / 'thumbnails' / f'{path.stem}_{size}.{extension}')
+
+
+def to_rgb(image):
+    """`image` in RGB, transparent pixels on a white background"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def ingest_profile_pic(upload):
+    """
+    Return the uploaded profile picture `upload` oriented, capped at
+    settings.PROFILE_PIC_MAX_DIMENSION and stripped of its metadata, as a
+    JPEG upload named after the original.
+
+    Only the header is read before the checks: uploads larger than
+    settings.PROFILE_PIC_MAX_UPLOAD_SIZE bytes or settings.PROFILE_PIC_MAX_PIXELS
+    pixels (decompression bombs) are rejected without decoding them. Large
+    uploads are streamed from their temporary file (FILE_UPLOAD_MAX_MEMORY_SIZE),
+    JPEGs are decoded at a reduced scale (draft mode).
+
+    Raises:
+        ValidationError: the upload is too large or not a readable image.
+    """
+    if upload.size > settings.PROFILE_PIC_MAX_UPLOAD_SIZE:
+        raise ValidationError(users_messages['PROFILE_PIC_TOO_LARGE'] % {
+            'size': settings.PROFILE_PIC_MAX_UPLOAD_SIZE // (1024 * 1024)}, code='file_too_large')
+
+    upload.seek(0)
+    max_dimension = settings.PROFILE_PIC_MAX_DIMENSION
+    try:
+        with Image.open(upload) as image:
+            width, height = image.size
+            if width * height > settings.PROFILE_PIC_MAX_PIXELS:
+                raise ValidationError(users_messages['PROFILE_PIC_TOO_MANY_PIXELS'], code='too_many_pixels')
+            image.draft('RGB', (max_dimension, max_dimension))
+            image = to_rgb(ImageOps.exif_transpose(image))
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise ValidationError(users_messages['PROFILE_PIC_INVALID'], code='invalid_image')
+
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    # Nothing but the pixels is written, no exif nor icc_profile
+    image.save(buffer, 'JPEG', **THUMBNAIL_FORMATS['jpg'][1])
+    name = f'{PurePosixPath(upload.name).stem}.jpg'
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def generate_thumbnails(picture):
+    """
+    Generate and store every thumbnail of `picture` (a FieldFile), replacing
+    existing ones.
+
+    The picture is decoded once, JPEGs at a reduced scale (draft mode) when
+    the largest thumbnail allows it.
+    """
+    storage = picture.storage
+    largest = max(settings.PROFILE_PIC_THUMBNAIL_SIZES)
+    with picture.open('rb'), Image.open(picture) as image:
+        image.draft('RGB', (largest * 2, largest * 2))
+        image = to_rgb(ImageOps.exif_transpose(image))
+        for size in settings.PROFILE_PIC_THUMBNAIL_SIZES:
+            thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+            for extension, (image_format, options) in THUMBNAIL_FORMATS.items():
+                buffer = BytesIO()
+                thumbnail.save(buffer, image_format, **options)
+                name = thumbnail_name(picture.name, size, extension)
+                storage.delete(name)
+                storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def thumbnail_names(name):
+    """Storage names of the thumbnails of the picture `name` by '<size>.<extension>', see Profile.thumbnail_names"""
+    return {
+        f'{size}.{extension}': thumbnail_name(name, size, extension)
+        for size in settings.PROFILE_PIC_THUMBNAIL_SIZES
+        for extension in THUMBNAIL_FORMATS
+    }
+
+
+def delete_thumbnails(name, storage):
+    """Delete the thumbnails of the picture `name`"""
+    for size in settings.PROFILE_PIC_THUMBNAIL_SIZES:
+        for extension in THUMBNAIL_FORMATS:
+            storage.delete(thumbnail_name(name, size, extension))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from core.outbox import enqueue_tasks
+from users.models import Profile
+from users.tasks import generate_thumbnails_task
+
+
+class Command(BaseCommand):
+    """
+    Management command enqueuing the thumbnails of the profile pictures
+    that have none (see users.tasks.generate_thumbnails_task)
+
+    Run it once after upgrading from imagekit (users migration 0009): the
+    pictures uploaded before have no thumbnails, they are served full size
+    until the `images` workers have generated them.
+
+    Profiles are enqueued through the task outbox in chunks (--chunk-size),
+    one INSERT per chunk. The task is idempotent, running the command again
+    only enqueues the pictures still without thumbnails.
+    """
+
+    help = "Enqueue the thumbnails generation of the profile pictures without thumbnails"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of profiles enqueued per query (default 1000)')
+
+    def handle(self, *args, **kwargs):
+        chunk_size = kwargs['chunk_size']
+        profile_ids = Profile.objects.filter(
+            ~Q(profile_pic='') & Q(profile_pic__isnull=False)
+        ).exclude(thumbnails_source=F('profile_pic')).order_by('pk').values_list('pk', flat=True)
+
+        total = 0
+        last_id = 0
+        while True:
+            chunk = list(profile_ids.filter(pk__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            enqueue_tasks(generate_thumbnails_task, [[profile_id] for profile_id in chunk])
+            total += len(chunk)
+            last_id = chunk[-1]
+
+        self.stdout.write(self.style.SUCCESS("Enqueued the thumbnails of %s profile pictures" % total))
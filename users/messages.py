@@ -64,6 +64,9 @@ users_messages = {
     'LOCATION_OUTSIDE_CITY' : _('Location is in %(actual)s, not %(selected)s'),
     'COULD_NOT_GENERATE_LOCATION_FOR_CITY': _('Could not generate location for selected city'),
     'SELECT_CITY_OR_LOCATION': _('Please select either a location on the map or a city'),
+    'PROFILE_PIC_TOO_LARGE': _('The profile picture must be smaller than %(size)d MB'),
+    'PROFILE_PIC_TOO_MANY_PIXELS': _('The profile picture resolution is too high'),
+    'PROFILE_PIC_INVALID': _('Upload a valid image. The file you uploaded was either not an image or a corrupted image.'),
 
     # adapter
     'EMAIL_NOT_UNIQUE': _('This email is already in use by another account.')
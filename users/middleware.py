@@ -0,0 +1,35 @@
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.utils.decorators import sync_and_async_middleware
+
+# Backends recorded by the sessions opened before the profile backends
+# (see users.backends) -> profile backend taking over their sessions
+LEGACY_BACKENDS = {
+    'django.contrib.auth.backends.ModelBackend': 'users.backends.ProfileModelBackend',
+    'allauth.account.auth_backends.AuthenticationBackend': 'users.backends.ProfileAuthenticationBackend',
+}
+
+
+@sync_and_async_middleware
+def legacy_backend_session_middleware(get_response):
+    """
+    Move the sessions opened with a legacy backend to the matching profile
+    backend before AuthenticationMiddleware reads them, so they stay logged
+    in while the legacy backends are not listed in AUTHENTICATION_BACKENDS
+    (where they would check the password of every failed login again).
+
+    Each session is rewritten once, on its first request.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            backend = await request.session.aget(BACKEND_SESSION_KEY)
+            if backend in LEGACY_BACKENDS:
+                await request.session.aset(BACKEND_SESSION_KEY, LEGACY_BACKENDS[backend])
+            return await get_response(request)
+    else:
+        def middleware(request):
+            backend = request.session.get(BACKEND_SESSION_KEY)
+            if backend in LEGACY_BACKENDS:
+                request.session[BACKEND_SESSION_KEY] = LEGACY_BACKENDS[backend]
+            return get_response(request)
+    return middleware
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_upgraderequest_upgraderequestreview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='notification_digest',
+            field=models.BooleanField(default=False, help_text='Group the notifications of the day by type instead of getting each one', verbose_name='Daily notifications digest'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_profile_notification_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='thumbnails_source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Thumbnails source'),
+        ),
+    ]
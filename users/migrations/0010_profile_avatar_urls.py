@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 22:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_profile_thumbnails_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_urls',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Avatar URLs'),
+        ),
+    ]
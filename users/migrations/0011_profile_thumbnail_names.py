@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-20 10:05
+
+from pathlib import PurePosixPath
+
+from django.db import migrations, models
+
+
+def urls_to_names(apps, schema_editor):
+    """Replace the cached thumbnail URLs by their storage names (see users.images.thumbnail_name)"""
+    Profile = apps.get_model('users', 'Profile')
+    for profile in Profile.objects.exclude(thumbnails_source='').only('pk', 'thumbnails_source', 'thumbnail_names').iterator():
+        source = PurePosixPath(profile.thumbnails_source)
+        names = {}
+        for key in profile.thumbnail_names:
+            size, extension = key.split('.')
+            names[key] = str(source.parent / 'thumbnails' / f'{source.stem}_{size}.{extension}')
+        Profile.objects.filter(pk=profile.pk).update(thumbnail_names=names)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_profile_avatar_urls'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='profile',
+            old_name='avatar_urls',
+            new_name='thumbnail_names',
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='thumbnail_names',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Thumbnail names'),
+        ),
+        migrations.RunPython(urls_to_names, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,5 @@
+from urllib.parse import urljoin
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
@@ -5,11 +7,10 @@ from django.contrib.gis.gdal import OGRGeometry
 from django.contrib.gis.geos import Point
 from django.contrib.staticfiles.storage import staticfiles_storage
 from django.db import connection
+from django.utils.encoding import filepath_to_uri
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from phonenumber_field.modelfields import PhoneNumberField
-from imagekit.models import ImageSpecField
-from imagekit.processors import ResizeToFill
 
 
 class Country(models.Model):
@@ -117,17 +118,13 @@ class Profile(models.Model):
     #Original size profile pic
     profile_pic = models.ImageField(_("Profile picture"), default=None, upload_to='profile_pics', blank=True, null=True)
 
-    #Thumbnail of profile pic to be displayed in the profile page
-    profile_pic_256 = ImageSpecField(source='profile_pic',
-        processors=[ResizeToFill(256, 256)],
-        format='JPEG',
-        options={'quality': 100})
+    # Name of the picture whose thumbnails (64 and 256 pixels, WebP and JPEG) were
+    # generated by users.tasks.generate_thumbnails_task, see users.images
+    thumbnails_source = models.CharField(_('Thumbnails source'), max_length=100, blank=True, default='', editable=False)
 
-    #Thumbnail of profile pic to be displayed in feed and maps page along side the username
-    profile_pic_64 = ImageSpecField(source='profile_pic',
-        processors=[ResizeToFill(64, 64)],
-        format='JPEG',
-        options={'quality': 100})
+    # Storage names of these thumbnails by '<size>.<extension>' (e.g. '64.webp'), written
+    # with thumbnails_source, their URLs are joined to MEDIA_URL without any storage call
+    thumbnail_names = models.JSONField(_('Thumbnail names'), default=dict, blank=True, editable=False)
 
     phone_number = PhoneNumberField(_('Phone number'), help_text=_('Personal phone number'))
     bio = models.TextField(
@@ -138,36 +135,55 @@ class Profile(models.Model):
         help_text=_('Tell us about yourself (500 characters max)')
     )
 
+    notification_digest = models.BooleanField(
+        _('Daily notifications digest'),
+        default=False,
+        help_text=_('Group the notifications of the day by type instead of getting each one')
+    )
+
     def __str__(self):
         return f'{self.user.username} profile'
 
-    def get_profile_pic_64(self):
+    def has_thumbnails(self):
+        """Return True if the thumbnails of the current profile pic were generated"""
+        return bool(self.profile_pic) and self.thumbnails_source == self.profile_pic.name
+
+    def get_thumbnail_url(self, size, extension='jpg'):
         """
-        Return profile_pic_64 if it exists
-        else return placeholder (images/profile_placeholder_64x64.svg)
+        Return the URL of the `size` thumbnail of the profile pic, its
+        storage name (thumbnail_names) joined to settings.MEDIA_URL without
+        any storage call, so it follows MEDIA_URL changes. The names belong
+        to thumbnails_source, they are ignored as soon as the picture changes.
+        Until the thumbnails are generated the original picture is returned,
+        without profile pic the placeholder.
         TODO : check if user is logged in using a social account
         and get the avatar from it
         """
-        if self.profile_pic_64:
-            return self.profile_pic_64.url
-        else:
+        name = self.thumbnail_names.get(f'{size}.{extension}') if self.has_thumbnails() else None
+        if name:
+            return urljoin(settings.MEDIA_URL, filepath_to_uri(name))
+        elif self.profile_pic:
+            return self.profile_pic.url
+        elif size <= 64:
             return staticfiles_storage.url('images/profile_placeholder_64x64.svg')
+        else:
+            return staticfiles_storage.url('images/profile_placeholder.svg')
+
+    def get_profile_pic_64(self):
+        return self.get_thumbnail_url(64)
+
+    def get_profile_pic_64_webp(self):
+        return self.get_thumbnail_url(64, 'webp')
 
     def has_pending_upgrade_request(self):
         """Return True if the user has at least one pending upgrade request."""
         return self.user.upgrade_requests.filter(status='pending').exists()
     
     def get_profile_pic_256(self):
-        """
-        Return profile_pic_256 if it exists
-        else return placeholder (images/profile_placeholder_64x64.svg)
-        TODO : check if user is logged in using a social account
-        and get the avatar from it
-        """
-        if self.profile_pic_256:
-            return self.profile_pic_256.url
-        else:
-            return staticfiles_storage.url('images/profile_placeholder.svg')
+        return self.get_thumbnail_url(256)
+
+    def get_profile_pic_256_webp(self):
+        return self.get_thumbnail_url(256, 'webp')
 
     class Meta:
         verbose_name = _('Profile')
@@ -0,0 +1,176 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from users.images import delete_thumbnails, generate_thumbnails, thumbnail_names
+from users.models import Profile, UpgradeRequest, UpgradeRequestReview
+from notifications.models import Notification, NotificationDelivery, NotificationPreference
+from notifications.counters import incr_unread_counts
+from notifications.push import push_notifications
+
+
+def get_upgrade_request_outcome(approve_count, reject_count):
+    """
+    Return the (status, reason) outcome of an upgrade request review period.
+
+    status is 'approved' or 'rejected', reason is None for approved requests,
+    'lack_of_reviews' or 'rejected_by_managers'. Same rules as initiatives
+    (see core.tasks.get_review_outcome).
+    """
+    # Not enough reviews -> rejected
+    if approve_count + reject_count < settings.MIN_UPGRADE_REQUEST_REVIEWS_REQUIRED:
+        return 'rejected', 'lack_of_reviews'
+    # Approved by majority or reviews are equal -> approved
+    if approve_count >= reject_count:
+        return 'approved', None
+    # More rejects than approves -> rejected
+    return 'rejected', 'rejected_by_managers'
+
+
+def _evaluate_due_upgrade_requests(now, chunk_size):
+    """
+    Evaluate one chunk of pending upgrade requests whose review period has ended.
+
+    Whatever the chunk size this costs a fixed number of queries:
+    1.  Lock the chunk (skipping requests locked by a concurrent evaluation).
+    2.  Tally the votes of every request of the chunk with one grouped aggregate.
+    3.  Update the requests statuses, one UPDATE per outcome.
+    4.  Promote the approved users with one UPDATE on Profile.
+    5.  Create the outcome notifications and their recipients with two bulk INSERTs.
+
+    Returns:
+        int: Number of evaluated upgrade requests.
+    """
+    review_ended_before = now - timedelta(days=settings.UPGRADE_REQUEST_REVIEW_DURATION)
+    due_requests = list(UpgradeRequest.objects
+                        .select_for_update(skip_locked=True)
+                        .filter(status='pending', request_datetime__lte=review_ended_before)
+                        .order_by('request_datetime')
+                        .values_list('id', 'user_id')[:chunk_size])
+    if not due_requests:
+        return 0
+
+    tally = {
+        row['upgrade_request_id']: row
+        for row in UpgradeRequestReview.objects
+            .filter(upgrade_request_id__in=[request_id for request_id, _user_id in due_requests])
+            .values('upgrade_request_id')
+            .annotate(approve_count=Count('id', filter=Q(vote='approve')),
+                    reject_count=Count('id', filter=Q(vote='reject')))
+    }
+
+    outcomes = {}
+    for request_id, user_id in due_requests:
+        votes = tally.get(request_id, {})
+        status, reason = get_upgrade_request_outcome(votes.get('approve_count', 0), votes.get('reject_count', 0))
+        outcomes[request_id] = (user_id, status, reason)
+
+    for status in ('approved', 'rejected'):
+        UpgradeRequest.objects.filter(
+            id__in=[request_id for request_id, (_user_id, outcome, _reason) in outcomes.items() if outcome == status]
+        ).update(status=status)
+
+    Profile.objects.filter(
+        user_id__in=[user_id for user_id, status, _reason in outcomes.values() if status == 'approved']
+    ).update(account_type='manager')
+
+    notifications = Notification.objects.bulk_create([
+        Notification(
+            notification_type=f'upgrade_request_{status}',
+            related_upgrade_request_id=request_id,
+            message=reason or '',
+            idempotency_key=f'upgrade_request:{request_id}:{status}',
+        )
+        for request_id, (_user_id, status, reason) in outcomes.items()
+    ])
+    # Requesters who turned the in-app channel off for their outcome get no delivery
+    in_app_off = set(
+        NotificationPreference.objects.filter(
+            user_id__in=[user_id for user_id, _status, _reason in outcomes.values()],
+            notification_type__in=['upgrade_request_approved', 'upgrade_request_rejected'],
+            in_app=False,
+        ).values_list('user_id', 'notification_type')
+    )
+    recipients = {
+        notification: outcomes[notification.related_upgrade_request_id][0]
+        for notification in notifications
+        if (outcomes[notification.related_upgrade_request_id][0], notification.notification_type) not in in_app_off
+    }
+    NotificationDelivery.objects.bulk_create([
+        NotificationDelivery(notification_id=notification.id,
+                             user_id=user_id,
+                             created_at=notification.created_at)
+        for notification, user_id in recipients.items()
+    ])
+    incr_unread_counts(recipients.values())
+    push_notifications((notification, [user_id]) for notification, user_id in recipients.items())
+    return len(outcomes)
+
+
+@shared_task
+def evaluate_upgrade_requests_task():
+    """
+    Periodic (celery beat) task evaluating every pending upgrade request
+    whose review period (settings.UPGRADE_REQUEST_REVIEW_DURATION) has ended.
+
+    For each request:
+        *   If the total number of reviews is less than the required minimum
+            (`settings.MIN_UPGRADE_REQUEST_REVIEWS_REQUIRED`), the request is 'rejected'.
+        *   If 'approve' votes are greater than or equal to 'reject' votes, the request
+            is 'approved' and the user's Profile.account_type becomes 'manager'.
+        *   Otherwise the request is 'rejected'.
+        *   The user gets an 'upgrade_request_approved' or 'upgrade_request_rejected'
+            notification, with the rejection reason as message.
+
+    Requests are processed in chunks of settings.UPGRADE_REQUEST_EVALUATION_CHUNK_SIZE,
+    each chunk in its own transaction and with a fixed number of queries,
+    see `_evaluate_due_upgrade_requests`.
+
+    Returns:
+        int: Number of evaluated upgrade requests.
+    """
+    now = timezone.now()
+    chunk_size = settings.UPGRADE_REQUEST_EVALUATION_CHUNK_SIZE
+    total = 0
+    while True:
+        with transaction.atomic():
+            evaluated = _evaluate_due_upgrade_requests(now, chunk_size)
+        total += evaluated
+        if evaluated < chunk_size:
+            break
+    return total
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, max_retries=3)
+def generate_thumbnails_task(profile_id):
+    """
+    Generate the thumbnails of the profile picture of a profile (see
+    users.images) and record it in Profile.thumbnails_source along with
+    the storage names of the thumbnails (Profile.thumbnail_names), the
+    thumbnails of the previous picture are deleted.
+
+    Enqueued through the task outbox (core.outbox) when a picture is
+    uploaded. Idempotent: a picture is processed once, a task for a picture
+    replaced since then does nothing.
+
+    Returns:
+        bool: True if thumbnails were generated.
+    """
+    profile = Profile.objects.filter(pk=profile_id).first()
+    if profile is None or not profile.profile_pic or profile.has_thumbnails():
+        return False
+
+    picture = profile.profile_pic
+    generate_thumbnails(picture)
+    # Compare-and-set, the picture may have been replaced meanwhile
+    updated = Profile.objects.filter(pk=profile_id, profile_pic=picture.name).update(
+        thumbnails_source=picture.name, thumbnail_names=thumbnail_names(picture.name))
+    if not updated:
+        delete_thumbnails(picture.name, picture.storage)
+        return False
+    if profile.thumbnails_source:
+        delete_thumbnails(profile.thumbnails_source, picture.storage)
+    return True
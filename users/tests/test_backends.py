@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from notifications.counters import get_unread_count
+from users.backends import ProfileModelBackend
+from users.models import City
+from users.tests.test_utils import create_new_user
+from core.tests.test_utils import create_initiative
+
+
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES)
+class ProfileBackendTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(self):
+        call_command('load_spatial_layers', 'DZ')
+        self.annaba_city = City.objects.get(name='Annaba')
+        self.point_in_annaba = self.annaba_city.get_random_location_point()
+        # Lives away from the initiative, whose city is rendered by its pages
+        self.oran_city = City.objects.get(name='Oran')
+        self.volunteer = create_new_user(email='volunteer_user@gmail.com',
+                                        username='volunteer_user',
+                                        password='qsdflkjlkj',
+                                        phone_number='+213555447755',
+                                        bio='Some good bio',
+                                        city=self.oran_city,
+                                        geo_location=self.oran_city.get_random_location_point(),
+                                        )
+        self.manager = create_new_user(email='manager_user@gmail.com',
+                                    username='manager_user',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447766',
+                                    bio='Some good bio',
+                                    account_type='manager',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    )
+        self.other_manager = create_new_user(email='other_manager_user@gmail.com',
+                                    username='other_manager_user',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447777',
+                                    bio='Some good bio',
+                                    account_type='manager',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    )
+        self.initiative = create_initiative(self.manager, 'Some info', self.annaba_city, self.point_in_annaba)
+        # Reviewed by the manager
+        self.other_initiative = create_initiative(self.other_manager, 'Some other info', self.annaba_city, self.point_in_annaba)
+
+    def test_user_loaded_with_profile_city_and_country_in_one_query(self):
+        """
+        The backend loads the user, its profile, city and country at once,
+        without their geometries
+        """
+        with self.assertNumQueries(1):
+            user = ProfileModelBackend().get_user(self.volunteer.pk)
+            self.assertEqual(user.profile.account_type, 'volunteer')
+            self.assertEqual(user.profile.city.name, 'Oran')
+            self.assertEqual(user.profile.country.iso2, 'DZ')
+
+        self.assertEqual(user.profile.city.get_deferred_fields(), {'geom'})
+        self.assertEqual(user.profile.country.get_deferred_fields(), {'geom'})
+
+    def assertPagesNumQueries(self, pages):
+        for url, num in pages:
+            with self.subTest(url=url), self.assertNumQueries(num):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_main_pages_do_not_query_the_request_user_profile(self):
+        """
+        Across the main pages request.user.profile and its city and country
+        come with the user, each page runs the session and user queries and
+        its own queries only
+        """
+        # Cached by the first page otherwise, see notifications.counters
+        get_unread_count(self.volunteer)
+        get_unread_count(self.manager)
+
+        self.client.login(username='volunteer_user', password='qsdflkjlkj')
+        self.assertPagesNumQueries([
+            (reverse('home'), 2),
+            # Paginator count and page, no initiative open to volunteers
+            (reverse('initiatives-list'), 4),
+            # Initiative, volunteers count, creator, creator profile and city
+            (reverse('initiative-detail', kwargs={'pk': self.initiative.pk}), 7),
+            # Pending upgrade request
+            (reverse('profile'), 3),
+            # City choices
+            (reverse('profile-update'), 3),
+            # Feed rows, no notification
+            (reverse('notifications-list'), 3),
+        ])
+
+        self.client.login(username='manager_user', password='qsdflkjlkj')
+        self.assertPagesNumQueries([
+            # Initiative, creator and review of the manager (test_func), then
+            # initiative, creator, creator profile and city (page)
+            (reverse('initiative-review', kwargs={'pk': self.other_initiative.pk}), 9),
+            (reverse('create-initiative'), 2),
+        ])
+
+    def test_sessions_of_the_previous_backends_stay_logged_in(self):
+        """
+        Sessions opened with the default backends before the profile backends
+        are moved to the profile backends and stay authenticated, new logins
+        use the profile backends.
+        """
+        self.assertNotIn('django.contrib.auth.backends.ModelBackend', settings.AUTHENTICATION_BACKENDS)
+        self.client.force_login(self.volunteer, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['user'], self.volunteer)
+        self.assertEqual(self.client.session['_auth_user_backend'], 'users.backends.ProfileModelBackend')
+
+        self.client.force_login(self.volunteer, backend='allauth.account.auth_backends.AuthenticationBackend')
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.context['user'], self.volunteer)
+        self.assertEqual(self.client.session['_auth_user_backend'], 'users.backends.ProfileAuthenticationBackend')
+
+        self.client.logout()
+        self.client.login(username='volunteer_user', password='qsdflkjlkj')
+        self.assertEqual(self.client.session['_auth_user_backend'], 'users.backends.ProfileModelBackend')
@@ -0,0 +1,123 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from users.models import City, UpgradeRequest, UpgradeRequestReview
+from users.tests.test_utils import create_new_user
+from users.tasks import evaluate_upgrade_requests_task
+from notifications.models import Notification, NotificationPreference
+
+
+# Ovveriding prod spatial data with light weigth test layers to speed up tests
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES)
+class EvaluateUpgradeRequestsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(self):
+        call_command('load_spatial_layers', 'DZ')
+        self.annaba_city = City.objects.get(name='Annaba')
+        self.point_in_annaba = self.annaba_city.get_random_location_point()
+        self.managers = [create_new_user(email=f'manager_{i}@gmail.com',
+                                    username=f'manager_{i}',
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447766', 
+                                    bio='Some good bio',
+                                    account_type='manager',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    ) for i in range(6)]
+        self.review_ended = timezone.now() - timezone.timedelta(days=settings.UPGRADE_REQUEST_REVIEW_DURATION + 1)
+
+    def create_upgrade_request(self, username, approves=0, rejects=0, request_datetime=None):
+        """
+        Create a volunteer with an upgrade request reviewed by `approves` + `rejects` managers
+        """
+        volunteer = create_new_user(email=f'{username}@gmail.com',
+                                    username=username,
+                                    password='qsdflkjlkj',
+                                    phone_number='+213555447766', 
+                                    bio='Some good bio',
+                                    account_type='volunteer',
+                                    city=self.annaba_city,
+                                    geo_location=self.point_in_annaba,
+                                    )
+        upgrade_request = UpgradeRequest.objects.create(user=volunteer,
+                                                        motivation="Im a nice person...",
+                                                        request_datetime=request_datetime or self.review_ended)
+        votes = ['approve'] * approves + ['reject'] * rejects
+        UpgradeRequestReview.objects.bulk_create([
+            UpgradeRequestReview(upgrade_request=upgrade_request, manager=manager, vote=vote)
+            for manager, vote in zip(self.managers, votes)
+        ])
+        return upgrade_request
+
+    def test_upgrade_requests_outcomes(self):
+        """
+        Tests approved, rejected and not reviewed enough requests are evaluated,
+        approved users become managers and every user is notified.
+        """
+        approved = self.create_upgrade_request('approved_user', approves=4, rejects=2)
+        rejected = self.create_upgrade_request('rejected_user', approves=2, rejects=4)
+        ignored = self.create_upgrade_request('ignored_user', approves=1)
+        # Still in its review period
+        pending = self.create_upgrade_request('pending_user', approves=6, request_datetime=timezone.now())
+
+        evaluated = evaluate_upgrade_requests_task()
+
+        for upgrade_request in (approved, rejected, ignored, pending):
+            upgrade_request.refresh_from_db()
+            upgrade_request.user.profile.refresh_from_db()
+
+        self.assertEqual(evaluated, 3)
+        self.assertEqual(approved.status, 'approved')
+        self.assertEqual(approved.user.profile.account_type, 'manager')
+        self.assertEqual(rejected.status, 'rejected')
+        self.assertEqual(rejected.user.profile.account_type, 'volunteer')
+        self.assertEqual(ignored.status, 'rejected')
+        self.assertEqual(pending.status, 'pending')
+        self.assertEqual(pending.user.profile.account_type, 'volunteer')
+
+        approved_notification = Notification.objects.get(notification_type='upgrade_request_approved')
+        self.assertEqual(list(approved_notification.recipients.all()), [approved.user])
+        self.assertEqual(Notification.objects.get(notification_type='upgrade_request_rejected',
+                                                related_upgrade_request=rejected).message, 'rejected_by_managers')
+        self.assertEqual(Notification.objects.get(notification_type='upgrade_request_rejected',
+                                                related_upgrade_request=ignored).message, 'lack_of_reviews')
+        # Nothing left to evaluate
+        self.assertEqual(evaluate_upgrade_requests_task(), 0)
+
+    def test_upgrade_requests_evaluation_query_count_does_not_grow(self):
+        """
+        Tests that evaluating many requests costs the same number of queries as a few.
+        """
+        for i in range(2):
+            self.create_upgrade_request(f'first_batch_{i}', approves=5)
+        with CaptureQueriesContext(connection) as few_requests:
+            evaluate_upgrade_requests_task()
+
+        for i in range(10):
+            self.create_upgrade_request(f'second_batch_{i}', approves=3, rejects=3)
+        with CaptureQueriesContext(connection) as many_requests:
+            evaluate_upgrade_requests_task()
+
+        self.assertEqual(UpgradeRequest.objects.filter(status='pending').count(), 0)
+        self.assertEqual(len(many_requests.captured_queries), len(few_requests.captured_queries))
+
+    def test_upgrade_request_outcome_respects_in_app_preference(self):
+        """
+        Tests that a requester who turned the in-app channel off for the
+        outcome gets no delivery, the others still do.
+        """
+        muted = self.create_upgrade_request('muted_user', approves=5)
+        notified = self.create_upgrade_request('notified_user', approves=5)
+        NotificationPreference.objects.create(user=muted.user, notification_type='upgrade_request_approved',
+                                              in_app=False, email=False)
+
+        self.assertEqual(evaluate_upgrade_requests_task(), 2)
+
+        self.assertFalse(Notification.objects.get(related_upgrade_request=muted).recipients.exists())
+        self.assertEqual(list(Notification.objects.get(related_upgrade_request=notified).recipients.all()),
+                         [notified.user])
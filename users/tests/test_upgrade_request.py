@@ -13,7 +13,8 @@ from users.tests.test_utils import create_new_user, create_test_image, verify_em
 UserModel = get_user_model()
 
 # Ovveriding prod spatial data with light weigth test layers to speed up tests
-@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS)
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES)
 class UpgradeRequestTestCase(TestCase):
 
     @classmethod
@@ -1,19 +1,27 @@
+from io import StringIO
+from unittest import mock
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.management import call_command
 from django.core import mail
 from allauth.account.models import EmailAddress
 from django.test import Client, TestCase, override_settings
+from PIL import Image
 from django.urls import reverse
 from users.models import Profile, City
 from users.messages import users_messages
 from users.tests.test_utils import create_new_user, create_test_image, verify_email_address
+from users.tasks import generate_thumbnails_task
+from core.models import TaskOutbox
+from core.tests.test_utils import run_outbox_tasks
 
 
 UserModel = get_user_model()
 
 # Ovveriding prod spatial data with light weigth test layers to speed up tests
-@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS)
+@override_settings(SPATIAL_LAYER_PATHS=settings.TEST_SPATIAL_LAYER_PATHS,
+                   CACHES=settings.TEST_CACHES)
 class UserTestCase(TestCase):
 
     @classmethod
@@ -117,6 +125,144 @@ class UserTestCase(TestCase):
         self.assertEqual( new_user.profile.city, self.annaba_city)
         self.assertNotEqual( new_user.profile.profile_pic, '' )
 
+    def test_profile_pic_thumbnails_generated_once_by_task(self):
+        """
+        Uploading a profile picture enqueues the thumbnails task, which stores
+        the WebP and JPEG thumbnails under deterministic names, runs once per picture
+        """
+        user = create_new_user(email='thumbnails@gmail.com',
+                                username='thumbnails',
+                                password='qsdflkjlkj',
+                                phone_number='+213555447799',
+                                bio='Some good bio',
+                                city=self.annaba_city,
+                                geo_location=self.point_in_annaba,
+                                )
+        self.client_1.login(username='thumbnails', password='qsdflkjlkj')
+        self.client_1.post(reverse('profile-update'),
+                            {'profile_pic': create_test_image(size=(640, 480)),
+                            'city': str(self.annaba_city.pk),
+                            'bio': 'Some good bio',
+                            'phone_number': '0555447799',
+                            'username': 'thumbnails',
+                            })
+        profile = Profile.objects.get(user=user)
+        # Until the task runs the original picture is served
+        self.assertFalse(profile.has_thumbnails())
+        self.assertEqual(profile.get_profile_pic_64(), profile.profile_pic.url)
+
+        self.assertIn('users.tasks.generate_thumbnails_task', run_outbox_tasks())
+
+        profile.refresh_from_db()
+        self.assertTrue(profile.has_thumbnails())
+        self.assertTrue(profile.get_profile_pic_64().endswith('_64.jpg'))
+        self.assertTrue(profile.get_profile_pic_256_webp().endswith('_256.webp'))
+        storage = profile.profile_pic.storage
+        # Avatar URLs are joined to MEDIA_URL, the storage is not called
+        with mock.patch.object(type(storage), 'url', side_effect=AssertionError('storage called')):
+            urls = [profile.get_profile_pic_64(), profile.get_profile_pic_64_webp(),
+                    profile.get_profile_pic_256(), profile.get_profile_pic_256_webp()]
+        for url in urls:
+            self.assertTrue(storage.exists(url[len(settings.MEDIA_URL):]))
+        # Moving the media to a CDN needs no rebuild
+        with override_settings(MEDIA_URL='https://cdn.example.com/media/'):
+            self.assertEqual(profile.get_profile_pic_64(),
+                             'https://cdn.example.com/media/' + urls[0][len(settings.MEDIA_URL):])
+        self.assertFalse(generate_thumbnails_task.apply(args=(profile.id,)).get())
+
+    def test_thumbnails_backfilled_for_existing_pictures(self):
+        """
+        Tests that the generate_profile_thumbnails command enqueues the pictures
+        uploaded before thumbnails existed, and only those.
+        """
+        user = create_new_user(email='backfill@gmail.com',
+                                username='backfill',
+                                password='qsdflkjlkj',
+                                phone_number='+213555447798',
+                                bio='Some good bio',
+                                city=self.annaba_city,
+                                geo_location=self.point_in_annaba,
+                                )
+        self.client_1.login(username='backfill', password='qsdflkjlkj')
+        self.client_1.post(reverse('profile-update'),
+                            {'profile_pic': create_test_image(size=(640, 480)),
+                            'city': str(self.annaba_city.pk),
+                            'bio': 'Some good bio',
+                            'phone_number': '0555447798',
+                            'username': 'backfill',
+                            })
+        # A picture uploaded before the thumbnails, as left by migration 0009
+        TaskOutbox.objects.all().delete()
+        profile = Profile.objects.get(user=user)
+        self.assertFalse(profile.has_thumbnails())
+
+        call_command('generate_profile_thumbnails', stdout=StringIO())
+        self.assertEqual(run_outbox_tasks(), ['users.tasks.generate_thumbnails_task'])
+        profile.refresh_from_db()
+        self.assertTrue(profile.has_thumbnails())
+
+        call_command('generate_profile_thumbnails', stdout=StringIO())
+        self.assertEqual(run_outbox_tasks(), [])
+
+    @override_settings(PROFILE_PIC_MAX_DIMENSION=200)
+    def test_profile_pic_downscaled_and_stripped_on_upload(self):
+        """
+        The uploaded picture is oriented, downscaled and stored as a JPEG
+        without its EXIF metadata
+        """
+        user = create_new_user(email='ingest@gmail.com',
+                                username='ingest',
+                                password='qsdflkjlkj',
+                                phone_number='+213555447788',
+                                bio='Some good bio',
+                                city=self.annaba_city,
+                                geo_location=self.point_in_annaba,
+                                )
+        self.client_1.login(username='ingest', password='qsdflkjlkj')
+        # Landscape picture taken with the camera rotated (EXIF orientation 6)
+        response = self.client_1.post(reverse('profile-update'),
+                                        {'profile_pic': create_test_image(name='big.png', ext='PNG',
+                                                                          size=(600, 400), orientation=6),
+                                        'city': str(self.annaba_city.pk),
+                                        'bio': 'Some good bio',
+                                        'phone_number': '0555447788',
+                                        'username': 'ingest',
+                                        })
+        profile = Profile.objects.get(user=user)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(profile.profile_pic.name.endswith('.jpg'))
+        with profile.profile_pic.open('rb'), Image.open(profile.profile_pic) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (133, 200))
+            self.assertFalse(image.getexif())
+
+    @override_settings(PROFILE_PIC_MAX_PIXELS=100 * 100)
+    def test_profile_pic_with_too_many_pixels_rejected(self):
+        """
+        Pictures above PROFILE_PIC_MAX_PIXELS (decompression bombs) are rejected
+        """
+        user = create_new_user(email='bomb@gmail.com',
+                                username='bomb',
+                                password='qsdflkjlkj',
+                                phone_number='+213555447722',
+                                bio='Some good bio',
+                                city=self.annaba_city,
+                                geo_location=self.point_in_annaba,
+                                )
+        self.client_1.login(username='bomb', password='qsdflkjlkj')
+        response = self.client_1.post(reverse('profile-update'),
+                                        {'profile_pic': create_test_image(size=(101, 100)),
+                                        'city': str(self.annaba_city.pk),
+                                        'bio': 'Some good bio',
+                                        'phone_number': '0555447722',
+                                        'username': 'bomb',
+                                        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, users_messages['PROFILE_PIC_TOO_MANY_PIXELS'])
+        self.assertFalse(Profile.objects.get(user=user).profile_pic)
+
     def test_redirect_when_profile_not_created(self):
         """
         Users without a profile are redirected from 'profile'
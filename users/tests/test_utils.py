@@ -24,13 +24,17 @@ def create_new_user(email, username, password, phone_number, bio, account_type='
     return user
 
 
-def create_test_image(name='test.jpg', ext='JPEG', size=(100, 100), color=(255, 0, 0)):
+def create_test_image(name='test.jpg', ext='JPEG', size=(100, 100), color=(255, 0, 0), orientation=None):
     """
-    Helper function that returns an image file that will be used in tests
+    Helper function that returns an image file that will be used in tests,
+    with an EXIF orientation tag if `orientation` is given
     """
     file = BytesIO()
     image = Image.new('RGB', size, color)
-    image.save(file, ext)
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    image.save(file, ext, exif=exif)
     file.seek(0)
     return SimpleUploadedFile(name, file.read(), content_type='image/jpeg')
 
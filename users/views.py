@@ -1,6 +1,7 @@
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
 from django.utils.translation import gettext as _
@@ -12,6 +13,8 @@ from users.forms import (ProfileCreationForm,
                         ProfileUpdateForm, 
                         UpgradeRequestForm)
 from users.messages import users_messages
+from users.tasks import generate_thumbnails_task
+from core.outbox import enqueue_task
 
 UserModel = get_user_model()
 
@@ -35,7 +38,10 @@ class ProfileCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         profile = form.save(commit=False)
         profile.country = Country.objects.get(iso2='DZ')
         profile.account_type = 'volunteer'
-        profile.save()
+        with transaction.atomic():
+            profile.save()
+            if profile.profile_pic:
+                enqueue_task(generate_thumbnails_task, profile.id)
         messages.success( self.request, users_messages['ACCOUNT_CREATED_SUCCESS'])
         return super().form_valid(form)
 
@@ -66,8 +72,11 @@ class ProfileUpdateView(LoginRequiredMixin, TemplateView):
         profile_form = ProfileUpdateForm(request.POST, request.FILES, instance=request.user.profile)
 
         if user_form.is_valid() and profile_form.is_valid():
-            user_form.save()
-            profile_form.save()
+            with transaction.atomic():
+                user_form.save()
+                profile = profile_form.save()
+                if 'profile_pic' in profile_form.changed_data and profile.profile_pic:
+                    enqueue_task(generate_thumbnails_task, profile.id)
             messages.success(self.request, users_messages['PROFILE_UPDATE_SUCCESS'])
             return redirect('profile')
 
@@ -123,7 +132,10 @@ class UpgradeRequestView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         # Otherwise, allow
         return True
 
+    @transaction.atomic
     def form_valid(self, form):
+        # Atomic so the upgrade request, its notification and the fan-out
+        # task (see core.outbox) are saved together
         form.instance.user = self.request.user
         messages.success( self.request, users_messages['UPGRADE_REQUEST_SUBMITTED'])
         return super().form_valid(form)
\ No newline at end of file